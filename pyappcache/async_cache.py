@@ -0,0 +1,227 @@
+import asyncio
+import io
+import shutil
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from logging import getLogger
+from pathlib import Path
+from typing import Optional, TypeVar, Any, cast, Callable, Awaitable, IO
+
+from .cache import BaseCache, Cache
+from .compression import Compressor, GZIPCompressor
+from .serialisation import Serialiser, PickleSerialiser
+from .keys import Key, build_raw_key
+from .sqlite_lru import SqliteCache
+from .fs import FilesystemCache
+
+V = TypeVar("V")
+T = TypeVar("T")
+
+
+logger = getLogger(__name__)
+
+
+class AsyncCache(BaseCache, metaclass=ABCMeta):
+    """The asyncio counterpart of :class:`~pyappcache.cache.Cache`.
+
+    The interface is the same, except that every method which touches the
+    backend is a coroutine."""
+
+    DEFAULT_PREFIX = Cache.DEFAULT_PREFIX
+
+    def __init__(self, prefix=DEFAULT_PREFIX):
+        #: A prefix that will be applied to cache keys, as with
+        #: :attr:`Cache.prefix <pyappcache.cache.Cache.prefix>`.
+        self.prefix = prefix
+        #: The compressor that will be used when a key asks for compression.
+        self.compressor: Compressor = GZIPCompressor()
+        #: The serialiser used to turn Python objects back and forth into bytes.
+        self.serialiser: Serialiser = PickleSerialiser()
+
+    async def get(self, key: Key[V]) -> Optional[V]:
+        """Look up the value stored under a :class:`~pyappcache.keys.Key` instance"""
+        namespace_key = key.namespace_key()
+        if namespace_key is not None:
+            namespace = await self.lookup_namespace(namespace_key)
+            if namespace is None:
+                return None
+        else:
+            namespace = None
+
+        cache_contents = await self.get_raw(
+            build_raw_key(self.prefix, key, namespace=namespace)
+        )
+        if cache_contents is not None:
+            return cast(V, self._load(cache_contents))
+        else:
+            return None
+
+    async def get_by_str(self, key_str: str) -> Optional[Any]:
+        """Look up the value stored under a :class:`str`."""
+        cache_contents = await self.get_raw(build_raw_key(self.prefix, key_str))
+        if cache_contents is not None:
+            return self._load(cache_contents)
+        else:
+            return None
+
+    async def get_via(
+        self, key: Key[V], getter: Callable[[], Awaitable[V]], ttl_seconds: int = 0
+    ) -> V:
+        """Look up a value, awaiting the getter and caching the result on a
+        miss."""
+        cache_contents = await self.get(key)
+        if cache_contents is None:
+            new_cache_contents = await getter()
+            await self.set(key, new_cache_contents, ttl_seconds)
+            return new_cache_contents
+        else:
+            return cache_contents
+
+    async def lookup_namespace(self, key: Key) -> Optional[str]:
+        namespace = await self.get(key)
+        if namespace is not None:
+            return str(namespace)
+        else:
+            return None
+
+    async def set(self, key: Key[V], value: V, ttl_seconds: int = 0) -> None:
+        """Set a value by :class:`~pyappcache.keys.Key`"""
+        namespace_key = key.namespace_key()
+        if namespace_key is not None:
+            namespace = await self.lookup_namespace(namespace_key)
+            if namespace is None:
+                logger.warning("unable to set key as namespace does not exist")
+                return None
+        else:
+            namespace = None
+        await self.set_raw(
+            build_raw_key(self.prefix, key, namespace=namespace),
+            self._dump(value, key),
+            ttl_seconds,
+        )
+
+    async def set_by_str(
+        self, key_str: str, value: V, ttl_seconds: int = 0, compress: bool = False
+    ) -> None:
+        """Set a value by a :class:`str`."""
+        await self.set_raw(
+            build_raw_key(self.prefix, key_str),
+            self._dump(value, compress=compress),
+            ttl_seconds,
+        )
+
+    async def invalidate(self, key: Key[V]) -> None:
+        """Invalidate by :class:`~pyappcache.keys.Key`."""
+        namespace_key = key.namespace_key()
+        if namespace_key is not None:
+            namespace = await self.lookup_namespace(namespace_key)
+            if namespace is None:
+                logger.warning("unable to invalidate key as namespace does not exist")
+                return None
+        else:
+            namespace = None
+        await self.invalidate_raw(build_raw_key(self.prefix, key, namespace=namespace))
+
+    async def invalidate_by_str(self, key_str: str) -> None:
+        await self.invalidate_raw(build_raw_key(self.prefix, key_str))
+
+    @abstractmethod
+    async def get_raw(self, key_str: str) -> Optional[IO[bytes]]:
+        """Look up a value (as bytes) from a concrete key string."""
+        pass  # pragma: no cover
+
+    @abstractmethod
+    async def set_raw(
+        self, key_str: str, value_bytes: IO[bytes], ttl_seconds: int
+    ) -> None:
+        """Set a value (as bytes) by a concrete key string."""
+        pass  # pragma: no cover
+
+    @abstractmethod
+    async def invalidate_raw(self, key_str: str) -> None:
+        """Invalidate a key by a concrete key string."""
+        pass  # pragma: no cover
+
+    @abstractmethod
+    async def clear(self) -> None:
+        """Remove all keys from the cache."""
+        pass  # pragma: no cover
+
+
+class ThreadedAsyncCache(AsyncCache):
+    """An :class:`AsyncCache` which runs the raw operations of an ordinary,
+    blocking, :class:`~pyappcache.cache.Cache` on a worker thread so that they
+    don't block the event loop.
+
+    The blocking cache is created by calling ``cache_factory`` on the worker
+    thread.  There is exactly one worker thread per instance, so caches that
+    hold thread-bound resources (such as sqlite connections) work.
+
+    """
+
+    def __init__(self, cache_factory: Callable[[], Cache]):
+        """
+
+        :param cache_factory: A callable, taking no arguments, that returns the
+            blocking cache to wrap."""
+        super().__init__()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pyappcache"
+        )
+        #: The wrapped, blocking, cache
+        self.cache: Cache = self._executor.submit(cache_factory).result()
+        self.prefix = self.cache.prefix
+
+    async def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, *args))
+
+    def _get_raw_into_memory(self, key_str: str) -> Optional[IO[bytes]]:
+        # Some caches return open files - read them on the worker thread too
+        cache_contents = self.cache.get_raw(key_str)
+        if cache_contents is None or isinstance(cache_contents, io.BytesIO):
+            return cache_contents
+        with cache_contents:
+            buf = io.BytesIO()
+            shutil.copyfileobj(cache_contents, buf)
+        buf.seek(0)
+        return buf
+
+    async def get_raw(self, key_str: str) -> Optional[IO[bytes]]:
+        return await self._run(self._get_raw_into_memory, key_str)
+
+    async def set_raw(
+        self, key_str: str, value_bytes: IO[bytes], ttl_seconds: int
+    ) -> None:
+        await self._run(self.cache.set_raw, key_str, value_bytes, ttl_seconds)
+
+    async def invalidate_raw(self, key_str: str) -> None:
+        await self._run(self.cache.invalidate_raw, key_str)
+
+    async def clear(self) -> None:
+        await self._run(self.cache.clear)
+
+    def close(self) -> None:
+        """Shut down the worker thread."""
+        self._executor.shutdown(wait=True)
+
+
+class AsyncSqliteCache(ThreadedAsyncCache):
+    """An asyncio wrapper for :class:`~pyappcache.sqlite_lru.SqliteCache`.
+
+    Takes the same arguments as :class:`~pyappcache.sqlite_lru.SqliteCache`.
+    If you pass a connection, it must have been opened with
+    ``check_same_thread=False`` as it will be used from the worker thread.
+
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(lambda: SqliteCache(*args, **kwargs))
+
+
+class AsyncFilesystemCache(ThreadedAsyncCache):
+    """An asyncio wrapper for :class:`~pyappcache.fs.FilesystemCache`."""
+
+    def __init__(self, directory: Path, **kwargs: Any):
+        super().__init__(lambda: FilesystemCache(directory, **kwargs))
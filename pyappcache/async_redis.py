@@ -0,0 +1,50 @@
+import io
+from typing import Optional, cast, IO
+from logging import getLogger
+
+from redis import asyncio as redis_asyncio
+
+from .async_cache import AsyncCache
+
+logger = getLogger(__name__)
+
+
+class AsyncRedisCache(AsyncCache):
+    """An asyncio redis :class:`~pyappcache.async_cache.AsyncCache`, using
+    ``redis.asyncio`` (redis-py 4.2+).
+
+    As with :class:`~pyappcache.redis.RedisCache`, :meth:`clear` will call
+    ``FLUSHDB``.
+
+    """
+
+    def __init__(self, client: Optional[redis_asyncio.Redis] = None):
+        """
+
+        :param client: A optional asyncio redis client to use.  If one isn't
+            provided database 0 on localhost is used."""
+        super().__init__()
+        if client is not None:
+            self._redis = client
+        else:
+            self._redis = redis_asyncio.Redis()
+
+    async def get_raw(self, raw_key: str) -> Optional[IO[bytes]]:
+        value = await self._redis.get(raw_key)
+        if value is not None:
+            return io.BytesIO(cast(bytes, value))
+        else:
+            return None
+
+    async def set_raw(
+        self, raw_key: str, value_bytes: IO[bytes], ttl_seconds: int
+    ) -> None:
+        await self._redis.set(
+            raw_key, value_bytes.read(), ex=ttl_seconds if ttl_seconds != 0 else None
+        )
+
+    async def invalidate_raw(self, raw_key: str) -> None:
+        await self._redis.delete(raw_key)
+
+    async def clear(self) -> None:
+        await self._redis.flushdb()
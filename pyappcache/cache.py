@@ -1,10 +1,35 @@
 from abc import ABCMeta, abstractmethod
 from logging import getLogger
-from typing import Optional, TypeVar, Any, cast, Callable, Sequence, Mapping, IO
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic, sleep, time
+from uuid import uuid4
+from typing import (
+    Optional,
+    TypeVar,
+    Any,
+    cast,
+    Callable,
+    Sequence,
+    Mapping,
+    IO,
+    List,
+    Dict,
+    Set,
+    Tuple,
+)
 
-from .compression import Compressor, GZIPCompressor
+from .compression import (
+    Compressor,
+    DecompressionError,
+    GZIPCompressor,
+    get_compressor_for,
+)
 from .serialisation import Serialiser, PickleSerialiser
 from .keys import Key, build_raw_key
+from .envelope import Envelope
+from .lru import LRU
+from .singleflight import SingleFlight
 
 V = TypeVar("V")
 
@@ -12,75 +37,348 @@ V = TypeVar("V")
 logger = getLogger(__name__)
 
 
-class Cache(metaclass=ABCMeta):
+class BaseCache:
+    """Behaviour shared between :class:`Cache` and
+    :class:`~pyappcache.async_cache.AsyncCache`."""
+
+    compressor: Compressor
+    serialiser: Serialiser
+
+    def _load(self, cache_contents: IO[bytes]) -> Any:
+        """Decompress (if required) and deserialise a cached value."""
+        return self._load_enveloped(cache_contents)[0]
+
+    def _load_enveloped(
+        self, cache_contents: IO[bytes]
+    ) -> Tuple[Any, Optional[Envelope]]:
+        """As :meth:`_load`, but also return the value's envelope, if it has
+        one."""
+        envelope, payload = Envelope.unwrap(cache_contents)
+        if payload is None:
+            return None, None
+        cache_contents = payload
+        compressor = get_compressor_for(cache_contents, self.compressor)
+        if compressor is not None:
+            try:
+                cache_contents = compressor.decompress(cache_contents)
+            except DecompressionError as e:
+                logger.warning("unable to decompress value: %s", e)
+                return None, None
+        return self.serialiser.load(cache_contents), envelope
+
+    def _dump(
+        self,
+        value: Any,
+        key: Optional[Key] = None,
+        compress: bool = False,
+        envelope: Optional[Envelope] = None,
+    ) -> IO[bytes]:
+        """Serialise and (if the key or caller asks for it) compress a value,
+        optionally in an envelope."""
+        as_pickle = self.serialiser.dump(value)
+        compressor = self.compressor
+        if key is not None:
+            compress = key.should_compress(value, as_pickle)
+            compressor = getattr(key, "compressor", None) or compressor
+        if compress:
+            as_bytes = compressor.compress(as_pickle)
+        else:
+            as_bytes = as_pickle
+        if envelope is not None:
+            return envelope.wrap(as_bytes)
+        else:
+            return as_bytes
+
+
+class Cache(BaseCache, metaclass=ABCMeta):
     """The standard, cross backend, interface to a cache."""
 
     DEFAULT_PREFIX = "pyappcache"
 
+    DEFAULT_NAMESPACE_CACHE_SIZE = 1000
+
+    #: Appended to a raw key to get the key of its lease
+    LEASE_SUFFIX = "#lease"
+
+    #: Longest time to wait between polls when another process holds a lease
+    MAX_LEASE_POLL_SECONDS = 1.0
+
     def __init__(self, prefix=DEFAULT_PREFIX):
         #: A prefix that will be applied to cache keys to allow for multiple
         #: instances of this class to co-exist.  Exact use varies by particular
         #: cache.  Default is `'pyappcache'`.
         self.prefix = prefix
-        #: The compressor that will be used when a key asks for compression.
-        #: Default is gzip via :class:`.compression.GZIPCompressor`
+        #: The compressor that will be used when a key asks for compression
+        #: (unless the key has its own ``compressor``).  Default is gzip via
+        #: :class:`.compression.GZIPCompressor`.  Values compressed with any
+        #: registered :class:`.compression.TaggedCompressor` (or gzip) can be
+        #: read whatever this is set to.
         self.compressor: Compressor = GZIPCompressor()
         #: The serialiers that will be used to turn Python objects back and
         #: forth into bytes.  The default serialiser is pickle, via
         #: :class:`.serialisation.PickleSerialiser`
         self.serialiser: Serialiser = PickleSerialiser()
+        #: How long, in seconds, resolved namespaces are remembered in-process.
+        #: The default, 0, is "strict": namespaces are read from the cache on
+        #: every operation on a namespaced key.  Setting this higher is
+        #: "relaxed": it saves a cache read per operation but means that a
+        #: namespace changed by *another* process may not be noticed for up to
+        #: this many seconds.  Changes made via this instance are always
+        #: noticed immediately.
+        self.namespace_ttl_seconds: float = 0
+        self._namespaces = LRU(self.DEFAULT_NAMESPACE_CACHE_SIZE)
+        #: How long, in seconds, :meth:`get_via` will wait for another thread
+        #: that is already calling the getter for the same key.  If the wait
+        #: times out the getter is called anyway.  None means wait forever.
+        self.get_via_wait_seconds: Optional[float] = 30
+        self._flights = SingleFlight()
+        #: If set, :meth:`get_via` takes a lease (a short-lived lock, stored in
+        #: the cache itself) before calling the getter, so that only one
+        #: process recomputes a missing value.  Other processes poll the
+        #: cache until the value appears - or the lease expires, at which
+        #: point they call the getter themselves.  The lease should outlast
+        #: the getter.  Default is None: no leases.
+        self.lease_ttl_seconds: Optional[float] = None
+        #: How long to wait before the first poll for a value that another
+        #: process holds the lease for.  The wait doubles on each poll.
+        self.lease_poll_seconds: float = 0.05
+        #: Maximum number of threads used to refresh stale values in the
+        #: background (see the ``soft_ttl_seconds`` argument of
+        #: :meth:`get_via`)
+        self.refresh_max_workers = 4
+        self._refresh_pool: Optional[ThreadPoolExecutor] = None
+        self._refresh_lock = Lock()
+        self._refreshing: Set[str] = set()
+
+    @property
+    def namespace_cache_size(self) -> int:
+        """The maximum number of resolved namespaces remembered when
+        :attr:`namespace_ttl_seconds` is set.  Default is 1000."""
+        return self._namespaces.max_size
+
+    @namespace_cache_size.setter
+    def namespace_cache_size(self, namespace_cache_size: int) -> None:
+        self._namespaces.max_size = namespace_cache_size
 
     def get(self, key: Key[V]) -> Optional[V]:
         """Look up the value stored under a :class:`~pyappcache.keys.Key` instance"""
-        namespace_key = key.namespace_key()
-        if namespace_key is not None:
-            namespace = self.lookup_namespace(namespace_key)
-            if namespace is None:
-                return None
-        else:
-            namespace = None
-
-        cache_contents = self.get_raw(
-            build_raw_key(self.prefix, key, namespace=namespace)
-        )
-        if cache_contents is not None:
-            if self.compressor.is_compressed(cache_contents):
-                cache_contents = self.compressor.decompress(cache_contents)
-            return cast(V, self.serialiser.load(cache_contents))
-        else:
+        raw_key = self._build_raw_key(key)
+        if raw_key is None:
             return None
+        return cast(Optional[V], self._get_value(raw_key))
 
     def get_by_str(self, key_str: str) -> Optional[Any]:
         """Look up the value stored under a :class:`str`.
 
         Users of this method will have to construct string keys for themselves."""
-        cache_contents = self.get_raw(build_raw_key(self.prefix, key_str))
-        if cache_contents is not None:
-            if self.compressor.is_compressed(cache_contents):
-                cache_contents = self.compressor.decompress(cache_contents)
-            return self.serialiser.load(cache_contents)
-        else:
-            return None
+        return self._get_value(build_raw_key(self.prefix, key_str))
+
+    def get_many(self, keys: Sequence[Key[V]]) -> List[Optional[V]]:
+        """Look up the values stored under many :class:`~pyappcache.keys.Key`
+        instances at once.
+
+        Returns a list of values (or None, for misses) in the same order as
+        the keys.  Backends that support it will do this in a single round
+        trip."""
+        raw_keys = self._build_raw_keys(keys)
+        unique_raw_keys = list(
+            dict.fromkeys(raw_key for raw_key in raw_keys if raw_key is not None)
+        )
+        values = self._get_values(unique_raw_keys)
+        return [
+            values.get(raw_key) if raw_key is not None else None for raw_key in raw_keys
+        ]
 
-    def get_via(self, key: Key[V], getter: Callable[[], V]) -> V:
-        cache_contents = self.get(key)
-        if cache_contents is None:
+    def get_via(
+        self,
+        key: Key[V],
+        getter: Callable[[], V],
+        ttl_seconds: int = 0,
+        soft_ttl_seconds: Optional[float] = None,
+    ) -> V:
+        """Look up a value, calling ``getter`` and caching the result if it
+        isn't present.
+
+        If several threads miss on the same key at once, only one of them
+        calls the getter - the others wait (for up to
+        :attr:`get_via_wait_seconds`) and use its result.  If the getter
+        raises, the waiting threads get the same exception.
+
+        If ``soft_ttl_seconds`` is given, values older than that are still
+        returned straight away but are also refreshed, by calling the getter
+        on a background thread (see :attr:`refresh_max_workers`).  There is at
+        most one refresh in progress per key at a time.
+
+        If the key has an ``xfetch_beta`` (see
+        :attr:`~pyappcache.keys.BaseKey.xfetch_beta`) then the time taken by
+        the getter is recorded and values may also be refreshed in the
+        background shortly before their (hard) TTL is up.
+
+        """
+        raw_key = self._build_raw_key(key)
+        xfetch_beta: Optional[float] = getattr(key, "xfetch_beta", None)
+
+        def get_and_set() -> V:
+            started = monotonic()
             new_cache_contents = getter()
-            self.set(key, new_cache_contents)
+            if xfetch_beta is not None and ttl_seconds != 0:
+                delta: Optional[float] = monotonic() - started
+            else:
+                delta = None
+            envelope = _make_envelope(ttl_seconds, soft_ttl_seconds, delta)
+            self._set(key, new_cache_contents, ttl_seconds, envelope)
             return new_cache_contents
+
+        if raw_key is None:
+            return get_and_set()
+
+        cache_contents, envelope = self._get_enveloped_value(raw_key)
+        if cache_contents is not None:
+            if envelope is not None and (
+                envelope.is_stale()
+                or (
+                    xfetch_beta is not None
+                    and envelope.should_refresh_early(xfetch_beta)
+                )
+            ):
+                self._schedule_refresh(raw_key, get_and_set)
+            return cast(V, cache_contents)
+
+        if self.lease_ttl_seconds is not None:
+            leased_key = raw_key
+
+            def via_lease() -> V:
+                return self._get_via_lease(leased_key, get_and_set)
+
+            return self._flights.do(raw_key, via_lease, self.get_via_wait_seconds)
         else:
-            return cache_contents
+            return self._flights.do(raw_key, get_and_set, self.get_via_wait_seconds)
+
+    def _schedule_refresh(self, raw_key: str, get_and_set: Callable[[], Any]) -> None:
+        """Call get_and_set on the refresh pool, unless a refresh of raw_key
+        is already pending."""
+        with self._refresh_lock:
+            if raw_key in self._refreshing:
+                return
+            self._refreshing.add(raw_key)
+            if self._refresh_pool is None:
+                self._refresh_pool = ThreadPoolExecutor(
+                    max_workers=self.refresh_max_workers,
+                    thread_name_prefix="pyappcache-refresh",
+                )
+            pool = self._refresh_pool
+        pool.submit(self._refresh, raw_key, get_and_set)
+
+    def _refresh(self, raw_key: str, get_and_set: Callable[[], Any]) -> None:
+        try:
+            if self.lease_ttl_seconds is None:
+                get_and_set()
+                return
+            # If another process is already refreshing it then leave it to
+            # them and keep serving the stale value
+            lease_key = raw_key + self.LEASE_SUFFIX
+            token = uuid4().hex
+            if not self.acquire_lease_raw(lease_key, token, self.lease_ttl_seconds):
+                logger.debug("%s is being refreshed elsewhere", raw_key)
+                return
+            try:
+                get_and_set()
+            finally:
+                self.release_lease_raw(lease_key, token)
+        except Exception:
+            logger.exception("background refresh of %s failed", raw_key)
+        finally:
+            with self._refresh_lock:
+                self._refreshing.discard(raw_key)
+
+    def _get_via_lease(self, raw_key: str, get_and_set: Callable[[], V]) -> V:
+        """Call get_and_set while holding the lease for raw_key - or, if
+        another process holds it, poll until that process has set the
+        value."""
+        lease_ttl_seconds = cast(float, self.lease_ttl_seconds)
+        lease_key = raw_key + self.LEASE_SUFFIX
+        token = uuid4().hex
+        give_up_at = monotonic() + lease_ttl_seconds
+        poll_seconds = self.lease_poll_seconds
+        while True:
+            if self.acquire_lease_raw(lease_key, token, lease_ttl_seconds):
+                try:
+                    # Someone else may have set it between our miss and now
+                    cache_contents = self._get_value(raw_key)
+                    if cache_contents is not None:
+                        return cast(V, cache_contents)
+                    return get_and_set()
+                finally:
+                    self.release_lease_raw(lease_key, token)
+            if monotonic() >= give_up_at:
+                logger.warning("lease for %s was not released, ignoring it", raw_key)
+                return get_and_set()
+            sleep(poll_seconds)
+            poll_seconds = min(poll_seconds * 2, self.MAX_LEASE_POLL_SECONDS)
+            cache_contents = self._get_value(raw_key)
+            if cache_contents is not None:
+                return cast(V, cache_contents)
 
     def lookup_namespace(self, key: Key) -> Optional[str]:
-        # FIXME: is this required?
+        """Resolve a namespace key to the current namespace (or None if it
+        doesn't exist).
+
+        Uses the in-process namespace cache if :attr:`namespace_ttl_seconds`
+        is set."""
+        if self.namespace_ttl_seconds == 0:
+            return self._read_namespace(key)
+        raw_key = build_raw_key(self.prefix, key)
+        entry = self._namespaces.get(raw_key)
+        if entry is not None:
+            return cast(Optional[str], entry.value)
+        namespace = self._read_namespace(key)
+        self._namespaces.set(raw_key, namespace, self.namespace_ttl_seconds)
+        return namespace
+
+    def _read_namespace(self, key: Key) -> Optional[str]:
         namespace = self.get(key)
         if namespace is not None:
             return str(namespace)
         else:
             return None
 
-    def set(self, key: Key[V], value: V, ttl_seconds: int = 0) -> None:
-        """Set a value by :class:`~pyappcache.keys.Key`"""
+    def _forget_namespaces(self, raw_keys: Sequence[str]) -> None:
+        """Drop raw keys (which may be namespace keys) from the in-process
+        namespace cache, as they've been changed by this process."""
+        if len(self._namespaces) > 0:
+            self._namespaces.pop_many(raw_keys)
+
+    def _forget_all_namespaces(self) -> None:
+        """Empty the in-process namespace cache, as the cache has been
+        cleared."""
+        self._namespaces.clear()
+
+    def set(
+        self,
+        key: Key[V],
+        value: V,
+        ttl_seconds: int = 0,
+        soft_ttl_seconds: Optional[float] = None,
+    ) -> None:
+        """Set a value by :class:`~pyappcache.keys.Key`
+
+        :param ttl_seconds: The (hard) TTL, after which the value is gone.  0
+            (the default) means no expiry.
+        :param soft_ttl_seconds: Optionally, a "soft" TTL, after which
+            :meth:`get_via` will still return the value but will refresh it in
+            the background.  Should be shorter than the hard TTL.
+        """
+        self._set(
+            key, value, ttl_seconds, _make_envelope(ttl_seconds, soft_ttl_seconds)
+        )
+
+    def _set(
+        self,
+        key: Key[V],
+        value: V,
+        ttl_seconds: int,
+        envelope: Optional[Envelope],
+    ) -> None:
         namespace_key = key.namespace_key()  # FIXME: move this inside lookup_namespace
         if namespace_key is not None:
             namespace = self.lookup_namespace(namespace_key)
@@ -89,14 +387,25 @@ class Cache(metaclass=ABCMeta):
                 return None
         else:
             namespace = None
-        as_pickle = self.serialiser.dump(value)
-        if key.should_compress(value, as_pickle):
-            as_bytes = self.compressor.compress(as_pickle)
-        else:
-            as_bytes = as_pickle
-        self.set_raw(
-            build_raw_key(self.prefix, key, namespace=namespace), as_bytes, ttl_seconds
-        )
+        raw_key = build_raw_key(self.prefix, key, namespace=namespace)
+        self._set_value(raw_key, value, ttl_seconds, key=key, envelope=envelope)
+        self._forget_namespaces([raw_key])
+
+    def set_many(self, mapping: Mapping[Key[V], V], ttl_seconds: int = 0) -> None:
+        """Set many values by :class:`~pyappcache.keys.Key` at once.
+
+        All values are given the same TTL.  Keys whose namespace does not exist
+        are skipped."""
+        keys = list(mapping.keys())
+        values: Dict[str, Tuple[Any, Key]] = {}
+        for key, raw_key in zip(keys, self._build_raw_keys(keys)):
+            if raw_key is None:
+                logger.warning("unable to set key as namespace does not exist")
+                continue
+            values[raw_key] = (mapping[key], key)
+        if values:
+            self._set_values(values, ttl_seconds)
+            self._forget_namespaces(list(values.keys()))
 
     def set_via(
         self,
@@ -115,17 +424,9 @@ class Cache(metaclass=ABCMeta):
         self, key_str: str, value: V, ttl_seconds: int = 0, compress: bool = False
     ) -> None:
         """Set a value by a :class:`str`."""
-        as_pickle = self.serialiser.dump(value)
-        if compress:
-            as_bytes = self.compressor.compress(as_pickle)
-        else:
-            as_bytes = as_pickle
         raw_key = build_raw_key(self.prefix, key_str)
-        self.set_raw(
-            raw_key,
-            as_bytes,
-            ttl_seconds,
-        )
+        self._set_value(raw_key, value, ttl_seconds, compress=compress)
+        self._forget_namespaces([raw_key])
 
     def invalidate(self, key: Key[V]) -> None:
         """Invalidate by :class:`~pyappcache.keys.Key`.
@@ -140,10 +441,146 @@ class Cache(metaclass=ABCMeta):
                 return None
         else:
             namespace = None
-        self.invalidate_raw(build_raw_key(self.prefix, key, namespace=namespace))
+        raw_key = build_raw_key(self.prefix, key, namespace=namespace)
+        self.invalidate_raw(raw_key)
+        self._forget_namespaces([raw_key])
+
+    def invalidate_many(self, keys: Sequence[Key[V]]) -> None:
+        """Invalidate many :class:`~pyappcache.keys.Key` instances at once.
+
+        Keys whose namespace does not exist are skipped."""
+        raw_keys = []
+        for raw_key in self._build_raw_keys(keys):
+            if raw_key is None:
+                logger.warning("unable to invalidate key as namespace does not exist")
+            else:
+                raw_keys.append(raw_key)
+        if raw_keys:
+            self.invalidate_many_raw(raw_keys)
+            self._forget_namespaces(raw_keys)
 
     def invalidate_by_str(self, key_str: str) -> None:
-        self.invalidate_raw(build_raw_key(self.prefix, key_str))
+        raw_key = build_raw_key(self.prefix, key_str)
+        self.invalidate_raw(raw_key)
+        self._forget_namespaces([raw_key])
+
+    def _build_raw_key(self, key: Key) -> Optional[str]:
+        """Build the raw key for a key, or return None if its namespace does
+        not exist."""
+        namespace_key = key.namespace_key()
+        if namespace_key is not None:
+            namespace = self.lookup_namespace(namespace_key)
+            if namespace is None:
+                return None
+        else:
+            namespace = None
+        return build_raw_key(self.prefix, key, namespace=namespace)
+
+    def _build_raw_keys(self, keys: Sequence[Key]) -> List[Optional[str]]:
+        """Build the raw keys for many keys, looking up each distinct namespace
+        only once.
+
+        Keys whose namespace does not exist get None instead of a raw key."""
+        namespace_keys: Dict[str, Key] = {}
+        namespace_raw_keys: List[Optional[str]] = []
+        for key in keys:
+            namespace_key = key.namespace_key()
+            if namespace_key is not None:
+                raw_namespace_key = build_raw_key(self.prefix, namespace_key)
+                namespace_keys.setdefault(raw_namespace_key, namespace_key)
+                namespace_raw_keys.append(raw_namespace_key)
+            else:
+                namespace_raw_keys.append(None)
+
+        namespaces = self._lookup_namespaces(namespace_keys)
+
+        raw_keys: List[Optional[str]] = []
+        for key, namespace_raw_key in zip(keys, namespace_raw_keys):
+            if namespace_raw_key is None:
+                raw_keys.append(build_raw_key(self.prefix, key))
+            else:
+                namespace = namespaces[namespace_raw_key]
+                if namespace is None:
+                    raw_keys.append(None)
+                else:
+                    raw_keys.append(
+                        build_raw_key(self.prefix, key, namespace=namespace)
+                    )
+        return raw_keys
+
+    def _lookup_namespaces(self, namespace_keys: Dict[str, Key]) -> Dict[str, Any]:
+        """Resolve many namespaces at once (using the in-process namespace
+        cache if enabled).  Takes and returns dicts keyed by raw key."""
+        namespaces: Dict[str, Any] = {}
+        if self.namespace_ttl_seconds != 0:
+            for raw_key in list(namespace_keys.keys()):
+                entry = self._namespaces.get(raw_key)
+                if entry is not None:
+                    namespaces[raw_key] = entry.value
+            namespace_keys = {
+                raw_key: key
+                for raw_key, key in namespace_keys.items()
+                if raw_key not in namespaces
+            }
+        if len(namespace_keys) > 0:
+            for raw_key, namespace in zip(
+                namespace_keys.keys(), self.get_many(list(namespace_keys.values()))
+            ):
+                if namespace is not None:
+                    namespace = str(namespace)
+                namespaces[raw_key] = namespace
+                if self.namespace_ttl_seconds != 0:
+                    self._namespaces.set(raw_key, namespace, self.namespace_ttl_seconds)
+        return namespaces
+
+    def _get_value(self, raw_key: str) -> Optional[Any]:
+        """Look up and deserialise the value stored under a raw key."""
+        return self._get_enveloped_value(raw_key)[0]
+
+    def _get_enveloped_value(
+        self, raw_key: str
+    ) -> Tuple[Optional[Any], Optional[Envelope]]:
+        """As :meth:`_get_value`, but also return the value's envelope, if it
+        has one."""
+        cache_contents = self.get_raw(raw_key)
+        if cache_contents is not None:
+            return self._load_enveloped(cache_contents)
+        else:
+            return None, None
+
+    def _get_values(self, raw_keys: Sequence[str]) -> Dict[str, Any]:
+        """Look up and deserialise the values stored under many (distinct) raw
+        keys.  Misses are omitted from the returned dict."""
+        values = {}
+        for raw_key, cache_contents in zip(raw_keys, self.get_many_raw(raw_keys)):
+            if cache_contents is not None:
+                values[raw_key] = self._load(cache_contents)
+        return values
+
+    def _set_value(
+        self,
+        raw_key: str,
+        value: Any,
+        ttl_seconds: int,
+        key: Optional[Key] = None,
+        compress: bool = False,
+        envelope: Optional[Envelope] = None,
+    ) -> None:
+        """Serialise and store a value under a raw key."""
+        self.set_raw(raw_key, self._dump(value, key, compress, envelope), ttl_seconds)
+
+    def _set_values(
+        self, values: Mapping[str, Tuple[Any, Key]], ttl_seconds: int
+    ) -> None:
+        """Serialise and store many values (each given with its key) under
+        raw keys."""
+        self.set_many_raw(
+            {
+                raw_key: self._dump(value, key)
+                for raw_key, (value, key) in values.items()
+            },
+            ttl_seconds,
+        )
 
     @abstractmethod
     def get_raw(self, key_str: str) -> Optional[IO[bytes]]:
@@ -170,7 +607,60 @@ class Cache(metaclass=ABCMeta):
         """
         pass  # pragma: no cover
 
-    @abstractmethod
+    def get_many_raw(self, key_strs: Sequence[str]) -> List[Optional[IO[bytes]]]:
+        """Look up many values (as bytes) from concrete key strings.
+
+        Returns a list in the same order as the key strings.  The default
+        implementation calls :meth:`get_raw` once per key - backends should
+        override this to use a bulk operation where they have one.
+
+        :param key_strs: the (fully prefixed) key strings to look up
+        """
+        return [self.get_raw(key_str) for key_str in key_strs]
+
+    def set_many_raw(self, items: Mapping[str, IO[bytes]], ttl_seconds: int) -> None:
+        """Set many values (as bytes) by concrete key strings.
+
+        The default implementation calls :meth:`set_raw` once per key.
+
+        :param items: a mapping of (fully prefixed) key strings to values
+        """
+        for key_str, value_bytes in items.items():
+            self.set_raw(key_str, value_bytes, ttl_seconds)
+
+    def invalidate_many_raw(self, key_strs: Sequence[str]) -> None:
+        """Invalidate many keys by concrete key strings.
+
+        The default implementation calls :meth:`invalidate_raw` once per key.
+
+        :param key_strs: the (fully prefixed) key strings to invalidate
+        """
+        for key_str in key_strs:
+            self.invalidate_raw(key_str)
+
+    def acquire_lease_raw(
+        self, lease_key_str: str, token: str, ttl_seconds: float
+    ) -> bool:
+        """Atomically take a lease (a short-lived lock) unless someone else
+        holds it.  Returns True if the lease was acquired.
+
+        Only required for :attr:`lease_ttl_seconds`.  Leases should not show
+        up as ordinary values.
+
+        :param lease_key_str: the (fully prefixed) key string of the lease
+        :param token: a random string identifying the holder
+        :param ttl_seconds: how long until the lease expires by itself
+        """
+        raise NotImplementedError("this cache does not support leases")
+
+    def release_lease_raw(self, lease_key_str: str, token: str) -> None:
+        """Release a lease - but only if it is still held by token.
+
+        :param lease_key_str: the (fully prefixed) key string of the lease
+        :param token: the token the lease was acquired with
+        """
+        raise NotImplementedError("this cache does not support leases")
+
     def clear(self) -> None:
         """Remove all keys from the cache.
 
@@ -178,4 +668,25 @@ class Cache(metaclass=ABCMeta):
         server, so use with care.
 
         """
+        self.clear_raw()
+        self._forget_all_namespaces()
+
+    @abstractmethod
+    def clear_raw(self) -> None:
+        """Remove all keys from the backend (see :meth:`clear`)."""
         pass  # pragma: no cover
+
+
+def _make_envelope(
+    ttl_seconds: int, soft_ttl_seconds: Optional[float], delta: Optional[float] = None
+) -> Optional[Envelope]:
+    """Return an envelope for a value, if it needs one (ie: if it has a soft TTL
+    or its recompute time is wanted)."""
+    if soft_ttl_seconds is None and delta is None:
+        return None
+    now = time()
+    return Envelope(
+        soft_expiry=now + soft_ttl_seconds if soft_ttl_seconds is not None else 0,
+        expiry=now + ttl_seconds if ttl_seconds != 0 else 0,
+        delta=delta or 0,
+    )
@@ -1,10 +1,31 @@
+from abc import ABCMeta, abstractmethod
 from io import BytesIO
+import bz2
+from logging import getLogger
+import lzma
 import shutil
-from typing import IO, cast
+from typing import IO, Dict, Optional, cast
 import gzip
+import zlib
 
 from typing_extensions import Protocol
 
+logger = getLogger(__name__)
+
+#: The first byte of values compressed by a :class:`TaggedCompressor`.  The
+#: second byte is the compressor's tag.  This must not be the first byte of
+#: any other header (eg: the envelope's magic, or gzip's).
+TAG_MARKER = 0xA8
+
+# Size of the chunks streamed through compressors that need feeding by hand
+CHUNK_SIZE = 64 * 1024
+
+
+class DecompressionError(Exception):
+    """Raised by compressors that can't decompress a value (eg: because
+    something needed to do so is missing).  Caches treat the value as a
+    miss."""
+
 
 class Compressor(Protocol):
     """The protocol for compressors to follow"""
@@ -49,3 +70,228 @@ class GZIPCompressor:
 
     def decompress(self, data: IO[bytes]) -> IO[bytes]:
         return cast(IO[bytes], gzip.open(data))
+
+
+class TaggedCompressor(metaclass=ABCMeta):
+    """A base class for compressors that start what they compress with a two
+    byte header: :data:`TAG_MARKER` and then their one byte :attr:`tag`.
+
+    Registered tagged compressors (see :func:`register_compressor`) can
+    always be read back, whatever compressor the cache or key is set to use,
+    so the compressor can be changed without flushing the cache.
+
+    Subclasses need to set :attr:`tag` and implement :meth:`_compress` and
+    :meth:`_decompress`.
+
+    """
+
+    #: Identifies this compressor in the header of values it has compressed.
+    #: Must be unique among registered compressors.
+    tag: int
+
+    def is_compressed(self, data: IO[bytes]) -> bool:
+        head = data.read(2)
+        data.seek(0)
+        return head == bytes([TAG_MARKER, self.tag])
+
+    def compress(self, data: IO[bytes]) -> IO[bytes]:
+        buf = BytesIO()
+        buf.write(bytes([TAG_MARKER, self.tag]))
+        self._compress(data, buf)
+        buf.seek(0)
+        return buf
+
+    def decompress(self, data: IO[bytes]) -> IO[bytes]:
+        data.read(2)
+        try:
+            return self._decompress(data)
+        except DecompressionError:
+            raise
+        except Exception as e:
+            # Each codec has its own errors.  The value may not even be
+            # compressed - just happen to start with a header.
+            raise DecompressionError(
+                f"invalid {type(self).__name__} data: {e!r}"
+            ) from e
+
+    @abstractmethod
+    def _compress(self, data: IO[bytes], out: IO[bytes]) -> None:
+        """Write a compressed copy of data to out."""
+        pass  # pragma: no cover
+
+    @abstractmethod
+    def _decompress(self, data: IO[bytes]) -> IO[bytes]:
+        """Decompress data (which is positioned after the header)."""
+        pass  # pragma: no cover
+
+
+class ZlibCompressor(TaggedCompressor):
+    """A compressor that uses zlib's deflate, without any gzip or zlib
+    framing.  Much quicker than gzip at lower levels."""
+
+    tag = 1
+
+    def __init__(self, level: int = 1):
+        """
+
+        :param level: The zlib compression level (default 1)"""
+        #: Zlib compression level
+        self.level = level
+
+    def _compress(self, data: IO[bytes], out: IO[bytes]) -> None:
+        compressobj = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        for chunk in iter(lambda: data.read(CHUNK_SIZE), b""):
+            out.write(compressobj.compress(chunk))
+        out.write(compressobj.flush())
+
+    def _decompress(self, data: IO[bytes]) -> IO[bytes]:
+        decompressobj = zlib.decompressobj(-zlib.MAX_WBITS)
+        buf = BytesIO()
+        for chunk in iter(lambda: data.read(CHUNK_SIZE), b""):
+            buf.write(decompressobj.decompress(chunk))
+        buf.write(decompressobj.flush())
+        buf.seek(0)
+        return buf
+
+
+class LZMACompressor(TaggedCompressor):
+    """A compressor that uses lzma (xz).  Slow, but compresses well."""
+
+    tag = 2
+
+    def __init__(self, preset: int = 6):
+        """
+
+        :param preset: The lzma compression preset (default 6)"""
+        #: lzma compression preset
+        self.preset = preset
+
+    def _compress(self, data: IO[bytes], out: IO[bytes]) -> None:
+        with lzma.LZMAFile(out, mode="w", preset=self.preset) as lzma_f:
+            shutil.copyfileobj(data, lzma_f)
+
+    def _decompress(self, data: IO[bytes]) -> IO[bytes]:
+        lzma_f = lzma.LZMAFile(data)
+        # Decompression is lazy, so read a little to check the data is valid
+        lzma_f.peek()
+        return cast(IO[bytes], lzma_f)
+
+
+class BZ2Compressor(TaggedCompressor):
+    """A compressor that uses bzip2."""
+
+    tag = 3
+
+    def __init__(self, level: int = 9):
+        """
+
+        :param level: The bzip2 compression level (default 9)"""
+        #: bzip2 compression level
+        self.level = level
+
+    def _compress(self, data: IO[bytes], out: IO[bytes]) -> None:
+        with bz2.BZ2File(out, mode="w", compresslevel=self.level) as bz2_f:
+            shutil.copyfileobj(data, bz2_f)
+
+    def _decompress(self, data: IO[bytes]) -> IO[bytes]:
+        bz2_f = bz2.BZ2File(data)
+        # As with lzma, check the data is valid
+        bz2_f.peek()  # type: ignore[attr-defined]
+        return cast(IO[bytes], bz2_f)
+
+
+class ZstdCompressor(TaggedCompressor):
+    """A compressor that uses zstd, via the optional ``zstandard`` library.
+    Fast, and compresses well."""
+
+    tag = 4
+
+    def __init__(self, level: int = 3):
+        """
+
+        :param level: The zstd compression level (default 3)"""
+        import zstandard
+
+        self._zstandard = zstandard
+        #: zstd compression level
+        self.level = level
+
+    def _compress(self, data: IO[bytes], out: IO[bytes]) -> None:
+        self._zstandard.ZstdCompressor(level=self.level).copy_stream(data, out)
+
+    def _decompress(self, data: IO[bytes]) -> IO[bytes]:
+        buf = BytesIO()
+        self._zstandard.ZstdDecompressor().copy_stream(data, buf)
+        buf.seek(0)
+        return buf
+
+
+class LZ4Compressor(TaggedCompressor):
+    """A compressor that uses lz4, via the optional ``lz4`` library.  Very
+    fast, though doesn't compress as well as the others."""
+
+    tag = 5
+
+    def __init__(self) -> None:
+        import lz4.frame
+
+        self._lz4_frame = lz4.frame
+
+    def _compress(self, data: IO[bytes], out: IO[bytes]) -> None:
+        out.write(self._lz4_frame.compress(data.read()))
+
+    def _decompress(self, data: IO[bytes]) -> IO[bytes]:
+        return BytesIO(self._lz4_frame.decompress(data.read()))
+
+
+_registry: Dict[int, TaggedCompressor] = {}
+
+
+def register_compressor(compressor: TaggedCompressor) -> None:
+    """Register a tagged compressor, so that values compressed with it can be
+    read back.  The built in ones are registered already (zstd and lz4 only
+    if their libraries are installed)."""
+    existing = _registry.get(compressor.tag)
+    if existing is not None and type(existing) is not type(compressor):
+        raise ValueError(
+            f"tag {compressor.tag} is already used by {type(existing).__name__}"
+        )
+    _registry[compressor.tag] = compressor
+
+
+def get_compressor_for(data: IO[bytes], compressor: Compressor) -> Optional[Compressor]:
+    """Return the compressor that some data was compressed with, or None if
+    it wasn't compressed.
+
+    Registered tagged compressors are looked up by their tag.  Otherwise
+    ``compressor`` (eg: the cache's compressor) is asked, followed by gzip,
+    which was the default before compressors were tagged.
+
+    """
+    head = data.read(2)
+    data.seek(0)
+    if len(head) == 2 and head[0] == TAG_MARKER:
+        tagged = _registry.get(head[1])
+        if tagged is not None:
+            return tagged
+        logger.warning("unknown compressor tag: %d", head[1])
+    if compressor.is_compressed(data):
+        return compressor
+    elif _GZIP.is_compressed(data):
+        return _GZIP
+    return None
+
+
+_GZIP = GZIPCompressor()
+
+register_compressor(ZlibCompressor())
+register_compressor(LZMACompressor())
+register_compressor(BZ2Compressor())
+try:
+    register_compressor(ZstdCompressor())
+except ImportError:  # pragma: no cover
+    pass
+try:
+    register_compressor(LZ4Compressor())
+except ImportError:  # pragma: no cover
+    pass
@@ -0,0 +1,230 @@
+from io import BytesIO
+from logging import getLogger
+import struct
+import threading
+from typing import IO, Dict, Iterable, List, Optional
+import weakref
+
+import zstandard
+
+from .cache import Cache
+from .compression import DecompressionError, TaggedCompressor, register_compressor
+from .keys import build_raw_key
+
+logger = getLogger(__name__)
+
+#: Dictionaries are stored in the cache under keys starting with this
+DICTIONARY_KEY_PREFIX = "pyappcache-dictionaries"
+
+_DICT_ID = struct.Struct("!I")
+
+# Dictionaries never change once trained (and are identified by zstd's
+# dictionary id) so they can be shared by every compressor in the process
+_dictionaries: Dict[int, zstandard.ZstdCompressionDict] = {}
+
+# Every live compressor, so that dictionaries can be looked for in each of
+# their caches
+_compressors: "weakref.WeakSet[ZstdDictionaryCompressor]" = weakref.WeakSet()
+
+
+class _ZstdDictionaryFormat(TaggedCompressor):
+    """Reads values compressed by any :class:`ZstdDictionaryCompressor`.
+
+    It is this, rather than any one compressor, that is registered: values
+    can come from any cache that a compressor has been created for, and the
+    registry shouldn't keep compressors (or their caches) alive.
+
+    """
+
+    tag = 6
+
+    # zstd compression level (for values without a dictionary)
+    level = 3
+
+    def _lookup_order(self) -> List["ZstdDictionaryCompressor"]:
+        """The compressors whose caches to look for dictionaries in."""
+        return list(_compressors)
+
+    def _compress(self, data: IO[bytes], out: IO[bytes]) -> None:
+        out.write(_DICT_ID.pack(0))
+        out.write(zstandard.ZstdCompressor(level=self.level).compress(data.read()))
+
+    def _decompress(self, data: IO[bytes]) -> IO[bytes]:
+        (dict_id,) = _DICT_ID.unpack(data.read(_DICT_ID.size))
+        if dict_id == 0:
+            return BytesIO(zstandard.ZstdDecompressor().decompress(data.read()))
+        dictionary = _dictionaries.get(dict_id)
+        if dictionary is None:
+            for compressor in self._lookup_order():
+                dictionary = compressor._get_dictionary(dict_id)
+                if dictionary is not None:
+                    break
+        if dictionary is None:
+            raise DecompressionError(f"zstd dictionary {dict_id:08x} not found")
+        decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+        return BytesIO(decompressor.decompress(data.read()))
+
+
+class ZstdDictionaryCompressor(_ZstdDictionaryFormat):
+    """A compressor that uses zstd with a dictionary trained on earlier
+    values, which makes it much better at compressing small values (eg: a
+    few hundred bytes) that resemble each other.  Needs the optional
+    ``zstandard`` library.
+
+    Create one for each kind of value (eg: per key class), with a distinct
+    ``name``, and set it as the keys' ``compressor``.  Until there is a
+    dictionary, values are compressed without one and sampled.  Once
+    :attr:`training_sample_count` have been sampled a dictionary is trained
+    from them, stored in the cache and used from then on.  :meth:`train` can
+    also be called directly.
+
+    Dictionaries are stored in the same cache as the values, under
+    :data:`DICTIONARY_KEY_PREFIX`, so other processes can read the values
+    too - provided that they also create a ``ZstdDictionaryCompressor``.
+    They are set without a TTL and set again every
+    :attr:`refresh_every_n` values, so that LRU caches keep them, but a value
+    whose dictionary has been evicted anyway can't be read (and is treated as
+    a miss).
+
+    When reading, dictionaries are looked for in the caches of all
+    ``ZstdDictionaryCompressor`` instances, this one's first.
+
+    """
+
+    def __init__(self, cache: Cache, name: str, level: int = 3):
+        """
+
+        :param cache: Where to store (and find) dictionaries.
+        :param name: Identifies the dictionary to use, eg: the name of a key
+            class.
+        :param level: The zstd compression level (default 3)"""
+        self.cache = cache
+        #: Identifies the current dictionary of this compressor in the cache
+        self.name = name
+        #: zstd compression level
+        self.level = level
+        #: How many values to sample before training a dictionary
+        self.training_sample_count = 1000
+        #: Values bigger than this many bytes are not sampled
+        self.max_sample_size = 16 * 1024
+        #: Size of trained dictionaries, in bytes
+        self.dictionary_size = 16 * 1024
+        #: Every this many values compressed with the dictionary, it is set in
+        #: the cache again so that LRU caches don't evict it before the values
+        #: that need it (0 to never do this)
+        self.refresh_every_n = 1000
+        self._compressed_since_refresh = 0
+        self._samples: List[bytes] = []
+        self._samples_lock = threading.Lock()
+        self._dictionary = self._load_current()
+        _compressors.add(self)
+
+    @property
+    def dictionary_id(self) -> Optional[int]:
+        """The id of the dictionary in use, or None if there isn't one yet."""
+        return self._dictionary.dict_id() if self._dictionary is not None else None
+
+    def train(self, samples: Iterable[bytes]) -> int:
+        """Train a dictionary from samples of values (as serialised, but not
+        compressed, bytes), store it in the cache and start using it.  Returns
+        the new dictionary's id."""
+        dictionary = zstandard.train_dictionary(
+            self.dictionary_size, list(samples), level=self.level
+        )
+        dict_id = dictionary.dict_id()
+        self._store(dictionary)
+        self.cache.set_raw(self._current_key(), BytesIO(_DICT_ID.pack(dict_id)), 0)
+        _dictionaries[dict_id] = dictionary
+        self._dictionary = dictionary
+        return dict_id
+
+    def reload(self) -> None:
+        """Switch to the dictionary currently stored in the cache for
+        :attr:`name` (eg: if another process has trained a new one)."""
+        dictionary = self._load_current()
+        if dictionary is not None:
+            self._dictionary = dictionary
+
+    def _store(self, dictionary: zstandard.ZstdCompressionDict) -> None:
+        """Set a dictionary in the cache (again)."""
+        self.cache.set_raw(
+            self._dictionary_key(dictionary.dict_id()),
+            BytesIO(dictionary.as_bytes()),
+            0,
+        )
+
+    def _lookup_order(self) -> List["ZstdDictionaryCompressor"]:
+        return [self] + [other for other in _compressors if other is not self]
+
+    def _current_key(self) -> str:
+        return build_raw_key(self.cache.prefix, f"{DICTIONARY_KEY_PREFIX}/{self.name}")
+
+    def _dictionary_key(self, dict_id: int) -> str:
+        return build_raw_key(
+            self.cache.prefix, f"{DICTIONARY_KEY_PREFIX}/{dict_id:08x}"
+        )
+
+    def _load_current(self) -> Optional[zstandard.ZstdCompressionDict]:
+        contents = self.cache.get_raw(self._current_key())
+        if contents is None:
+            return None
+        (dict_id,) = _DICT_ID.unpack(contents.read())
+        dictionary = self._get_dictionary(dict_id)
+        if dictionary is not None:
+            # Set again, as values are about to be compressed with it
+            self._store(dictionary)
+        return dictionary
+
+    def _get_dictionary(self, dict_id: int) -> Optional[zstandard.ZstdCompressionDict]:
+        dictionary = _dictionaries.get(dict_id)
+        if dictionary is None:
+            contents = self.cache.get_raw(self._dictionary_key(dict_id))
+            if contents is None:
+                return None
+            dictionary = zstandard.ZstdCompressionDict(contents.read())
+            _dictionaries[dict_id] = dictionary
+        return dictionary
+
+    def _sample(self, payload: bytes) -> Optional[zstandard.ZstdCompressionDict]:
+        """Keep a sample, training a dictionary once there are enough.
+        Returns the dictionary to use."""
+        if len(payload) > self.max_sample_size:
+            return self._dictionary
+        with self._samples_lock:
+            self._samples.append(payload)
+            if len(self._samples) < self.training_sample_count:
+                return self._dictionary
+            samples = self._samples
+            self._samples = []
+        # Another process may have got there first
+        self.reload()
+        if self._dictionary is None:
+            try:
+                self.train(samples)
+            except zstandard.ZstdError:
+                logger.exception("unable to train a dictionary for %s", self.name)
+        return self._dictionary
+
+    def _compress(self, data: IO[bytes], out: IO[bytes]) -> None:
+        payload = data.read()
+        dictionary = self._dictionary
+        if dictionary is None:
+            dictionary = self._sample(payload)
+        if dictionary is None:
+            super()._compress(BytesIO(payload), out)
+        else:
+            self._compressed_since_refresh += 1
+            if 0 < self.refresh_every_n <= self._compressed_since_refresh:
+                self._compressed_since_refresh = 0
+                self._store(dictionary)
+            out.write(_DICT_ID.pack(dictionary.dict_id()))
+            compressor = zstandard.ZstdCompressor(
+                level=self.level,
+                dict_data=dictionary,
+                write_checksum=False,
+                write_dict_id=False,
+            )
+            out.write(compressor.compress(payload))
+
+
+register_compressor(_ZstdDictionaryFormat())
@@ -0,0 +1,94 @@
+from io import BytesIO
+from logging import getLogger
+from math import log
+from random import random
+import shutil
+import struct
+from time import time
+from typing import IO, Optional, Tuple
+
+logger = getLogger(__name__)
+
+
+class Envelope:
+    """Metadata stored in a header in front of a cached value.
+
+    Envelopes are only written when they're needed (eg: for a soft TTL) so
+    most cached values don't have one.  They are stored in the value itself,
+    rather than via some backend feature, so that they work on all backends.
+
+    """
+
+    __slots__ = ("soft_expiry", "expiry", "delta")
+
+    #: The first bytes of an enveloped value
+    MAGIC = b"\xa7PYAC"
+
+    VERSION = 2
+
+    _HEADER = struct.Struct("!5sBddd")
+
+    def __init__(self, soft_expiry: float = 0, expiry: float = 0, delta: float = 0):
+        #: The unix time after which the value should be refreshed, or 0 for
+        #: never
+        self.soft_expiry = soft_expiry
+        #: The unix time at which the value expires, or 0 for never
+        self.expiry = expiry
+        #: How long the value took to compute, in seconds (0 if not known)
+        self.delta = delta
+
+    def __repr__(self) -> str:
+        return (
+            f"<Envelope soft_expiry={self.soft_expiry} expiry={self.expiry}"
+            f" delta={self.delta}>"
+        )
+
+    def is_stale(self) -> bool:
+        """Whether the soft expiry time has passed."""
+        return self.soft_expiry != 0 and self.soft_expiry < time()
+
+    def should_refresh_early(self, beta: float) -> bool:
+        """Whether to refresh the value ahead of its expiry, as per the
+        "XFetch" algorithm of "Optimal Probabilistic Cache Stampede
+        Prevention" (Vattani, Chierichetti and Lowenstein, 2015).
+
+        The chance rises as the expiry gets nearer, and is higher for values
+        that are slower to compute.  A higher beta means earlier refreshes.
+
+        """
+        if self.expiry == 0 or self.delta == 0:
+            return False
+        # 1 - random() is in (0, 1], so is safe to take the log of
+        return time() - self.delta * beta * log(1 - random()) >= self.expiry
+
+    def wrap(self, payload: IO[bytes]) -> IO[bytes]:
+        """Return the payload with this envelope's header in front of it."""
+        buf = BytesIO()
+        buf.write(
+            self._HEADER.pack(
+                self.MAGIC, self.VERSION, self.soft_expiry, self.expiry, self.delta
+            )
+        )
+        shutil.copyfileobj(payload, buf)
+        buf.seek(0)
+        return buf
+
+    @classmethod
+    def unwrap(
+        cls, data: IO[bytes]
+    ) -> Tuple[Optional["Envelope"], Optional[IO[bytes]]]:
+        """Split data into an envelope (or None, if there isn't one) and the
+        payload.  The payload is None if the value can't be read (because its
+        envelope is of an unknown version), which should be treated as a
+        miss."""
+        head = data.read(cls._HEADER.size)
+        if len(head) != cls._HEADER.size or not head.startswith(cls.MAGIC):
+            data.seek(0)
+            return None, data
+        _, version, soft_expiry, expiry, delta = cls._HEADER.unpack(head)
+        if version != cls.VERSION:
+            logger.warning("unknown envelope version: %d", version)
+            return None, None
+        # The payload gets its own buffer as compressors and serialisers are
+        # allowed to seek back to 0
+        return cls(soft_expiry, expiry, delta), BytesIO(data.read())
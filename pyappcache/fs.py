@@ -1,18 +1,65 @@
+import hashlib
+import mmap
 import os
+import re
 import sqlite3
-from typing import Optional, IO, List
+import tempfile
+from typing import Optional, Any, Dict, IO, List, Mapping, Sequence
 from logging import getLogger
 from pathlib import Path
 import shutil
-from contextlib import closing
-from datetime import datetime, timedelta
+import threading
+import time
+from uuid import uuid4
+import weakref
+from contextlib import closing, suppress
+from functools import partial
+from datetime import datetime, timedelta, timezone
 
 from dateutil.parser import parse as parse_dt
 
 from .cache import Cache
+from .keys import Key
+from .sqlite_lru import (
+    CREATE_LEASES_DDL,
+    CREATE_TOTALS_DDL,
+    DELETE_DML,
+    GET_TOTALS_DQL,
+    MAX_KEYS_PER_QUERY,
+    _ConnectionPool,
+    _acquire_lease,
+    _chunked,
+    _placeholders,
+    _release_lease,
+)
 
 logger = getLogger(__name__)
 
+# Stored in PRAGMA user_version of the metadata database.  Version 0 is the
+# original, flat, layout where all files were in the top directory and named
+# after their key (with "/" replaced by "_").  Version 1 is the hashed layout:
+# see FilesystemCache._make_path.
+LAYOUT_VERSION = 1
+
+TABLE_EXISTS_DQL = """
+SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'pyappcache';
+"""
+
+#: Don't fsync at all: a crash may lose recent writes (but won't leave a
+#: partially written value)
+FSYNC_NONE = "none"
+#: fsync each value file before it is moved into place
+FSYNC_DATA = "data"
+#: As FSYNC_DATA, and also fsync the directory afterwards, so that the move
+#: itself is durable
+FSYNC_DATA_AND_DIR = "data+dir"
+
+FSYNC_POLICIES = (FSYNC_NONE, FSYNC_DATA, FSYNC_DATA_AND_DIR)
+
+GET_ALL_KEYS_DQL = """
+SELECT key, expiry FROM pyappcache;
+"""
+
 CREATE_DDL = """
 CREATE TABLE IF NOT EXISTS pyappcache (
     key PRIMARY KEY,
@@ -22,6 +69,17 @@ CREATE TABLE IF NOT EXISTS pyappcache (
 );
 """
 
+# Sizes are corrected in place by compact(), which the totals triggers (shared
+# with SqliteCache) don't cover
+CREATE_RESIZE_TRIGGER_DDL = """
+CREATE TRIGGER IF NOT EXISTS pyappcache_totals_resize
+AFTER UPDATE OF size ON pyappcache
+BEGIN
+    UPDATE pyappcache_totals
+    SET total_size = total_size - OLD.size + NEW.size;
+END;
+"""
+
 INDEX_DDL: List[str] = [
     "CREATE INDEX IF NOT EXISTS idx_pyappcache_expiry ON pyappcache(expiry);",
     "CREATE INDEX IF NOT EXISTS idx_pyappcache_last_read ON pyappcache(last_read);",
@@ -36,8 +94,23 @@ WHERE key = ?
 AND (expiry >= ? OR expiry = '-1');
 """
 
+GET_LIVE_MANY_DQL = """
+SELECT key
+FROM pyappcache
+WHERE key IN ({placeholders})
+AND (expiry >= ? OR expiry = '-1');
+"""
+
+TOUCH_MANY_DML = """
+UPDATE pyappcache
+SET last_read = ?
+WHERE key IN ({placeholders});
+"""
+
+# Preceded by a DELETE_DML (rather than INSERT OR REPLACE) so that the totals
+# triggers see the old row go
 SET_DML = """
-INSERT OR REPLACE INTO pyappcache
+INSERT INTO pyappcache
 (key, expiry, last_read, size)
 VALUES
 (?, ?, ?, ?);
@@ -49,116 +122,573 @@ FROM pyappcache
 WHERE key = ?;
 """
 
-# The below SQL should be done in one step using the RETURNING clause of the
-# DELETE statement, but RETURNING was only added to sqlite in 3.35.0
-# (2021-03-12) and not everyone has it yet (including me)
-
-GET_EVICTION_COHORT_DQL = """
-SELECT
-    KEY
-FROM (
-    SELECT
-        KEY,
-        last_read,
-        SUM(size) OVER (ORDER BY last_read DESC) AS total_size
-    FROM pyappcache) AS t
-WHERE
-    total_size > ?;
+GET_LEAST_RECENTLY_READ_DQL = """
+SELECT key, size
+FROM pyappcache
+ORDER BY last_read ASC;
 """
 
-EVICT_COHORT_DML = """
+DELETE_MANY_DML = """
 DELETE FROM pyappcache
-WHERE KEY IN (
-SELECT
-    KEY
-FROM (
-    SELECT
-        KEY,
-        last_read,
-        SUM(size) OVER (ORDER BY last_read DESC) AS total_size
-    FROM pyappcache) AS t
-WHERE
-    total_size > ?
-)
+WHERE key IN ({placeholders})
+"""
+
+# '-1' (never expires) sorts before any date so is excluded by the lower bound
+GET_EXPIRED_DQL = """
+SELECT key
+FROM pyappcache
+WHERE expiry > '-1' AND expiry < ?
+LIMIT ?;
+"""
+
+GET_SIZES_DQL = """
+SELECT key, size
+FROM pyappcache;
+"""
+
+SET_SIZE_DML = """
+UPDATE pyappcache
+SET size = ?
+WHERE key = ?;
+"""
+
+RECOUNT_TOTALS_DML = """
+UPDATE pyappcache_totals
+SET
+    row_count = (SELECT count(*) FROM pyappcache),
+    total_size = (SELECT coalesce(sum(size), 0) FROM pyappcache);
+"""
+
+# RETURNING was only added to sqlite in 3.35.0 (2021-03-12)
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Touches are flushed some time after the read so must not go backwards (eg: if
+# the key has been set since)
+FLUSH_TOUCH_DML = """
+UPDATE pyappcache
+SET last_read = max(last_read, ?)
+WHERE key = ?;
 """
 
 CLEAR_DML = """
-UPDATE pyappcache SET expiry = ?;
+DELETE FROM pyappcache;
 """
 
 
 class FilesystemCache(Cache):
+    """A cache kept in files in a directory, with a sqlite database alongside
+    for the metadata (expiry, last read time and size).
+
+    Any number of threads and processes can share one directory.  Values are
+    written to a temporary file which is then moved into place, so a reader
+    sees either the old value or the new one, never part of one.  The
+    metadata database is in WAL mode, so reads are not blocked by writes.
+
+    Eviction is LRU by total size.  Each value file's modification time is
+    set to its expiry time (or 0, for never), so that whether it has expired
+    can be told from the file alone.
+
+    """
+
     METADATA_DB_FILENAME = "metadata.sqlite3"
 
     # 100mb default limit
     DEFAULT_MAX_SIZE = 1000 * 1000 * 100
 
-    def __init__(self, directory: Path, max_size_bytes: int = DEFAULT_MAX_SIZE):
+    DEFAULT_BUSY_TIMEOUT_SECONDS = 5.0
+
+    #: Where the links made by :meth:`get_path` are kept
+    PINS_DIRECTORY = ".pins"
+
+    def __init__(
+        self,
+        directory: Path,
+        max_size_bytes: int = DEFAULT_MAX_SIZE,
+        fsync: str = FSYNC_NONE,
+        busy_timeout_seconds: float = DEFAULT_BUSY_TIMEOUT_SECONDS,
+        touch_interval_seconds: float = 0,
+    ):
+        """
+
+        :parameter directory: The directory to keep the cache in.  Created if
+            it doesn't exist.
+        :parameter max_size_bytes: Maximum total size of values.  Defaults to
+            100MB.
+        :parameter fsync: When to fsync: ``"none"`` (the default), ``"data"``
+            (each value file) or ``"data+dir"`` (each value file and then its
+            directory).  ``"none"`` can lose recent writes in a crash, though
+            never leaves a partially written value.
+        :parameter busy_timeout_seconds: How long to wait for other writers
+            to the metadata database before giving up.
+        :parameter touch_interval_seconds: By default each read also writes
+            the key's last read time to the metadata database.  If this is
+            set, reads don't use the database at all: last read times are
+            buffered in memory and written in batches, at most this many
+            seconds apart (or every :attr:`touch_batch_size` reads), so that a
+            hit is just an ``open()``.  Eviction order is then only
+            approximately LRU.
+
+        """
         super().__init__()
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy: {fsync}")
+        #: When to fsync (see :data:`FSYNC_POLICIES`)
+        self.fsync = fsync
+        self.busy_timeout_seconds = busy_timeout_seconds
         self.directory = directory
         self.directory.mkdir(parents=True, exist_ok=True)
         self.max_size_bytes = max_size_bytes
-        self.metadata_conn = sqlite3.connect(
-            str(self.directory / self.METADATA_DB_FILENAME)
+        #: Once the total size goes over ``max_size_bytes``, evict down to
+        #: this (default: ``max_size_bytes``).  Lower values mean evicting
+        #: less often, in bigger batches.
+        self.low_water_mark_bytes: Optional[int] = None
+        #: Maximum seconds between writes of buffered last read times (0 to
+        #: write them on every read)
+        self.touch_interval_seconds = touch_interval_seconds
+        #: Maximum number of buffered last read times
+        self.touch_batch_size = 1000
+        self._touches: Dict[str, str] = {}
+        self._touch_lock = threading.Lock()
+        self._next_touch_flush = time.monotonic() + touch_interval_seconds
+        #: Maximum number of keys changed per transaction by :meth:`compact`
+        self.compact_batch_size = 500
+        #: How old a file with no metadata must be before :meth:`compact`
+        #: deletes it
+        self.orphan_grace_seconds = 60
+        #: How old a pin (see :meth:`get_path`) must be before :meth:`compact`
+        #: deletes it, in case it was never released (eg: by a process that
+        #: crashed).  Default is a day.
+        self.pin_max_age_seconds = 24 * 60 * 60
+        self._compact_stop: Optional[threading.Event] = None
+        self._pool = _ConnectionPool(
+            partial(
+                _connect,
+                self.directory / self.METADATA_DB_FILENAME,
+                busy_timeout_seconds,
+                fsync,
+            )
         )
-        with closing(self.metadata_conn.cursor()) as cursor:
-            cursor.execute(CREATE_DDL)
-            for index_ddl in INDEX_DDL:
-                cursor.execute(index_ddl)
-            self.metadata_conn.commit()
+        weakref.finalize(self, self._pool.close)
+        _create_or_migrate(self.metadata_conn, self.directory)
+
+    @property
+    def metadata_conn(self) -> sqlite3.Connection:
+        """The connection to the metadata database.  sqlite connections can't
+        be shared between threads so each thread gets its own, which is
+        closed when the thread ends."""
+        return self._pool.get()
 
     def _make_path(self, raw_key: str) -> Path:
-        path = self.directory / raw_key.replace("/", "_")
-        path.parent.mkdir(parents=True, exist_ok=True)
-        return path
+        """Return the path of the file for a key: named for a hash of the key
+        and two directories deep (eg: ``ab/cd/abcd...``) so that no one
+        directory gets too big.  Directories are only created on write."""
+        return _hashed_path(self.directory, raw_key)
 
-    def get_raw(self, raw_key: str) -> Optional[IO[bytes]]:
+    def _touch(self, raw_key: str) -> bool:
+        """Update the last read time of a key, returning whether it is live."""
         now = datetime.utcnow()
         with closing(self.metadata_conn.cursor()) as cursor:
             cursor.execute(TOUCH_DML, (now.isoformat(), raw_key, now.isoformat()))
-            if cursor.rowcount == 0:
-                return None
+            # Commit even when nothing was updated, to release the write lock
             self.metadata_conn.commit()
+            return cursor.rowcount > 0
+
+    def _open(self, raw_key: str) -> Optional[IO[bytes]]:
+        """Open the file for a key (if it is live), counting it as a read."""
+        if self.touch_interval_seconds == 0:
+            if not self._touch(raw_key):
+                return None
+            try:
+                return self._make_path(raw_key).open("rb")
+            except FileNotFoundError:
+                # The row is removed by compact()
+                return None
 
-        path = self._make_path(raw_key)
         try:
-            return path.open("rb")
+            fh = self._make_path(raw_key).open("rb")
         except FileNotFoundError:
-            # FIXME: should handle this by expiring the key
             return None
+        if _has_expired(os.fstat(fh.fileno()).st_mtime):
+            fh.close()
+            return None
+        self._buffer_touches([raw_key])
+        return fh
 
-    def set_raw(self, raw_key: str, value_bytes: IO[bytes], ttl_seconds: int) -> None:
+    def _buffer_touches(self, raw_keys: Sequence[str]) -> None:
+        now = datetime.utcnow().isoformat()
+        with self._touch_lock:
+            for raw_key in raw_keys:
+                self._touches[raw_key] = now
+            due = (
+                len(self._touches) >= self.touch_batch_size
+                or time.monotonic() >= self._next_touch_flush
+            )
+        if due:
+            self.flush_touches()
+
+    def flush_touches(self) -> None:
+        """Write any buffered last read times to the metadata database (see
+        ``touch_interval_seconds``)."""
+        with self._touch_lock:
+            touches = self._touches
+            self._touches = {}
+            self._next_touch_flush = time.monotonic() + self.touch_interval_seconds
+        if len(touches) > 0:
+            with closing(self.metadata_conn.cursor()) as cursor:
+                cursor.executemany(
+                    FLUSH_TOUCH_DML, [(now, key) for key, now in touches.items()]
+                )
+                self.metadata_conn.commit()
+
+    def get_raw(self, raw_key: str) -> Optional[IO[bytes]]:
+        return self._open(raw_key)
+
+    def get_mmap(self, key: Key[Any]) -> Optional[memoryview]:
+        """Return a read-only, memory mapped, view of the file stored under a
+        key, or None if there isn't one.
+
+        The view is of the value as stored, so this is only useful when the
+        serialiser stores bytes as is (eg:
+        :class:`~pyappcache.serialisation.BinaryFileSerialiser`) and the key
+        isn't compressed.  The view
+        stays valid even if the key is evicted, invalidated or set again.
+
+        """
+        raw_key = self._build_raw_key(key)
+        if raw_key is None:
+            return None
+        fh = self._open(raw_key)
+        if fh is None:
+            return None
+        with fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                # Empty files can't be mapped
+                return memoryview(b"")
+            return memoryview(mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def get_path(self, key: Key[Any]) -> Optional["PinnedPath"]:
+        """Return the path of the file stored under a key, or None if there
+        isn't one.
+
+        The file at the path won't be changed or deleted (eg: by eviction)
+        until the returned :class:`PinnedPath` is closed, so it can be passed
+        to things like Flask's ``send_file``, which use ``sendfile``.  As
+        with :meth:`get_mmap`, the file is the value as stored.  The
+        exceptions are :meth:`clear`, which deletes every pinned file, and
+        :meth:`compact`, which deletes pins older than
+        :attr:`pin_max_age_seconds`.  Pinned files don't count towards
+        ``max_size_bytes``.
+
+        """
+        raw_key = self._build_raw_key(key)
+        if raw_key is None:
+            return None
+        fh = self._open(raw_key)
+        if fh is None:
+            return None
         path = self._make_path(raw_key)
-        with path.open("w+b") as fh:
-            shutil.copyfileobj(value_bytes, fh)
-        size = _get_fh_size(value_bytes)
+        # A hard link to the file is made, which eviction doesn't know about
+        pins_directory = self.directory / self.PINS_DIRECTORY
+        pin = pins_directory / f"{path.name}.{uuid4().hex}"
+        with fh:
+            try:
+                os.link(path, pin)
+            except FileNotFoundError:
+                # Either the file has gone or this is the first pin
+                pins_directory.mkdir(exist_ok=True)
+                try:
+                    os.link(path, pin)
+                except FileNotFoundError:
+                    return None
+        return PinnedPath(pin)
+
+    def get_many_raw(self, raw_keys: Sequence[str]) -> List[Optional[IO[bytes]]]:
+        if self.touch_interval_seconds != 0:
+            return [self._open(raw_key) for raw_key in raw_keys]
+        now = datetime.utcnow()
+        live = set()
+        with closing(self.metadata_conn.cursor()) as cursor:
+            for chunk in _chunked(raw_keys, MAX_KEYS_PER_QUERY):
+                placeholders = _placeholders(len(chunk))
+                cursor.execute(
+                    GET_LIVE_MANY_DQL.format(placeholders=placeholders),
+                    (*chunk, now.isoformat()),
+                )
+                live_chunk = [row[0] for row in cursor.fetchall()]
+                if len(live_chunk) > 0:
+                    cursor.execute(
+                        TOUCH_MANY_DML.format(
+                            placeholders=_placeholders(len(live_chunk))
+                        ),
+                        (now.isoformat(), *live_chunk),
+                    )
+                live.update(live_chunk)
+            self.metadata_conn.commit()
+
+        rv: List[Optional[IO[bytes]]] = []
+        for raw_key in raw_keys:
+            if raw_key in live:
+                try:
+                    rv.append(self._make_path(raw_key).open("rb"))
+                except FileNotFoundError:
+                    rv.append(None)
+            else:
+                rv.append(None)
+        return rv
+
+    def set_raw(self, raw_key: str, value_bytes: IO[bytes], ttl_seconds: int) -> None:
+        self.set_many_raw({raw_key: value_bytes}, ttl_seconds)
+
+    def set_many_raw(self, items: Mapping[str, IO[bytes]], ttl_seconds: int) -> None:
         if ttl_seconds != 0:
             expiry = (datetime.utcnow() + timedelta(seconds=ttl_seconds)).isoformat()
+            expires_at = time.time() + ttl_seconds
         else:
             expiry = "-1"
+            expires_at = 0
+        rows = []
+        for raw_key, value_bytes in items.items():
+            self._write_file(self._make_path(raw_key), value_bytes, expires_at)
+            size = _get_fh_size(value_bytes)
+            rows.append((raw_key, expiry, datetime.utcnow().isoformat(), size))
+        # So that eviction sees recent reads
+        self.flush_touches()
         with closing(self.metadata_conn.cursor()) as cursor:
-            cursor.execute(SET_DML, (raw_key, expiry, datetime.utcnow(), size))
+            cursor.executemany(DELETE_DML, [(row[0],) for row in rows])
+            cursor.executemany(SET_DML, rows)
             self.metadata_conn.commit()
         self._evict()
 
+    def _write_file(
+        self, path: Path, value_bytes: IO[bytes], expires_at: float
+    ) -> None:
+        """Write to a temporary file in the same directory and then move it
+        over the path, so that readers never see a partial file."""
+        try:
+            fd, temp_name = tempfile.mkstemp(
+                prefix=f".{path.name}.", suffix=".tmp", dir=path.parent
+            )
+        except FileNotFoundError:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, temp_name = tempfile.mkstemp(
+                prefix=f".{path.name}.", suffix=".tmp", dir=path.parent
+            )
+        try:
+            with open(fd, "wb") as fh:
+                shutil.copyfileobj(value_bytes, fh)
+                fh.flush()
+                os.utime(fh.fileno(), (time.time(), expires_at))
+                if self.fsync != FSYNC_NONE:
+                    os.fsync(fh.fileno())
+            os.replace(temp_name, path)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+        if self.fsync == FSYNC_DATA_AND_DIR:
+            dir_fd = os.open(path.parent, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
     def invalidate_raw(self, raw_key: str) -> None:
-        # FIXME: this should be updating the metadata
-        path = self._make_path(raw_key)
-        path.unlink(missing_ok=True)
+        self.invalidate_many_raw([raw_key])
+
+    def invalidate_many_raw(self, raw_keys: Sequence[str]) -> None:
+        with self._touch_lock:
+            for raw_key in raw_keys:
+                self._touches.pop(raw_key, None)
+        with closing(self.metadata_conn.cursor()) as cursor:
+            self._delete_rows(cursor, raw_keys)
+            self.metadata_conn.commit()
+        self._unlink(raw_keys)
+
+    def _delete_rows(
+        self, cursor: sqlite3.Cursor, raw_keys: Sequence[str]
+    ) -> List[str]:
+        """Delete the metadata rows for some keys, returning the keys that were
+        actually deleted (and so whose files should be unlinked)."""
+        deleted: List[str] = []
+        for chunk in _chunked(raw_keys, MAX_KEYS_PER_QUERY):
+            delete_dml = DELETE_MANY_DML.format(placeholders=_placeholders(len(chunk)))
+            if HAS_RETURNING:
+                cursor.execute(delete_dml + " RETURNING key;", chunk)
+                deleted.extend(row[0] for row in cursor.fetchall())
+            else:  # pragma: no cover
+                cursor.execute(delete_dml, chunk)
+                deleted.extend(chunk)
+        return deleted
+
+    def _unlink(self, raw_keys: Sequence[str]) -> None:
+        for raw_key in raw_keys:
+            self._make_path(raw_key).unlink(missing_ok=True)
 
     def _evict(self) -> None:
         """Evict data to maintain the maximum size."""
         with closing(self.metadata_conn.cursor()) as cursor:
-            cursor.execute("BEGIN;")
-            cursor.execute(GET_EVICTION_COHORT_DQL, (self.max_size_bytes,))
-            rs = cursor.fetchall()
-            cursor.execute(EVICT_COHORT_DML, (self.max_size_bytes,))
+            _, total_size = cursor.execute(GET_TOTALS_DQL).fetchone()
+            if total_size <= self.max_size_bytes:
+                return
+            # IMMEDIATE so that other processes can't evict the same keys
+            cursor.execute("BEGIN IMMEDIATE;")
+            _, total_size = cursor.execute(GET_TOTALS_DQL).fetchone()
+            low_water_mark = self.max_size_bytes
+            if self.low_water_mark_bytes is not None:
+                low_water_mark = min(self.low_water_mark_bytes, low_water_mark)
+            bytes_over = total_size - low_water_mark
+            # Walk from the least recently read end until enough is found
+            evictees: List[str] = []
+            freed = 0
+            for raw_key, size in cursor.execute(GET_LEAST_RECENTLY_READ_DQL):
+                if freed >= bytes_over:
+                    break
+                evictees.append(raw_key)
+                freed += size
+            evicted = self._delete_rows(cursor, evictees)
+            self.metadata_conn.commit()
+        self._unlink(evicted)
+
+    def purge_expired(self) -> int:
+        """Delete all expired keys and their files, in batches.  Returns the
+        number deleted."""
+        purged = 0
+        while True:
+            with closing(self.metadata_conn.cursor()) as cursor:
+                cursor.execute("BEGIN IMMEDIATE;")
+                cursor.execute(
+                    GET_EXPIRED_DQL,
+                    (datetime.utcnow().isoformat(), self.compact_batch_size),
+                )
+                expired = [row[0] for row in cursor.fetchall()]
+                deleted = self._delete_rows(cursor, expired)
+                self.metadata_conn.commit()
+            self._unlink(deleted)
+            purged += len(deleted)
+            if len(expired) < self.compact_batch_size:
+                return purged
+
+    def compact(self) -> Dict[str, int]:
+        """Bring the metadata and the files back in line with each other:
+
+        - expired keys and their files are deleted (see :meth:`purge_expired`)
+        - metadata for keys whose files are missing is deleted
+        - files with no metadata are deleted (along with temporary files left
+          by interrupted sets), once they are more than
+          :attr:`orphan_grace_seconds` old
+        - sizes are corrected to those of the files on disk
+        - pins (see :meth:`get_path`) more than :attr:`pin_max_age_seconds`
+          old are deleted
+
+        Changes are made in batches of at most :attr:`compact_batch_size`, so
+        other processes are not blocked for long.  Returns counts of each
+        kind of change.
+
+        """
+        expired = self.purge_expired()
+
+        # Stat every file first, then check them off against the metadata
+        files: Dict[str, os.stat_result] = {}
+        temp_files: List[Path] = []
+        for top in self.directory.iterdir():
+            if not _is_hashed_directory(top):
+                continue
+            for middle in top.iterdir():
+                for entry in os.scandir(middle):
+                    if entry.name.startswith("."):
+                        temp_files.append(Path(entry.path))
+                    else:
+                        files[entry.name] = entry.stat()
+
+        missing: List[str] = []
+        resized = []
+        with closing(self.metadata_conn.cursor()) as cursor:
+            for raw_key, size in cursor.execute(GET_SIZES_DQL):
+                path = self._make_path(raw_key)
+                stat = files.pop(path.name, None)
+                if stat is None:
+                    # It may have been set since the files were listed
+                    if not path.exists():
+                        missing.append(raw_key)
+                elif stat.st_size != size:
+                    resized.append((stat.st_size, raw_key))
+        for chunk in _chunked(missing, self.compact_batch_size):
+            with closing(self.metadata_conn.cursor()) as cursor:
+                self._delete_rows(cursor, chunk)
+                self.metadata_conn.commit()
+        for resize_chunk in _chunked(resized, self.compact_batch_size):
+            with closing(self.metadata_conn.cursor()) as cursor:
+                cursor.executemany(SET_SIZE_DML, resize_chunk)
+                self.metadata_conn.commit()
+
+        # Files are written before their metadata, so a new file may not have
+        # any yet
+        orphaned = 0
+        cutoff = time.time() - self.orphan_grace_seconds
+        orphans = [_digest_path(self.directory, name) for name in files] + temp_files
+        for path in orphans:
+            with suppress(FileNotFoundError):
+                if path.stat().st_ctime < cutoff:
+                    path.unlink()
+                    orphaned += 1
+
+        # Pins are hard links so their ctime is when the file last gained or
+        # lost a link: never earlier than when the pin was made
+        stale_pins = 0
+        pin_cutoff = time.time() - self.pin_max_age_seconds
+        with suppress(FileNotFoundError):
+            for entry in os.scandir(self.directory / self.PINS_DIRECTORY):
+                with suppress(FileNotFoundError):
+                    if entry.stat().st_ctime < pin_cutoff:
+                        os.unlink(entry.path)
+                        stale_pins += 1
+
+        with closing(self.metadata_conn.cursor()) as cursor:
+            cursor.execute(RECOUNT_TOTALS_DML)
             self.metadata_conn.commit()
+        return {
+            "expired": expired,
+            "missing_files": len(missing),
+            "orphaned_files": orphaned,
+            "resized": len(resized),
+            "stale_pins": stale_pins,
+        }
+
+    def auto_compact(self, interval_seconds: float = 300) -> None:
+        """Call :meth:`compact` every ``interval_seconds`` on a background
+        thread, until :meth:`close` is called."""
+        self._compact_stop = stop = threading.Event()
+
+        def compact_periodically() -> None:
+            while not stop.wait(interval_seconds):
+                self._auto_compact()
 
-        for row in rs:
-            raw_key = row[0]
-            path = self._make_path(raw_key)
-            path.unlink(missing_ok=True)
+        threading.Thread(
+            target=compact_periodically, name="pyappcache-compact", daemon=True
+        ).start()
+
+    def _auto_compact(self) -> None:
+        try:
+            self.compact()
+        except Exception:
+            logger.exception("unable to compact %s", self.directory)
+
+    def close(self) -> None:
+        """Stop :meth:`auto_compact`, if it was started, write any buffered
+        last read times and close all connections to the metadata database.
+        New connections are opened as required."""
+        if self._compact_stop is not None:
+            self._compact_stop.set()
+            self._compact_stop = None
+        self.flush_touches()
+        self._pool.close()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of entries and their total size in bytes
+        (including expired entries that have not yet been removed).  Cheap:
+        these are running totals."""
+        with closing(self.metadata_conn.cursor()) as cursor:
+            row_count, total_size = cursor.execute(GET_TOTALS_DQL).fetchone()
+        return {"row_count": row_count, "total_size_bytes": total_size}
 
     def ttl(self, key_bytes: str) -> Optional[int]:
         """Returns the (remaining) TTL of the given key."""
@@ -174,12 +704,176 @@ class FilesystemCache(Cache):
         else:
             return None
 
-    def clear(self) -> None:
-        now = datetime.utcnow()
-        past = now - timedelta(seconds=1)
+    def acquire_lease_raw(
+        self, lease_key_str: str, token: str, ttl_seconds: float
+    ) -> bool:
+        return _acquire_lease(self.metadata_conn, lease_key_str, token, ttl_seconds)
+
+    def release_lease_raw(self, lease_key_str: str, token: str) -> None:
+        _release_lease(self.metadata_conn, lease_key_str, token)
+
+    def clear_raw(self) -> None:
+        with self._touch_lock:
+            self._touches = {}
         with closing(self.metadata_conn.cursor()) as cursor:
-            cursor.execute(CLEAR_DML, (past.isoformat(),))
+            cursor.execute(CLEAR_DML)
             self.metadata_conn.commit()
+        # Reads may not check the metadata, so the files have to go too -
+        # pinned ones included
+        for child in self.directory.iterdir():
+            if _is_hashed_directory(child) or child.name == self.PINS_DIRECTORY:
+                shutil.rmtree(child, ignore_errors=True)
+
+
+class PinnedPath(os.PathLike):
+    """The path of a file in a :class:`FilesystemCache`, which won't be
+    changed or deleted until :meth:`close` is called (or the ``with`` block
+    is left, or it is garbage collected).  It can be passed anywhere a path
+    can."""
+
+    def __init__(self, path: Path):
+        #: The path of the file
+        self.path = path
+        self._finalizer = weakref.finalize(self, path.unlink, missing_ok=True)
+
+    def __fspath__(self) -> str:
+        return str(self.path)
+
+    def __repr__(self) -> str:
+        return f"<PinnedPath {self.path}>"
+
+    def __enter__(self) -> "PinnedPath":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release the file."""
+        self._finalizer()
+
+
+def migrate_layout(directory: Path) -> int:
+    """Move the files of a :class:`FilesystemCache` directory from the old,
+    flat, layout to the current one and return how many were moved.
+
+    :class:`FilesystemCache` does this itself when first created on an old
+    directory but that can take some time for a big cache so you may want to
+    run it beforehand, eg: as part of a deploy.  It does nothing to a
+    directory that has already been migrated.
+
+    """
+    with closing(
+        sqlite3.connect(str(directory / FilesystemCache.METADATA_DB_FILENAME))
+    ) as conn:
+        return _create_or_migrate(conn, directory)
+
+
+def _create_or_migrate(conn: sqlite3.Connection, directory: Path) -> int:
+    """Create the metadata tables and indexes, migrating the files from the
+    old layout if needed.  Returns the number of files moved."""
+    moved = 0
+    with closing(conn.cursor()) as cursor:
+        # IMMEDIATE so that two processes can't both migrate the same directory
+        if not conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE;")
+        (version,) = cursor.execute("PRAGMA user_version;").fetchone()
+        if version < LAYOUT_VERSION and cursor.execute(TABLE_EXISTS_DQL).fetchone():
+            logger.info("migrating %s to the hashed layout", directory)
+            expiries = dict(cursor.execute(GET_ALL_KEYS_DQL).fetchall())
+            moved = _migrate_from_flat_layout(cursor, directory, expiries)
+        cursor.execute(CREATE_DDL)
+        cursor.execute(CREATE_LEASES_DDL)
+        for index_ddl in INDEX_DDL:
+            cursor.execute(index_ddl)
+        for totals_ddl in CREATE_TOTALS_DDL:
+            cursor.execute(totals_ddl)
+        cursor.execute(CREATE_RESIZE_TRIGGER_DDL)
+        cursor.execute(f"PRAGMA user_version = {LAYOUT_VERSION};")
+        conn.commit()
+    return moved
+
+
+def _migrate_from_flat_layout(
+    cursor: sqlite3.Cursor, directory: Path, expiries: Dict[str, str]
+) -> int:
+    by_flat_name: Dict[str, List[str]] = {}
+    for raw_key in expiries:
+        by_flat_name.setdefault(raw_key.replace("/", "_"), []).append(raw_key)
+
+    # Files are moved aside first as a flat file could have the same name as
+    # one of the new directories
+    staging = Path(tempfile.mkdtemp(prefix=".pyappcache-migrate-", dir=directory))
+    staged: List[str] = []
+    lost: List[str] = []
+    for flat_name, flat_keys in by_flat_name.items():
+        flat_path = directory / flat_name
+        if len(flat_keys) > 1:
+            # Several keys were written to the same file (eg: "a/b" and
+            # "a_b") and there is no way to tell which one it holds now
+            lost.extend(flat_keys)
+            flat_path.unlink(missing_ok=True)
+            continue
+        (raw_key,) = flat_keys
+        try:
+            os.replace(flat_path, staging / str(len(staged)))
+        except FileNotFoundError:
+            lost.append(raw_key)
+            continue
+        staged.append(raw_key)
+
+    for index, raw_key in enumerate(staged):
+        path = _hashed_path(directory, raw_key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(staging / str(index), path)
+        # Files now hold their expiry time too (see touch_interval_seconds)
+        os.utime(path, (time.time(), _expires_at(expiries[raw_key])))
+    staging.rmdir()
+
+    if len(lost) > 0:
+        logger.warning("dropping %d keys whose files were lost", len(lost))
+        cursor.executemany(DELETE_DML, [(raw_key,) for raw_key in lost])
+    return len(staged)
+
+
+def _connect(
+    metadata_path: Path, busy_timeout_seconds: float, fsync: str
+) -> sqlite3.Connection:
+    # Each connection is only used by one thread but close() may be called
+    # from any
+    conn = sqlite3.connect(
+        str(metadata_path), timeout=busy_timeout_seconds, check_same_thread=False
+    )
+    conn.execute("PRAGMA journal_mode = WAL;")
+    if fsync == FSYNC_NONE:
+        conn.execute("PRAGMA synchronous = NORMAL;")
+    return conn
+
+
+def _is_hashed_directory(path: Path) -> bool:
+    return path.is_dir() and re.fullmatch("[0-9a-f]{2}", path.name) is not None
+
+
+def _expires_at(expiry: str) -> float:
+    """Convert an expiry from the metadata (a UTC datetime, or "-1" for
+    never) to the form kept in a file's modification time."""
+    if expiry == "-1":
+        return 0
+    return parse_dt(expiry).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _has_expired(expires_at: float) -> bool:
+    """Whether the expiry time stored in a file's modification time has
+    passed."""
+    return expires_at != 0 and expires_at < time.time()
+
+
+def _hashed_path(directory: Path, raw_key: str) -> Path:
+    return _digest_path(directory, hashlib.sha256(raw_key.encode("utf-8")).hexdigest())
+
+
+def _digest_path(directory: Path, digest: str) -> Path:
+    return directory / digest[:2] / digest[2:4] / digest
 
 
 def _get_fh_size(fh: IO[bytes]) -> int:
@@ -4,6 +4,8 @@ from typing import IO
 from typing import TypeVar, Sequence, Union, Optional, Any
 from typing_extensions import Protocol
 
+from .compression import Compressor
+
 #: Key value
 V = TypeVar("V", contravariant=True)
 
@@ -51,6 +53,18 @@ class BaseKey(Key[V], metaclass=ABCMeta):
 
     """
 
+    #: If set, :meth:`~pyappcache.cache.Cache.get_via` will sometimes refresh
+    #: values of this key shortly *before* they expire, so that keys set at
+    #: the same time don't all expire (and get recomputed) at once.  The
+    #: refresh becomes more likely as the expiry approaches.  Higher values
+    #: refresh earlier: 1.0 is a sensible starting point.  Only applies to
+    #: values with a TTL.  Any key can opt in by having this attribute.
+    xfetch_beta: Optional[float] = None
+
+    #: If set, values of this key are compressed with this compressor rather
+    #: than the cache's.  Any key can opt in by having this attribute.
+    compressor: Optional[Compressor] = None
+
     def namespace_key(self) -> Optional[Key[Any]]:
         return None
 
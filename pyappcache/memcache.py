@@ -1,7 +1,8 @@
 import pylibmc
 import io
+import math
 
-from typing import Optional, Any, IO
+from typing import Optional, Any, IO, List, Mapping, Sequence
 from logging import getLogger
 
 from .cache import Cache
@@ -56,7 +57,54 @@ class MemcacheCache(Cache):
             logger.warning("got a connection error from pylibmc, retrying once")
         self._mc.delete(raw_key)
 
-    def clear(self) -> None:
+    def get_many_raw(self, raw_keys: Sequence[str]) -> List[Optional[IO[bytes]]]:
+        try:
+            values = self._mc.get_multi(raw_keys)
+        except pylibmc.ConnectionError:
+            logger.warning("got a connection error from pylibmc, retrying once")
+            values = self._mc.get_multi(raw_keys)
+        return [
+            io.BytesIO(values[raw_key]) if raw_key in values else None
+            for raw_key in raw_keys
+        ]
+
+    def set_many_raw(self, items: Mapping[str, IO[bytes]], ttl: int) -> None:
+        mapping = {
+            raw_key: value_bytes.read() for raw_key, value_bytes in items.items()
+        }
+        try:
+            failed = self._mc.set_multi(mapping, time=ttl)
+        except pylibmc.ConnectionError:
+            logger.warning("got a connection error from pylibmc, retrying once")
+            failed = self._mc.set_multi(mapping, time=ttl)
+        if failed:
+            logger.warning("memcache failed to set %d keys", len(failed))
+
+    def invalidate_many_raw(self, raw_keys: Sequence[str]) -> None:
+        try:
+            self._mc.delete_multi(raw_keys)
+        except pylibmc.ConnectionError:
+            logger.warning("got a connection error from pylibmc, retrying once")
+            self._mc.delete_multi(raw_keys)
+
+    def acquire_lease_raw(
+        self, lease_key_str: str, token: str, ttl_seconds: float
+    ) -> bool:
+        # memcache's expiry times are in whole seconds
+        time = max(1, math.ceil(ttl_seconds))
+        try:
+            return bool(self._mc.add(lease_key_str, token, time=time))
+        except pylibmc.ConnectionError:
+            logger.warning("got a connection error from pylibmc, retrying once")
+            return bool(self._mc.add(lease_key_str, token, time=time))
+
+    def release_lease_raw(self, lease_key_str: str, token: str) -> None:
+        # Memcache has no compare-and-delete, so there is a small window where
+        # a lease that expired and was taken by someone else can be deleted
+        if self._mc.get(lease_key_str) == token:
+            self._mc.delete(lease_key_str)
+
+    def clear_raw(self) -> None:
         """Clear the cache.
 
         Warning: memcache doesn't have a way to list keys so this clears
@@ -0,0 +1,139 @@
+import io
+from logging import getLogger
+from typing import Optional, Any, Dict, IO, Mapping, Sequence, Tuple
+
+from .cache import Cache
+from .envelope import Envelope
+from .keys import Key
+from .lru import LRU
+
+logger = getLogger(__name__)
+
+# This is present as a basic safety feature - to prevent people blowing up
+# their processes by accident
+MAX_SIZE = 10_000
+
+
+class _Serialised:
+    """Marks a value in a :class:`MemoryCache` as being bytes (eg: from
+    :meth:`~MemoryCache.set_raw` or when copying on read) rather than a live
+    Python object."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+class MemoryCache(Cache):
+    """A cache kept in a Python dict in the memory of the current process.
+
+    By default Python objects are stored as is and a :meth:`get` returns the
+    very same object that was :meth:`set` - there is no serialisation at all.
+    This is fast but means that mutating a value you got from the cache
+    mutates the cached value too.  Pass ``copy_on_read=True`` to instead
+    serialise values when setting them and deserialise (ie: copy) them on each
+    read, as other caches do.
+
+    Eviction is LRU by number of keys.
+
+    """
+
+    def __init__(self, max_size: int = MAX_SIZE, copy_on_read: bool = False):
+        """
+
+        :parameter max_size: Maximum number of keys.  Defaults to 10,000
+        :parameter copy_on_read: Whether to store serialised copies of values
+            rather than the values themselves.  Default is False.
+
+        """
+        super().__init__()
+        #: Whether values are serialised on set and deserialised on read
+        self.copy_on_read = copy_on_read
+        self._lru = LRU(max_size)
+        # Leases are kept separately so that they don't show up as values
+        self._leases = LRU(max_size)
+
+    @property
+    def max_size(self) -> int:
+        """Maximum number of keys"""
+        return self._lru.max_size
+
+    @max_size.setter
+    def max_size(self, max_size: int) -> None:
+        self._lru.max_size = max_size
+
+    def _get_enveloped_value(
+        self, raw_key: str
+    ) -> Tuple[Optional[Any], Optional[Envelope]]:
+        entry = self._lru.get(raw_key)
+        if entry is None:
+            return None, None
+        elif isinstance(entry.value, _Serialised):
+            return self._load_enveloped(io.BytesIO(entry.value.data))
+        else:
+            return entry.value, entry.metadata
+
+    def _get_values(self, raw_keys: Sequence[str]) -> Dict[str, Any]:
+        values = {}
+        for raw_key in raw_keys:
+            value = self._get_value(raw_key)
+            if value is not None:
+                values[raw_key] = value
+        return values
+
+    def _set_value(
+        self,
+        raw_key: str,
+        value: Any,
+        ttl_seconds: int,
+        key: Optional[Key] = None,
+        compress: bool = False,
+        envelope: Optional[Envelope] = None,
+    ) -> None:
+        if self.copy_on_read:
+            super()._set_value(raw_key, value, ttl_seconds, key, compress, envelope)
+        else:
+            self._lru.set(raw_key, value, ttl_seconds, envelope)
+
+    def _set_values(
+        self, values: Mapping[str, Tuple[Any, Key]], ttl_seconds: int
+    ) -> None:
+        if self.copy_on_read:
+            super()._set_values(values, ttl_seconds)
+        else:
+            for raw_key, (value, _) in values.items():
+                self._lru.set(raw_key, value, ttl_seconds)
+
+    def get_raw(self, key_str: str) -> Optional[IO[bytes]]:
+        entry = self._lru.get(key_str)
+        if entry is None:
+            return None
+        elif isinstance(entry.value, _Serialised):
+            return io.BytesIO(entry.value.data)
+        else:
+            return self._dump(entry.value, envelope=entry.metadata)
+
+    def set_raw(self, key_str: str, value_bytes: IO[bytes], ttl_seconds: int) -> None:
+        self._lru.set(key_str, _Serialised(value_bytes.read()), ttl_seconds)
+
+    def invalidate_raw(self, key_str: str) -> None:
+        self._lru.pop_many([key_str])
+
+    def invalidate_many_raw(self, key_strs: Sequence[str]) -> None:
+        self._lru.pop_many(key_strs)
+
+    def ttl(self, key_str: str) -> Optional[int]:
+        """Returns the (remaining) TTL of the given key."""
+        return self._lru.ttl(key_str)
+
+    def acquire_lease_raw(
+        self, lease_key_str: str, token: str, ttl_seconds: float
+    ) -> bool:
+        return self._leases.set_if_absent(lease_key_str, token, ttl_seconds)
+
+    def release_lease_raw(self, lease_key_str: str, token: str) -> None:
+        self._leases.pop_if_equal(lease_key_str, token)
+
+    def clear_raw(self) -> None:
+        self._lru.clear()
@@ -1,5 +1,5 @@
 import io
-from typing import Optional, cast, IO
+from typing import Optional, cast, IO, List, Mapping, Sequence
 from logging import getLogger
 
 import redis as redis_py
@@ -8,11 +8,21 @@ from .cache import Cache
 
 logger = getLogger(__name__)
 
+# Delete a key, but only if it has the given value
+RELEASE_LEASE_LUA = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+else
+    return 0
+end
+"""
+
 
 class RedisCache(Cache):
     """A redis :class:`~pyappcache.cache.Cache` instance.
 
-    This uses ``GET``/``SET``/``DELETE``.
+    This uses ``GET``/``SET``/``DELETE``, and ``MGET`` and pipelined ``SET``
+    for the bulk operations.  Leases use ``SET NX PX``.
 
     .. admonition:: :meth:`~Cache.clear` uses ``FLUSHDB``
 
@@ -47,5 +57,40 @@ class RedisCache(Cache):
     def invalidate_raw(self, raw_key: str) -> None:
         self._redis.delete(raw_key)
 
-    def clear(self) -> None:
+    def get_many_raw(self, raw_keys: Sequence[str]) -> List[Optional[IO[bytes]]]:
+        if len(raw_keys) == 0:
+            return []
+        return [
+            io.BytesIO(cast(bytes, value)) if value is not None else None
+            for value in self._redis.mget(raw_keys)
+        ]
+
+    def set_many_raw(self, items: Mapping[str, IO[bytes]], ttl_seconds: int) -> None:
+        # MSET can't set expiry, so pipeline the SETs instead
+        with self._redis.pipeline(transaction=False) as pipe:
+            for raw_key, value_bytes in items.items():
+                pipe.set(
+                    raw_key,
+                    value_bytes.read(),
+                    ex=ttl_seconds if ttl_seconds != 0 else None,
+                )
+            pipe.execute()
+
+    def invalidate_many_raw(self, raw_keys: Sequence[str]) -> None:
+        if len(raw_keys) > 0:
+            self._redis.delete(*raw_keys)
+
+    def acquire_lease_raw(
+        self, lease_key_str: str, token: str, ttl_seconds: float
+    ) -> bool:
+        return bool(
+            self._redis.set(
+                lease_key_str, token, nx=True, px=max(1, int(ttl_seconds * 1000))
+            )
+        )
+
+    def release_lease_raw(self, lease_key_str: str, token: str) -> None:
+        self._redis.eval(RELEASE_LEASE_LUA, 1, lease_key_str, token)
+
+    def clear_raw(self) -> None:
         self._redis.flushdb()
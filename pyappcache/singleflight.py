@@ -0,0 +1,83 @@
+from logging import getLogger
+from threading import Event, Lock
+from typing import Optional, Any, Callable, Dict, TypeVar, cast
+
+T = TypeVar("T")
+
+logger = getLogger(__name__)
+
+
+class _Call:
+    """A call in progress, which other threads can wait on."""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key, so that only one thread
+    (the "leader") actually does the work and the others wait for, and share,
+    its result.
+
+    Nothing is remembered after the call completes: exceptions are passed to
+    the threads that were waiting at the time but the next call for that key
+    starts afresh.
+
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[], T],
+        timeout: Optional[float] = None,
+        fallback: Optional[Callable[[], T]] = None,
+    ) -> T:
+        """Call fn, unless another thread is already calling fn for this key,
+        in which case wait for that call and return its result (or raise its
+        exception).
+
+        :param key: The key to coalesce calls on.
+        :param fn: The function to call.
+        :param timeout: How long to wait for another thread's call, in
+            seconds.  None (the default) means wait forever.
+        :param fallback: What to call if the wait times out.  Defaults to fn.
+
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                is_leader = True
+            else:
+                is_leader = False
+
+        if is_leader:
+            try:
+                result = fn()
+                call.result = result
+                return result
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if not call.done.wait(timeout):
+            logger.warning("timed out waiting for %s, falling back", key)
+            if fallback is None:
+                fallback = fn
+            return fallback()
+        if call.error is not None:
+            raise call.error
+        return cast(T, call.result)
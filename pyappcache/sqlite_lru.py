@@ -1,17 +1,115 @@
-from typing import Optional, Union, IO
+from typing import (
+    Optional,
+    IO,
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Sequence,
+    Iterator,
+    TypeVar,
+    cast,
+)
+import atexit
 import shutil
 import io
-from datetime import datetime, timedelta
-from contextlib import closing
+import os
+from contextlib import closing, nullcontext
+from functools import partial
+from logging import getLogger
+from pathlib import Path
 import sqlite3
-
-from dateutil.parser import parse as parse_dt
+import threading
+import time
+from uuid import uuid4
+import weakref
 
 from .cache import Cache
 
+T = TypeVar("T")
+
+logger = getLogger(__name__)
+
+# Times are unix epoch seconds (as floats).  A NULL expiry means "never
+# expires".  Size is the length of the value, in bytes.
 CREATE_DDL = """
-CREATE TABLE IF NOT EXISTS pyappcache
-(key PRIMARY KEY, value NOT NULL, expiry NOT NULL, last_read NOT NULL);
+CREATE TABLE IF NOT EXISTS pyappcache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expiry REAL,
+    last_read REAL NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Stored in the pyappcache_schema table (not PRAGMA user_version, which
+# belongs to whoever owns the database).  Version 0 is the original schema,
+# where times were ISO 8601 datetime strings and the expiry was '-1' for
+# "never".  Version 1 had no size column.
+SCHEMA_VERSION = 2
+
+TABLE_EXISTS_DQL = """
+SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;
+"""
+
+CREATE_SCHEMA_DDL = """
+CREATE TABLE IF NOT EXISTS pyappcache_schema
+(id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL);
+"""
+
+GET_SCHEMA_VERSION_DQL = """
+SELECT version FROM pyappcache_schema;
+"""
+
+SET_SCHEMA_VERSION_DML = """
+INSERT OR REPLACE INTO pyappcache_schema (id, version) VALUES (0, ?);
+"""
+
+GET_COLUMNS_DQL = """
+PRAGMA table_info(pyappcache);
+"""
+
+# julianday() parses the old datetime strings (which were UTC)
+MIGRATE_FROM_V0_DDL = [
+    "DROP INDEX IF EXISTS pyappcache_expiry;",
+    "DROP INDEX IF EXISTS pyappcache_last_read;",
+    "ALTER TABLE pyappcache RENAME TO pyappcache_v0;",
+    """
+    CREATE TABLE pyappcache
+    (key TEXT PRIMARY KEY, value BLOB NOT NULL, expiry REAL, last_read REAL NOT NULL);
+    """,
+    """
+    INSERT INTO pyappcache (key, value, expiry, last_read)
+    SELECT
+        key,
+        value,
+        CASE
+            WHEN expiry = '-1' THEN NULL
+            ELSE (julianday(expiry) - 2440587.5) * 86400.0
+        END,
+        (julianday(last_read) - 2440587.5) * 86400.0
+    FROM pyappcache_v0;
+    """,
+    "DROP TABLE pyappcache_v0;",
+]
+
+# The totals table and its triggers are recreated afterwards
+MIGRATE_FROM_V1_DDL = [
+    "ALTER TABLE pyappcache ADD COLUMN size INTEGER NOT NULL DEFAULT 0;",
+    "UPDATE pyappcache SET size = length(value);",
+    "DROP TRIGGER IF EXISTS pyappcache_count_insert;",
+    "DROP TRIGGER IF EXISTS pyappcache_count_delete;",
+    "DROP TABLE IF EXISTS pyappcache_count;",
+]
+
+MIGRATIONS = [MIGRATE_FROM_V0_DDL, MIGRATE_FROM_V1_DDL]
+
+CREATE_LEASES_DDL = """
+CREATE TABLE IF NOT EXISTS pyappcache_leases
+(key PRIMARY KEY, token NOT NULL, expiry NOT NULL);
 """
 
 INDEX_DDL = [
@@ -25,49 +123,140 @@ INDEX_DDL = [
     """,
 ]
 
+# The row count and total size are kept up to date by triggers, so that it's
+# cheap to check whether eviction is needed.  (Sets delete and then insert,
+# rather than use INSERT OR REPLACE, as REPLACE's implicit deletes don't fire
+# triggers.)
+CREATE_TOTALS_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS pyappcache_totals (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        row_count INTEGER NOT NULL,
+        total_size INTEGER NOT NULL
+    );
+    """,
+    """
+    INSERT INTO pyappcache_totals (id, row_count, total_size)
+    SELECT
+        0,
+        (SELECT count(*) FROM pyappcache),
+        (SELECT coalesce(sum(size), 0) FROM pyappcache)
+    WHERE NOT EXISTS (SELECT 1 FROM pyappcache_totals);
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pyappcache_totals_insert
+    AFTER INSERT ON pyappcache
+    BEGIN
+        UPDATE pyappcache_totals
+        SET row_count = row_count + 1, total_size = total_size + NEW.size;
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pyappcache_totals_delete
+    AFTER DELETE ON pyappcache
+    BEGIN
+        UPDATE pyappcache_totals
+        SET row_count = row_count - 1, total_size = total_size - OLD.size;
+    END;
+    """,
+]
+
+GET_TOTALS_DQL = """
+SELECT row_count, total_size FROM pyappcache_totals;
+"""
+
+DELETE_DML = """
+DELETE FROM pyappcache
+WHERE key = ?;
+"""
+
 SET_DML = """
-INSERT OR REPLACE INTO pyappcache
-(key, value, expiry, last_read)
+INSERT INTO pyappcache
+(key, value, expiry, last_read, size)
 VALUES
-(?, ?, ?, ?);
+(?, ?, ?, ?, ?);
 """
 
 SET_DML_FOR_BLOBOPEN = """
-INSERT OR REPLACE INTO pyappcache
-(key, value, expiry, last_read)
+INSERT INTO pyappcache
+(key, value, expiry, last_read, size)
 VALUES
-(?, zeroblob(?), ?, ?);
+(?, zeroblob(?), ?, ?, ?);
 """
 
+# Walks the last_read index from the least recently read end, so costs the
+# number of rows deleted rather than the size of the table
 EVICT_DML = """
 DELETE FROM pyappcache
 WHERE key IN (
 SELECT key
 FROM pyappcache
-ORDER BY last_read DESC
-LIMIT -1 OFFSET ?
+ORDER BY last_read ASC
+LIMIT ?
 );
 """
 
-TOUCH_DML = """
+GET_LEAST_RECENTLY_READ_DQL = """
+SELECT key, size
+FROM pyappcache
+ORDER BY last_read ASC;
+"""
+
+RESTORE_DML = [
+    """
+    DELETE FROM pyappcache
+    WHERE key IN (
+        SELECT key
+        FROM pyappcache_snapshot.pyappcache
+        WHERE expiry IS NULL OR expiry >= ?
+    );
+    """,
+    """
+    INSERT INTO pyappcache (key, value, expiry, last_read, size)
+    SELECT key, value, expiry, last_read, size
+    FROM pyappcache_snapshot.pyappcache
+    WHERE expiry IS NULL OR expiry >= ?;
+    """,
+]
+
+# Uses the pyappcache_expiry index (NULLs, which never expire, don't match)
+PURGE_EXPIRED_DML = """
+DELETE FROM pyappcache
+WHERE key IN (
+SELECT key
+FROM pyappcache
+WHERE expiry < ?
+LIMIT ?
+);
+"""
+
+TOUCH_MANY_DML = """
 UPDATE pyappcache
 SET last_read = ?
-WHERE key = ?
-AND (expiry >= ? OR expiry = '-1');
+WHERE key IN ({placeholders})
+AND (expiry IS NULL OR expiry >= ?);
 """
 
-GET_DQL = """
-SELECT value
+# Touches are flushed some time after the read so must not go backwards (eg: if
+# the key has been set since)
+FLUSH_TOUCH_DML = """
+UPDATE pyappcache
+SET last_read = max(last_read, ?)
+WHERE key = ?;
+"""
+
+GET_MANY_DQL = """
+SELECT key, value
 FROM pyappcache
-WHERE key = ?
-AND (expiry >= ? OR expiry = '-1');
+WHERE key IN ({placeholders})
+AND (expiry IS NULL OR expiry >= ?);
 """
 
-GET_DQL_FOR_BLOBOPEN = """
-SELECT rowid
+GET_MANY_DQL_FOR_BLOBOPEN = """
+SELECT key, rowid
 FROM pyappcache
-WHERE key = ?
-AND (expiry >= ? OR expiry = '-1');
+WHERE key IN ({placeholders})
+AND (expiry IS NULL OR expiry >= ?);
 """
 
 GET_TTL_DQL = """
@@ -76,9 +265,28 @@ FROM pyappcache
 WHERE key = ?;
 """
 
-INVALIDATE_DML = """
+INVALIDATE_MANY_DML = """
 DELETE FROM pyappcache
-WHERE key = ?;
+WHERE key IN ({placeholders});
+"""
+
+EXPIRE_LEASE_DML = """
+DELETE FROM pyappcache_leases
+WHERE key = ?
+AND expiry < ?;
+"""
+
+ACQUIRE_LEASE_DML = """
+INSERT OR IGNORE INTO pyappcache_leases
+(key, token, expiry)
+VALUES
+(?, ?, ?);
+"""
+
+RELEASE_LEASE_DML = """
+DELETE FROM pyappcache_leases
+WHERE key = ?
+AND token = ?;
 """
 
 CLEAR_DML = """
@@ -89,9 +297,21 @@ DELETE FROM pyappcache;
 # their processes by accident
 MAX_SIZE = 10_000
 
+# Expired rows are deleted this many at a time, to bound how long the write
+# lock is held
+PURGE_BATCH_SIZE = 500
+
+# Older versions of sqlite limit queries to 999 bound parameters so bulk
+# operations are done in chunks of this size
+MAX_KEYS_PER_QUERY = 500
+
 
 _in_memory_conn = None
 
+# Serialises writes (and some reads) by every SqliteCache using the shared
+# in-memory connection
+_in_memory_lock = threading.Lock()
+
 
 def get_in_memory_conn():
     """Get a shared in-memory connection.
@@ -106,120 +326,692 @@ def get_in_memory_conn():
         # This avoids clobbering other in memory sqlite databases (but allows
         # us to use them from different threads)
         _in_memory_conn = sqlite3.connect(
-            "file:pyappcache_memory?mode=memory&cache=shared"
+            "file:pyappcache_memory?mode=memory&cache=shared",
+            check_same_thread=False,
         )
     return _in_memory_conn
 
 
+class _ThreadConnection:
+    """A thread's connection, kept in a thread local.  Thread locals are
+    deleted when their thread ends, which is how :class:`_ConnectionPool`
+    knows to close the connection."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+
+class _ConnectionPool:
+    """One connection per thread, each closed when its thread ends (or by
+    :meth:`close`).
+
+    Nothing here may refer back to the cache using the pool, or the cache
+    would be kept alive by the finalizers of its threads' connections.
+
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection]):
+        self._connect = connect
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._conns)
+
+    def get(self) -> sqlite3.Connection:
+        """The connection for the current thread."""
+        thread_conn: Optional[_ThreadConnection] = getattr(self._local, "conn", None)
+        if thread_conn is None:
+            thread_conn = _ThreadConnection(self._connect())
+            with self._lock:
+                self._conns.append(thread_conn.conn)
+            weakref.finalize(
+                thread_conn, _release, self._conns, self._lock, thread_conn.conn
+            )
+            self._local.conn = thread_conn
+        return thread_conn.conn
+
+    def close(self) -> None:
+        """Close every connection.  New ones are opened as required."""
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+        self._local = threading.local()
+
+
+def _release(
+    conns: List[sqlite3.Connection], lock: threading.Lock, conn: sqlite3.Connection
+) -> None:
+    """Close a connection of a :class:`_ConnectionPool` whose thread has
+    ended."""
+    with lock:
+        if conn not in conns:
+            # Already closed by close()
+            return
+        conns.remove(conn)
+    conn.close()
+
+
+def _connect(
+    database: str, memory_uri: str, busy_timeout_seconds: float
+) -> sqlite3.Connection:
+    # Each connection is only used by one thread but close() may be called
+    # from any
+    if database == ":memory:":
+        conn = sqlite3.connect(
+            memory_uri,
+            uri=True,
+            timeout=busy_timeout_seconds,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA read_uncommitted = 1;")
+    else:
+        conn = sqlite3.connect(
+            database, timeout=busy_timeout_seconds, check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA synchronous = NORMAL;")
+    return conn
+
+
 class SqliteCache(Cache):
     """Implementation of an LRU cache using sqlite3.
 
     Note that as this is an LRU cache data accesses require write access (in
     order to update the last-used time).
+
+    Concurrency: by default (or when passed a ``connection``) every thread
+    uses the same sqlite connection, so only one thread at a time can use the
+    cache.  When passed a ``database`` instead, each thread opens its own
+    connection (closed when the thread ends):
+
+    - for a database file, connections use WAL mode (with
+      ``synchronous=NORMAL``) so that any number of threads *and processes*
+      can read while one writes.  Writers wait for each other for up to
+      ``busy_timeout_seconds``.
+    - for ``":memory:"``, a private in-memory database is opened in sqlite's
+      shared-cache mode.  Readers do not take locks (``read_uncommitted``) and
+      writers within the process take turns.
+
+    Either way, by default each read also writes (the key's last read time),
+    so reads take turns with each other just as writes do.  For reads of a
+    database file to really happen at once, set ``touch_interval_seconds``
+    too.
+
     """
 
+    DEFAULT_BUSY_TIMEOUT_SECONDS = 5.0
+
     def __init__(
-        self, max_size: int = MAX_SIZE, connection: Optional[sqlite3.Connection] = None
+        self,
+        max_size: Optional[int] = MAX_SIZE,
+        connection: Optional[sqlite3.Connection] = None,
+        database: Optional[str] = None,
+        busy_timeout_seconds: float = DEFAULT_BUSY_TIMEOUT_SECONDS,
+        touch_interval_seconds: float = 0,
+        max_size_bytes: Optional[int] = None,
+        stream_reads: bool = False,
     ):
         """
 
-        :parameter max_size: Maximum size of the LRU cache.  Defaults to 10,000
+        :parameter max_size: Maximum number of keys in the LRU cache (or None
+            for no maximum).  Defaults to 10,000
         :parameter connection: Optionally, you can pass a sqlite3 connection. By
             default an in-memory database will be used (this will be is shared between all
             instances).
+        :parameter database: Optionally, instead of a connection, the path of a
+            database file (or ``":memory:"``) to open one connection per
+            thread to.
+        :parameter busy_timeout_seconds: When using ``database``, how long to
+            wait for other writers before giving up.
+        :parameter touch_interval_seconds: By default each read also writes
+            the key's last read time.  If this is set, last read times are
+            instead buffered in memory and written in batches, at most this
+            many seconds apart (or every :attr:`touch_batch_size` reads), so
+            that a hit is just a ``SELECT`` (which, with ``database`` set to
+            a file, doesn't wait for writers).  Eviction order is then only
+            approximately LRU.
+        :parameter max_size_bytes: Optionally, a maximum total size for
+            values, in bytes.  Least recently read keys are evicted to stay
+            within both this and ``max_size``.  A value bigger than this on
+            its own is not stored (and a warning is logged).
+        :parameter stream_reads: If True (and on Python 3.11+), values are
+            read from the database as they are deserialised, rather than
+            copied into memory first, which roughly halves the peak memory
+            needed to read a large value.  Values are read from a connection
+            after it has let go of the write lock, so this needs ``database``
+            to be the path of a file (where each thread's connection reads
+            from its own snapshot): otherwise reads and writes by other
+            threads would break, or be broken by, half read values.  A value
+            must still be read before the same thread touches or sets its key
+            again.  Values stored with an envelope (see
+            :meth:`~pyappcache.cache.Cache.get_via`) are always copied.
 
         """
         super().__init__()
-        if connection is None:
-            self.conn = get_in_memory_conn()
+        if connection is not None and database is not None:
+            raise ValueError("pass either a connection or a database, not both")
+        if stream_reads and database in (None, ":memory:"):
+            raise ValueError("stream_reads needs database to be a file")
+        #: The database file each thread connects to (or None if all threads
+        #: share one connection)
+        self.database = database
+        self.busy_timeout_seconds = busy_timeout_seconds
+        self._memory_uri = f"file:pyappcache_{uuid4().hex}?mode=memory&cache=shared"
+        self._pool = _ConnectionPool(
+            partial(
+                _connect, cast(str, database), self._memory_uri, busy_timeout_seconds
+            )
+        )
+        weakref.finalize(self, self._pool.close)
+        # Writes within this process are serialised here rather than by
+        # sqlite, which can't wait for shared-cache locks
+        self._write_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection]
+        # A shared-cache in-memory database only lasts as long as some
+        # connection to it is open, so one is kept open while threads come
+        # and go
+        self._memory_keepalive: Optional[sqlite3.Connection] = None
+        if database is not None:
+            self._conn = None
+            if database == ":memory:":
+                self._memory_keepalive = _connect(
+                    database, self._memory_uri, busy_timeout_seconds
+                )
+        elif connection is None:
+            self._conn = get_in_memory_conn()
+            self._write_lock = _in_memory_lock
         else:
-            self.conn = connection
+            self._conn = connection
 
         # the blobopen API is newish, 3.11+
         self._has_blobopen = hasattr(self.conn, "blobopen")
+        self._stream_reads = stream_reads
 
         self.max_size = max_size
-        with closing(self.conn.cursor()) as cursor:
-            cursor.execute(CREATE_DDL)
-            for index_ddl in INDEX_DDL:
-                cursor.execute(index_ddl)
-            self.conn.commit()
-
-    def get_raw(self, raw_key: str) -> Optional[IO[bytes]]:  # pragma: no cover
-        now = datetime.utcnow()
-        with closing(self.conn.cursor()) as cursor:
-            cursor.execute(TOUCH_DML, (now, raw_key, now))
-            if self._has_blobopen:
-                cursor.execute(GET_DQL_FOR_BLOBOPEN, (raw_key, now))
-            else:
-                cursor.execute(GET_DQL, (raw_key, now))
-            v = cursor.fetchone()
-        if v is not None:
-            if self._has_blobopen:
-                rowid = v[0]
-                blob = self.conn.blobopen("pyappcache", "value", rowid, readonly=True)
-                # we need readline above in the stack, for pickle.
-                # frustratingly sqlite3.Blob does not have that and none of the
-                # wrappers in io seem able to polyfill it
-                rv = io.BytesIO()
-                shutil.copyfileobj(blob, rv)
-                rv.seek(0)
+        self.max_size_bytes = max_size_bytes
+        #: Once there are more than ``max_size`` rows, evict down to this many
+        #: (default: ``max_size``).  Lower values mean evicting less often, in
+        #: bigger batches.
+        self.low_water_mark: Optional[int] = None
+        #: As ``low_water_mark``, but for ``max_size_bytes``
+        self.low_water_mark_bytes: Optional[int] = None
+        #: Expired rows are skipped by reads but otherwise stay until evicted.
+        #: Every this many sets, a batch of them is deleted (0 to never do
+        #: this - see also :meth:`purge_expired`)
+        self.purge_every_n_sets = 1000
+        self._sets_since_purge = 0
+        self._snapshot_stop: Optional[threading.Event] = None
+        #: Maximum seconds between writes of buffered last read times (0 to
+        #: write them on every read)
+        self.touch_interval_seconds = touch_interval_seconds
+        #: Maximum number of buffered last read times
+        self.touch_batch_size = 1000
+        self._touches: Dict[str, float] = {}
+        self._touch_lock = threading.Lock()
+        self._next_touch_flush = time.monotonic() + touch_interval_seconds
+        with self._write_lock:
+            _create_or_migrate(self.conn)
+
+    @property
+    def stream_reads(self) -> bool:
+        """Whether values are streamed from the database (see the
+        ``stream_reads`` argument of :meth:`__init__`)."""
+        return self._stream_reads
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The connection for the current thread."""
+        if self._conn is not None:
+            return self._conn
+        return self._pool.get()
+
+    def close(self) -> None:
+        """Close all connections opened for ``database`` (each thread's
+        connection is also closed when the thread ends).  Connections that
+        were passed in are left alone.
+
+        Also stops :meth:`auto_snapshot`, if it was started."""
+        if self._snapshot_stop is not None:
+            self._snapshot_stop.set()
+            atexit.unregister(self._auto_snapshot)
+            self._snapshot_stop = None
+        # The in-memory database itself is kept (see _memory_keepalive) so
+        # that the cache can still be used afterwards
+        self._pool.close()
+
+    def snapshot(self, path: Path) -> None:
+        """Copy the database to a file at ``path`` (atomically replacing any
+        existing file), using sqlite's online backup API."""
+        temp_path = path.with_name(f".{path.name}.{uuid4().hex}")
+        try:
+            with self._write_lock:
+                self._flush_touches()
+                self.conn.commit()
+                with closing(sqlite3.connect(str(temp_path))) as snapshot_conn:
+                    self.conn.backup(snapshot_conn)
+            os.replace(temp_path, path)
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    def restore(self, path: Path) -> int:
+        """Load the unexpired keys from a file made by :meth:`snapshot`,
+        overwriting any existing keys of the same name.  Returns the number of
+        keys restored."""
+        with closing(sqlite3.connect(str(path))) as snapshot_conn, closing(
+            snapshot_conn.cursor()
+        ) as snapshot_cursor:
+            version = _get_schema_version(snapshot_cursor)
+        if version != SCHEMA_VERSION:
+            logger.warning("not restoring %s: schema version is %s", path, version)
+            return 0
+        with self._write_lock, closing(self.conn.cursor()) as cursor:
+            cursor.execute("ATTACH DATABASE ? AS pyappcache_snapshot;", (str(path),))
+            try:
+                now = time.time()
+                cursor.execute(RESTORE_DML[0], (now,))
+                cursor.execute(RESTORE_DML[1], (now,))
+                restored = cursor.rowcount
+                self._evict(cursor)
+                self.conn.commit()
+            finally:
+                cursor.execute("DETACH DATABASE pyappcache_snapshot;")
+        return restored
+
+    def auto_snapshot(self, path: Path, interval_seconds: float = 300) -> None:
+        """Restore from ``path`` (if it exists) and then keep it up to date:
+        snapshotting every ``interval_seconds`` on a background thread and
+        again when the interpreter exits.  This means that a restarted
+        process starts with a warm cache."""
+        if path.exists():
+            self.restore(path)
+        self._snapshot_stop = stop = threading.Event()
+
+        def snapshot_periodically() -> None:
+            while not stop.wait(interval_seconds):
+                self._auto_snapshot(path)
+
+        threading.Thread(
+            target=snapshot_periodically, name="pyappcache-snapshot", daemon=True
+        ).start()
+        atexit.register(self._auto_snapshot, path)
+
+    def _auto_snapshot(self, path: Path) -> None:
+        try:
+            self.snapshot(path)
+        except Exception:
+            logger.exception("unable to snapshot to %s", path)
+
+    def get_raw(self, raw_key: str) -> Optional[IO[bytes]]:
+        return self.get_many_raw([raw_key])[0]
+
+    def get_many_raw(self, raw_keys: Sequence[str]) -> List[Optional[IO[bytes]]]:
+        now = time.time()
+        if self._has_blobopen:
+            get_dql = GET_MANY_DQL_FOR_BLOBOPEN
+        else:  # pragma: no cover
+            get_dql = GET_MANY_DQL
+        found: Dict[str, Any] = {}
+        if self.touch_interval_seconds != 0:
+            # Each thread's own connection to a WAL database reads from a
+            # snapshot, so needs no lock - but other connections would see
+            # (and be upset by) writes from other threads
+            if self._conn is None and self.database != ":memory:":
+                lock: ContextManager[Any] = nullcontext()
             else:
-                (cache_contents,) = v
-                rv = io.BytesIO(cache_contents)
-        else:
-            rv = None
-        self.conn.commit()
+                lock = self._write_lock
+            with lock, closing(self.conn.cursor()) as cursor:
+                # One transaction, so that the rows found are still there
+                # when their values are read
+                if not self.conn.in_transaction:
+                    cursor.execute("BEGIN;")
+                try:
+                    for chunk in _chunked(raw_keys, MAX_KEYS_PER_QUERY):
+                        cursor.execute(
+                            get_dql.format(placeholders=_placeholders(len(chunk))),
+                            (*chunk, now),
+                        )
+                        found.update(cursor.fetchall())
+                    rv = [
+                        self._read_value(found[raw_key]) if raw_key in found else None
+                        for raw_key in raw_keys
+                    ]
+                finally:
+                    self.conn.commit()
+            self._buffer_touches(found.keys(), now)
+            return rv
+        with self._write_lock:
+            with closing(self.conn.cursor()) as cursor:
+                for chunk in _chunked(raw_keys, MAX_KEYS_PER_QUERY):
+                    placeholders = _placeholders(len(chunk))
+                    cursor.execute(
+                        TOUCH_MANY_DML.format(placeholders=placeholders),
+                        (now, *chunk, now),
+                    )
+                    cursor.execute(
+                        get_dql.format(placeholders=placeholders), (*chunk, now)
+                    )
+                    found.update(cursor.fetchall())
+            rv = [
+                self._read_value(found[raw_key]) if raw_key in found else None
+                for raw_key in raw_keys
+            ]
+            self.conn.commit()
         return rv
 
-    def set_raw(
-        self, key_bytes: str, value_bytes: IO[bytes], ttl: int
-    ) -> None:  # pragma: no cover
-        last_read = datetime.utcnow()
-        expiry: Union[str, datetime]
+    def _buffer_touches(self, raw_keys: Iterable[str], now: float) -> None:
+        with self._touch_lock:
+            for raw_key in raw_keys:
+                self._touches[raw_key] = now
+            due = (
+                len(self._touches) >= self.touch_batch_size
+                or time.monotonic() >= self._next_touch_flush
+            )
+        if due:
+            self.flush_touches()
+
+    def flush_touches(self) -> None:
+        """Write any buffered last read times to the database (see
+        ``touch_interval_seconds``)."""
+        with self._write_lock:
+            self._flush_touches()
+            self.conn.commit()
+
+    def _flush_touches(self) -> None:
+        # Must hold the write lock
+        with self._touch_lock:
+            touches = self._touches
+            self._touches = {}
+            self._next_touch_flush = time.monotonic() + self.touch_interval_seconds
+        if len(touches) > 0:
+            self.conn.executemany(
+                FLUSH_TOUCH_DML, [(now, key) for key, now in touches.items()]
+            )
+
+    def _read_value(self, value: Any) -> IO[bytes]:
+        if self._has_blobopen:
+            blob = self.conn.blobopen(  # type: ignore[attr-defined]
+                "pyappcache", "value", value, readonly=True
+            )
+            # we need readline above in the stack, for pickle.
+            # frustratingly sqlite3.Blob does not have that, so either wrap it
+            # or copy it
+            if self._stream_reads:
+                return io.BufferedReader(_BlobReader(blob))
+            rv = io.BytesIO()
+            shutil.copyfileobj(blob, rv)
+            rv.seek(0)
+            return rv
+        else:  # pragma: no cover
+            return io.BytesIO(value)
+
+    def set_raw(self, key_bytes: str, value_bytes: IO[bytes], ttl: int) -> None:
+        self.set_many_raw({key_bytes: value_bytes}, ttl)
+
+    def set_many_raw(self, items: Mapping[str, IO[bytes]], ttl: int) -> None:
+        last_read = time.time()
+        expiry: Optional[float]
         if ttl != 0:
-            expiry = last_read + timedelta(seconds=ttl)
+            expiry = last_read + ttl
         else:
-            expiry = "-1"
-        with closing(self.conn.cursor()) as cursor:
-            if self._has_blobopen:
-                value_bytes.seek(0, io.SEEK_END)
-                value_length = value_bytes.tell()
-                value_bytes.seek(0)
-                cursor.execute(
-                    SET_DML_FOR_BLOBOPEN, (key_bytes, value_length, expiry, last_read)
-                )
-                rowid = cursor.lastrowid
-                with closing(self.conn.blobopen("pyappcache", "value", rowid)) as blob:
-                    shutil.copyfileobj(value_bytes, blob)
-            else:
-                cursor.execute(
-                    SET_DML, (key_bytes, value_bytes.read(), expiry, last_read)
-                )
-            cursor.execute(EVICT_DML, (self.max_size,))
+            expiry = None
+        with self._write_lock, closing(self.conn.cursor()) as cursor:
+            # So that eviction sees recent reads
+            self._flush_touches()
+            for key_bytes, value_bytes in items.items():
+                # The old value goes even if the new one is too big to keep
+                cursor.execute(DELETE_DML, (key_bytes,))
+                if self._has_blobopen:
+                    value_bytes.seek(0, io.SEEK_END)
+                    value_length = value_bytes.tell()
+                    value_bytes.seek(0)
+                    if self._too_big(key_bytes, value_length):
+                        continue
+                    cursor.execute(
+                        SET_DML_FOR_BLOBOPEN,
+                        (key_bytes, value_length, expiry, last_read, value_length),
+                    )
+                    rowid = cursor.lastrowid
+                    with closing(
+                        self.conn.blobopen(  # type: ignore[attr-defined]
+                            "pyappcache", "value", rowid
+                        )
+                    ) as blob:
+                        shutil.copyfileobj(value_bytes, blob)
+                else:  # pragma: no cover
+                    value = value_bytes.read()
+                    if self._too_big(key_bytes, len(value)):
+                        continue
+                    cursor.execute(
+                        SET_DML, (key_bytes, value, expiry, last_read, len(value))
+                    )
+            self._evict(cursor)
+            self._sets_since_purge += len(items)
+            if 0 < self.purge_every_n_sets <= self._sets_since_purge:
+                self._sets_since_purge = 0
+                cursor.execute(PURGE_EXPIRED_DML, (last_read, PURGE_BATCH_SIZE))
 
             self.conn.commit()
 
+    def _too_big(self, key_bytes: str, value_length: int) -> bool:
+        """Whether a value is too big to keep, given max_size_bytes.  If it was
+        set it would just evict everything, itself included."""
+        if self.max_size_bytes is not None and value_length > self.max_size_bytes:
+            logger.warning(
+                "unable to set %s as it is bigger than max_size_bytes (%d bytes)",
+                key_bytes,
+                value_length,
+            )
+            return True
+        return False
+
+    def purge_expired(self) -> int:
+        """Delete all expired rows, in batches.  Returns the number deleted."""
+        purged = 0
+        while True:
+            with self._write_lock, closing(self.conn.cursor()) as cursor:
+                cursor.execute(PURGE_EXPIRED_DML, (time.time(), PURGE_BATCH_SIZE))
+                deleted = cursor.rowcount
+                self.conn.commit()
+            purged += deleted
+            if deleted < PURGE_BATCH_SIZE:
+                return purged
+
+    def _evict(self, cursor: sqlite3.Cursor) -> None:
+        row_count, total_size = cursor.execute(GET_TOTALS_DQL).fetchone()
+        rows_over = 0
+        if self.max_size is not None and row_count > self.max_size:
+            rows_over = row_count - _low_water(self.max_size, self.low_water_mark)
+        bytes_over = 0
+        if self.max_size_bytes is not None and total_size > self.max_size_bytes:
+            bytes_over = total_size - _low_water(
+                self.max_size_bytes, self.low_water_mark_bytes
+            )
+        if bytes_over == 0:
+            if rows_over > 0:
+                cursor.execute(EVICT_DML, (rows_over,))
+            return
+        # How many rows to evict depends on their sizes, so walk them from the
+        # least recently read end until enough have been found
+        evictees: List[str] = []
+        freed = 0
+        with closing(self.conn.execute(GET_LEAST_RECENTLY_READ_DQL)) as lrr_cursor:
+            for key, size in lrr_cursor:
+                if freed >= bytes_over and len(evictees) >= rows_over:
+                    break
+                evictees.append(key)
+                freed += size
+        for chunk in _chunked(evictees, MAX_KEYS_PER_QUERY):
+            cursor.execute(
+                INVALIDATE_MANY_DML.format(placeholders=_placeholders(len(chunk))),
+                chunk,
+            )
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of rows and their total size in bytes (including
+        expired rows that have not yet been removed).  Cheap: these are
+        running totals."""
+        with closing(self.conn.cursor()) as cursor:
+            row_count, total_size = cursor.execute(GET_TOTALS_DQL).fetchone()
+        return {"row_count": row_count, "total_size_bytes": total_size}
+
     def ttl(self, key_bytes: str) -> Optional[int]:
         """Returns the (remaining) TTL of the given key."""
-        now = datetime.utcnow()
         with closing(self.conn.cursor()) as cursor:
             cursor.execute(GET_TTL_DQL, (key_bytes,))
             row = cursor.fetchone()
-        if row is not None:
-            expiry = row[0]
-            expiry_dt = parse_dt(expiry)
-            ttl_td = expiry_dt - now
-            return int(ttl_td.total_seconds())
-        else:
+        if row is None or row[0] is None:
             return None
+        return int(row[0] - time.time())
 
     def invalidate_raw(self, raw_key: str) -> None:
-        with closing(self.conn.cursor()) as cursor:
-            cursor.execute(INVALIDATE_DML, (raw_key,))
+        self.invalidate_many_raw([raw_key])
+
+    def invalidate_many_raw(self, raw_keys: Sequence[str]) -> None:
+        with self._write_lock, closing(self.conn.cursor()) as cursor:
+            for chunk in _chunked(raw_keys, MAX_KEYS_PER_QUERY):
+                cursor.execute(
+                    INVALIDATE_MANY_DML.format(placeholders=_placeholders(len(chunk))),
+                    chunk,
+                )
             self.conn.commit()
 
-    def clear(self) -> None:
-        with closing(self.conn.cursor()) as cursor:
+    def acquire_lease_raw(
+        self, lease_key_str: str, token: str, ttl_seconds: float
+    ) -> bool:
+        with self._write_lock:
+            return _acquire_lease(self.conn, lease_key_str, token, ttl_seconds)
+
+    def release_lease_raw(self, lease_key_str: str, token: str) -> None:
+        with self._write_lock:
+            _release_lease(self.conn, lease_key_str, token)
+
+    def clear_raw(self) -> None:
+        with self._write_lock, closing(self.conn.cursor()) as cursor:
             cursor.execute(CLEAR_DML)
             self.conn.commit()
+
+
+class _BlobReader(io.RawIOBase):
+    """Adapts a sqlite3.Blob (3.11+) to a raw stream, so that it can be put
+    inside an io.BufferedReader (which provides readline, etc)."""
+
+    # Large reads are done in pieces of this size, so that there is never a
+    # second full sized copy of the value
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, blob: Any):
+        self._blob = blob
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        view = memoryview(buffer).cast("B")
+        total = 0
+        while total < len(view):
+            chunk = self._blob.read(min(len(view) - total, self.CHUNK_SIZE))
+            if len(chunk) == 0:
+                break
+            view[total : total + len(chunk)] = chunk
+            total += len(chunk)
+        return total
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._blob.seek(offset, whence)
+        return self.tell()
+
+    def tell(self) -> int:
+        return cast(int, self._blob.tell())
+
+    def close(self) -> None:
+        if not self.closed:
+            self._blob.close()
+        super().close()
+
+
+def _create_or_migrate(conn: sqlite3.Connection) -> None:
+    """Create the tables and indexes, migrating the old schema if present."""
+    with closing(conn.cursor()) as cursor:
+        # IMMEDIATE so that two processes can't both migrate the same database
+        if not conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE;")
+        version = _get_schema_version(cursor)
+        if version is not None:
+            for from_version in range(version, SCHEMA_VERSION):
+                logger.info("migrating pyappcache table from v%d", from_version)
+                for ddl in MIGRATIONS[from_version]:
+                    cursor.execute(ddl)
+        cursor.execute(CREATE_DDL)
+        cursor.execute(CREATE_LEASES_DDL)
+        for index_ddl in INDEX_DDL:
+            cursor.execute(index_ddl)
+        for totals_ddl in CREATE_TOTALS_DDL:
+            cursor.execute(totals_ddl)
+        cursor.execute(CREATE_SCHEMA_DDL)
+        cursor.execute(SET_SCHEMA_VERSION_DML, (SCHEMA_VERSION,))
+        conn.commit()
+
+
+def _get_schema_version(cursor: sqlite3.Cursor) -> Optional[int]:
+    """Return the schema version of the pyappcache table, or None if there
+    isn't one.  Tables from before the version was recorded are recognised by
+    their columns."""
+    if cursor.execute(TABLE_EXISTS_DQL, ("pyappcache",)).fetchone() is None:
+        return None
+    if cursor.execute(TABLE_EXISTS_DQL, ("pyappcache_schema",)).fetchone():
+        (version,) = cursor.execute(GET_SCHEMA_VERSION_DQL).fetchone()
+        return cast(int, version)
+    column_types = {
+        name: column_type
+        for _, name, column_type, *_ in cursor.execute(GET_COLUMNS_DQL).fetchall()
+    }
+    if "size" in column_types:
+        return 2
+    elif column_types["expiry"] == "REAL":
+        return 1
+    else:
+        return 0
+
+
+def _low_water(high_water: int, low_water: Optional[int]) -> int:
+    if low_water is None:
+        return high_water
+    else:
+        return min(low_water, high_water)
+
+
+def _acquire_lease(
+    conn: sqlite3.Connection, lease_key_str: str, token: str, ttl_seconds: float
+) -> bool:
+    """Take a lease, stored in the pyappcache_leases table, unless someone
+    else holds an unexpired one."""
+    now = time.time()
+    with closing(conn.cursor()) as cursor:
+        cursor.execute(EXPIRE_LEASE_DML, (lease_key_str, now))
+        cursor.execute(ACQUIRE_LEASE_DML, (lease_key_str, token, now + ttl_seconds))
+        acquired = cursor.rowcount == 1
+        conn.commit()
+    return acquired
+
+
+def _release_lease(conn: sqlite3.Connection, lease_key_str: str, token: str) -> None:
+    with closing(conn.cursor()) as cursor:
+        cursor.execute(RELEASE_LEASE_DML, (lease_key_str, token))
+        conn.commit()
+
+
+def _chunked(seq: Sequence[T], size: int) -> Iterator[Sequence[T]]:
+    """Split a sequence into chunks of at most size elements."""
+    for index in range(0, len(seq), size):
+        yield seq[index : index + size]
+
+
+def _placeholders(count: int) -> str:
+    """Return a comma separated list of count sqlite parameter placeholders."""
+    return ", ".join("?" * count)
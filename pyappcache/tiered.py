@@ -0,0 +1,203 @@
+from logging import getLogger
+from typing import Optional, Any, Dict, IO, List, Mapping, Sequence, Tuple
+
+from .cache import Cache
+from .envelope import Envelope
+from .keys import Key
+from .lru import LRU
+
+logger = getLogger(__name__)
+
+
+class TieredCache(Cache):
+    """A two tier cache: a small, bounded, in-process LRU (the "L1") in front
+    of any other :class:`~pyappcache.cache.Cache` (the "L2"), such as
+    :class:`~pyappcache.redis.RedisCache`.
+
+    The L1 holds deserialised Python objects, so an L1 hit skips both the
+    network and the serialiser.  Bear in mind that this means that L1 hits
+    return the *same* object each time - so don't mutate them.
+
+    Sets and invalidations go to both tiers.  Other processes can't invalidate
+    this process's L1, so entries in it are only kept for
+    ``l1_ttl_seconds``, which bounds how stale an L1 hit can be.
+
+    """
+
+    DEFAULT_L1_MAX_SIZE = 1000
+
+    DEFAULT_L1_TTL_SECONDS = 60
+
+    def __init__(
+        self,
+        l2: Cache,
+        l1_max_size: int = DEFAULT_L1_MAX_SIZE,
+        l1_ttl_seconds: int = DEFAULT_L1_TTL_SECONDS,
+        l2_max_ttl_seconds: Optional[int] = None,
+    ):
+        """
+
+        :param l2: The cache to put the L1 in front of.  Its prefix,
+            compressor and serialiser are used.
+        :param l1_max_size: Maximum number of entries in the L1.
+        :param l1_ttl_seconds: Maximum time an entry is kept in the L1,
+            regardless of the TTL it was set with.
+        :param l2_max_ttl_seconds: Optionally, a maximum TTL for entries
+            written to the L2.  By default the TTL is passed through as is.
+
+        """
+        super().__init__(prefix=l2.prefix)
+        self.compressor = l2.compressor
+        self.serialiser = l2.serialiser
+        #: The cache behind the L1
+        self.l2 = l2
+        #: Maximum number of seconds an entry is kept in the L1
+        self.l1_ttl_seconds = l1_ttl_seconds
+        #: Maximum TTL for entries in the L2 (None for no maximum)
+        self.l2_max_ttl_seconds = l2_max_ttl_seconds
+
+        self._l1 = LRU(l1_max_size)
+
+        #: Number of lookups that were answered by the L1
+        self.l1_hits = 0
+        #: Number of lookups that were not answered by the L1
+        self.l1_misses = 0
+        #: Number of L1 misses that were answered by the L2
+        self.l2_hits = 0
+        #: Number of L1 misses that were not answered by the L2 either
+        self.l2_misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit and miss counts for each tier."""
+        return {
+            "l1_hits": self.l1_hits,
+            "l1_misses": self.l1_misses,
+            "l2_hits": self.l2_hits,
+            "l2_misses": self.l2_misses,
+        }
+
+    @property
+    def l1_max_size(self) -> int:
+        """Maximum number of entries in the L1"""
+        return self._l1.max_size
+
+    @l1_max_size.setter
+    def l1_max_size(self, l1_max_size: int) -> None:
+        self._l1.max_size = l1_max_size
+
+    def _l1_get(self, raw_key: str) -> Tuple[bool, Any, Optional[Envelope]]:
+        entry = self._l1.get(raw_key)
+        if entry is not None:
+            self.l1_hits += 1
+            return True, entry.value, entry.metadata
+        else:
+            self.l1_misses += 1
+            return False, None, None
+
+    def _l1_set(
+        self,
+        raw_key: str,
+        value: Any,
+        ttl_seconds: int = 0,
+        envelope: Optional[Envelope] = None,
+    ) -> None:
+        if ttl_seconds == 0:
+            ttl_seconds = self.l1_ttl_seconds
+        else:
+            ttl_seconds = min(ttl_seconds, self.l1_ttl_seconds)
+        self._l1.set(raw_key, value, ttl_seconds, envelope)
+
+    def _l2_ttl(self, ttl_seconds: int) -> int:
+        if self.l2_max_ttl_seconds is None:
+            return ttl_seconds
+        elif ttl_seconds == 0:
+            return self.l2_max_ttl_seconds
+        else:
+            return min(ttl_seconds, self.l2_max_ttl_seconds)
+
+    def _get_enveloped_value(
+        self, raw_key: str
+    ) -> Tuple[Optional[Any], Optional[Envelope]]:
+        found, value, envelope = self._l1_get(raw_key)
+        if found:
+            return value, envelope
+        cache_contents = self.l2.get_raw(raw_key)
+        if cache_contents is None:
+            self.l2_misses += 1
+            return None, None
+        self.l2_hits += 1
+        value, envelope = self._load_enveloped(cache_contents)
+        if value is not None:
+            self._l1_set(raw_key, value, envelope=envelope)
+        return value, envelope
+
+    def _get_values(self, raw_keys: Sequence[str]) -> Dict[str, Any]:
+        values = {}
+        l1_misses = []
+        for raw_key in raw_keys:
+            found, value, _ = self._l1_get(raw_key)
+            if found:
+                values[raw_key] = value
+            else:
+                l1_misses.append(raw_key)
+        if len(l1_misses) > 0:
+            for raw_key, cache_contents in zip(
+                l1_misses, self.l2.get_many_raw(l1_misses)
+            ):
+                if cache_contents is None:
+                    self.l2_misses += 1
+                    continue
+                self.l2_hits += 1
+                value, envelope = self._load_enveloped(cache_contents)
+                if value is not None:
+                    self._l1_set(raw_key, value, envelope=envelope)
+                    values[raw_key] = value
+        return values
+
+    def _set_value(
+        self,
+        raw_key: str,
+        value: Any,
+        ttl_seconds: int,
+        key: Optional[Key] = None,
+        compress: bool = False,
+        envelope: Optional[Envelope] = None,
+    ) -> None:
+        self.set_raw(raw_key, self._dump(value, key, compress, envelope), ttl_seconds)
+        self._l1_set(raw_key, value, ttl_seconds, envelope)
+
+    def get_raw(self, key_str: str) -> Optional[IO[bytes]]:
+        return self.l2.get_raw(key_str)
+
+    def get_many_raw(self, key_strs: Sequence[str]) -> List[Optional[IO[bytes]]]:
+        return self.l2.get_many_raw(key_strs)
+
+    def set_raw(self, key_str: str, value_bytes: IO[bytes], ttl_seconds: int) -> None:
+        # Raw values don't have a Python object to put in the L1, so just make
+        # sure it doesn't have an old one
+        self._l1.pop_many([key_str])
+        self.l2.set_raw(key_str, value_bytes, self._l2_ttl(ttl_seconds))
+
+    def set_many_raw(self, items: Mapping[str, IO[bytes]], ttl_seconds: int) -> None:
+        self._l1.pop_many(list(items.keys()))
+        self.l2.set_many_raw(items, self._l2_ttl(ttl_seconds))
+
+    def invalidate_raw(self, key_str: str) -> None:
+        self._l1.pop_many([key_str])
+        self.l2.invalidate_raw(key_str)
+
+    def invalidate_many_raw(self, key_strs: Sequence[str]) -> None:
+        self._l1.pop_many(key_strs)
+        self.l2.invalidate_many_raw(key_strs)
+
+    def acquire_lease_raw(
+        self, lease_key_str: str, token: str, ttl_seconds: float
+    ) -> bool:
+        return self.l2.acquire_lease_raw(lease_key_str, token, ttl_seconds)
+
+    def release_lease_raw(self, lease_key_str: str, token: str) -> None:
+        self.l2.release_lease_raw(lease_key_str, token)
+
+    def clear_raw(self) -> None:
+        self._l1.clear()
+        self.l2.clear()
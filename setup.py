@@ -3,8 +3,10 @@ from setuptools import setup, find_packages
 VERSION = open("VERSION").read().strip()
 README = open("README.rst").read()
 
-redis_requirements = ["redis>=3"]
+redis_requirements = ["redis>=4.2"]
 memcache_requirements = ["pylibmc"]
+zstd_requirements = ["zstandard"]
+lz4_requirements = ["lz4"]
 test_requirements = [
     "black~=22.10.0",
     "cachecontrol",
@@ -39,7 +41,13 @@ setup(
     extras_require={
         "redis": redis_requirements,
         "memcache": memcache_requirements,
-        "tests": test_requirements + memcache_requirements + redis_requirements,
+        "zstd": zstd_requirements,
+        "lz4": lz4_requirements,
+        "tests": test_requirements
+        + memcache_requirements
+        + redis_requirements
+        + zstd_requirements
+        + lz4_requirements,
         "dev": ["bpython~=0.18"],
     },
     project_urls={
@@ -8,6 +8,8 @@ from pyappcache.memcache import MemcacheCache
 from pyappcache.redis import RedisCache
 from pyappcache.sqlite_lru import SqliteCache
 from pyappcache.fs import FilesystemCache
+from pyappcache.tiered import TieredCache
+from pyappcache.memory import MemoryCache
 
 import pytest
 from .utils import random_string, StringToStringKey, StringToStringKeyWithCompression
@@ -23,7 +25,9 @@ def redis_client():
     return redis_py.Redis()
 
 
-@pytest.fixture(scope="function", params=["redis", "memcache", "sqlite", "fs"])
+@pytest.fixture(
+    scope="function", params=["redis", "memcache", "sqlite", "fs", "tiered", "memory"]
+)
 def cache(request, redis_client, memcache_client, tmpdir):
     """Cache object"""
     cache: Cache
@@ -33,6 +37,10 @@ def cache(request, redis_client, memcache_client, tmpdir):
         cache = SqliteCache()
     elif request.param == "fs":
         cache = FilesystemCache(Path(str(tmpdir)))
+    elif request.param == "tiered":
+        cache = TieredCache(SqliteCache())
+    elif request.param == "memory":
+        cache = MemoryCache()
     else:
         cache = MemcacheCache(memcache_client)
 
@@ -0,0 +1,119 @@
+import asyncio
+import io
+from pathlib import Path
+
+from redis import asyncio as redis_asyncio
+import pytest
+
+from pyappcache.async_cache import (
+    AsyncCache,
+    AsyncSqliteCache,
+    AsyncFilesystemCache,
+    ThreadedAsyncCache,
+)
+from pyappcache.async_redis import AsyncRedisCache
+from .utils import random_string, StringToStringKey
+from .test_namespacing import UserFavouritePokemon, UserToLastChangedKey
+
+
+@pytest.fixture(scope="function", params=["redis", "sqlite", "fs"])
+def async_cache(request, tmpdir):
+    cache: AsyncCache
+    if request.param == "redis":
+        cache = AsyncRedisCache(redis_asyncio.Redis())
+    elif request.param == "sqlite":
+        cache = AsyncSqliteCache()
+    else:
+        cache = AsyncFilesystemCache(Path(str(tmpdir)))
+
+    cache.prefix = random_string()
+    yield cache
+    if isinstance(cache, ThreadedAsyncCache):
+        cache.close()
+
+
+def test_get_and_set(async_cache, KeyCls):
+    key = KeyCls(random_string())
+
+    async def go():
+        assert await async_cache.get(key) is None
+        await async_cache.set(key, "a")
+        assert await async_cache.get(key) == "a"
+
+    asyncio.run(go())
+
+
+def test_by_str(async_cache):
+    key_str = random_string()
+
+    async def go():
+        await async_cache.set_by_str(key_str, "a", compress=True)
+        assert await async_cache.get_by_str(key_str) == "a"
+        await async_cache.invalidate_by_str(key_str)
+        assert await async_cache.get_by_str(key_str) is None
+
+    asyncio.run(go())
+
+
+def test_invalidate_and_clear(async_cache):
+    key = StringToStringKey(random_string())
+
+    async def go():
+        await async_cache.set(key, "a")
+        await async_cache.invalidate(key)
+        assert await async_cache.get(key) is None
+
+        await async_cache.set(key, "a")
+        await async_cache.clear()
+        assert await async_cache.get(key) is None
+
+    asyncio.run(go())
+
+
+def test_get_via(async_cache):
+    key = StringToStringKey(random_string())
+    calls = 0
+
+    async def getter():
+        nonlocal calls
+        calls += 1
+        return "ok"
+
+    async def go():
+        assert await async_cache.get_via(key, getter) == "ok"
+        assert await async_cache.get_via(key, getter) == "ok"
+
+    asyncio.run(go())
+    assert calls == 1
+
+
+def test_namespaces(async_cache):
+    key = UserFavouritePokemon(random_string())
+
+    async def go():
+        await async_cache.set(key, "pikachu")
+        assert await async_cache.get(key) is None
+        await async_cache.invalidate(key)
+
+        await async_cache.set(UserToLastChangedKey(key._username), "1")
+        await async_cache.set(key, "pikachu")
+        assert await async_cache.get(key) == "pikachu"
+        await async_cache.invalidate(key)
+        assert await async_cache.get(key) is None
+
+    asyncio.run(go())
+
+
+def test_threaded_cache_reads_files_on_worker_thread(tmpdir):
+    """Check that open files from FilesystemCache are read into memory before
+    being handed back to the event loop."""
+    cache = AsyncFilesystemCache(Path(str(tmpdir)))
+    key_str = random_string()
+
+    async def go():
+        await cache.set_by_str(key_str, "a")
+        return await cache.get_raw(cache.prefix + "/" + key_str)
+
+    contents = asyncio.run(go())
+    cache.close()
+    assert isinstance(contents, io.BytesIO)
@@ -1,14 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from threading import Event
+import time
 
 from pyappcache.cache import Cache
+from pyappcache.compression import TAG_MARKER, LZMACompressor, ZlibCompressor
 from pyappcache.keys import build_raw_key
 from pyappcache.memcache import MemcacheCache
 from pyappcache.sqlite_lru import SqliteCache
 from pyappcache.redis import RedisCache
 from pyappcache.fs import FilesystemCache
+from pyappcache.tiered import TieredCache
+from pyappcache.memory import MemoryCache
 
 import pytest
-from .utils import random_string, StringToStringKeyWithCompression, random_bytes
+from .utils import (
+    DictCache,
+    random_string,
+    StringToStringKeyWithCompression,
+    random_bytes,
+    wait_until,
+)
 
 
 def test_get_and_set_no_ttl(cache, KeyCls):
@@ -35,12 +47,13 @@ def test_get_and_set_10k_sec_ttl(cache, KeyCls):
         # Is there any way to do this?
         pytest.skip("memcache ttl checker is too flaky")
         # ttl = get_memcache_ttl(key_str)
-    elif isinstance(cache, SqliteCache):
-        ttl = cache.ttl(key_str)
-    elif isinstance(cache, FilesystemCache):
+    elif isinstance(cache, (SqliteCache, FilesystemCache, MemoryCache)):
         ttl = cache.ttl(key_str)
     elif isinstance(cache, RedisCache):
         ttl = cache._redis.ttl(key_str)
+    elif isinstance(cache, TieredCache):
+        assert isinstance(cache.l2, SqliteCache)
+        ttl = cache.l2.ttl(key_str)
     assert cache.get(key) == "a"
     assert ttl is not None
     assert ttl > 9_000
@@ -108,6 +121,8 @@ def test_by_str(cache, KeyCls):
 
 
 def test_compression_via_key(cache):
+    if isinstance(cache, MemoryCache):
+        pytest.skip("MemoryCache stores objects, not bytes")
     key = StringToStringKeyWithCompression(random_string())
     cache.set(key, "b")
 
@@ -116,11 +131,52 @@ def test_compression_via_key(cache):
 
 
 def test_compression_via_str(cache):
+    if isinstance(cache, MemoryCache):
+        pytest.skip("MemoryCache stores objects, not bytes")
     cache.set_by_str("a", "b", compress=True)
     raw_value = cache.get_raw(build_raw_key(cache.prefix, "a")).read()
     assert raw_value.startswith(b"\x1f\x8b")
 
 
+class StringToStringKeyWithZlib(StringToStringKeyWithCompression):
+    compressor = ZlibCompressor()
+
+
+def test_compression_via_key_compressor(cache):
+    if isinstance(cache, MemoryCache):
+        pytest.skip("MemoryCache stores objects, not bytes")
+    key = StringToStringKeyWithZlib(random_string())
+    cache.set(key, "b")
+
+    raw_value = cache.get_raw(build_raw_key(cache.prefix, key)).read()
+    assert raw_value.startswith(b"\xa8\x01")
+    assert cache.get(key) == "b"
+
+
+def test_uncompressed_value_with_tag_header_is_a_miss(cache, caplog):
+    if isinstance(cache, MemoryCache):
+        pytest.skip("MemoryCache stores objects, not bytes")
+    key = StringToStringKeyWithZlib(random_string())
+    raw_value = bytes([TAG_MARKER, ZlibCompressor.tag]) + b"not compressed"
+    cache.set_raw(build_raw_key(cache.prefix, key), BytesIO(raw_value), 0)
+
+    assert cache.get(key) is None
+    assert "unable to decompress value" in caplog.text
+
+
+def test_changing_compressor_keeps_old_values(cache):
+    old_key = StringToStringKeyWithCompression(random_string())
+    cache.set(old_key, "gzipped")
+
+    cache.compressor = ZlibCompressor()
+    new_key = StringToStringKeyWithCompression(random_string())
+    cache.set(new_key, "deflated")
+
+    cache.compressor = LZMACompressor()
+    assert cache.get(old_key) == "gzipped"
+    assert cache.get(new_key) == "deflated"
+
+
 def test_get_via(cache, KeyCls):
     key = KeyCls(random_string())
 
@@ -214,3 +270,315 @@ def test_eviction__reading_is_a_touch(cache):
     assert cache.get_raw("a").read() == a_val
     assert cache.get_raw("b") is None
     assert cache.get_raw("c").read() == c_val
+
+
+def test_get_many_and_set_many(cache, KeyCls):
+    keys = [KeyCls(random_string()) for _ in range(3)]
+    cache.set_many({keys[0]: "a", keys[1]: "b"})
+
+    assert cache.get_many(keys) == ["a", "b", None]
+
+
+def test_get_many_default_implementation(KeyCls):
+    cache = DictCache()
+    keys = [KeyCls(random_string()) for _ in range(3)]
+    cache.set_many({keys[0]: "a", keys[1]: "b"})
+
+    assert cache.get_many(keys) == ["a", "b", None]
+
+
+def test_get_many_repeated_key(cache, KeyCls):
+    key = KeyCls(random_string())
+    cache.set(key, "a")
+
+    assert cache.get_many([key, key]) == ["a", "a"]
+
+
+def test_get_many_empty(cache):
+    assert cache.get_many([]) == []
+
+
+def test_set_many_ttl(cache, KeyCls):
+    key = KeyCls(random_string())
+    cache.set_many({key: "a"}, ttl_seconds=10_000)
+
+    key_str = build_raw_key(cache.prefix, key)
+    if isinstance(cache, (SqliteCache, FilesystemCache, MemoryCache)):
+        ttl = cache.ttl(key_str)
+    elif isinstance(cache, RedisCache):
+        ttl = cache._redis.ttl(key_str)
+    elif isinstance(cache, TieredCache):
+        assert isinstance(cache.l2, SqliteCache)
+        ttl = cache.l2.ttl(key_str)
+    else:
+        pytest.skip("memcache ttl checker is too flaky")
+    assert ttl is not None
+    assert ttl > 9_000
+
+
+def test_invalidate_many(cache, KeyCls):
+    keys = [KeyCls(random_string()) for _ in range(3)]
+    cache.set_many({key: "a" for key in keys})
+    cache.invalidate_many(keys[:2])
+
+    assert cache.get_many(keys) == [None, None, "a"]
+
+
+def test_invalidate_many_default_implementation(KeyCls):
+    cache = DictCache()
+    keys = [KeyCls(random_string()) for _ in range(3)]
+    cache.set_many({key: "a" for key in keys})
+    cache.invalidate_many(keys[:2])
+
+    assert cache.get_many(keys) == [None, None, "a"]
+
+
+def test_get_via_coalesces_concurrent_misses(cache, KeyCls):
+    key = KeyCls(random_string())
+    release = Event()
+    calls = 0
+
+    def slow_getter():
+        nonlocal calls
+        calls += 1
+        release.wait()
+        return "ok"
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(cache.get_via, key, slow_getter) for _ in range(5)]
+        time.sleep(0.1)
+        release.set()
+        assert [future.result() for future in futures] == ["ok"] * 5
+
+    assert calls == 1
+    assert cache.get(key) == "ok"
+
+
+def test_get_via_getter_fails(cache, KeyCls):
+    key = KeyCls(random_string())
+
+    def failing_getter():
+        raise RuntimeError("db down")
+
+    with pytest.raises(RuntimeError):
+        cache.get_via(key, failing_getter)
+
+    assert cache.get_via(key, lambda: "ok") == "ok"
+
+
+def test_get_via_ttl(cache, KeyCls):
+    if not hasattr(cache, "ttl"):
+        pytest.skip("ttl is not implemented")
+    key = KeyCls(random_string())
+    cache.get_via(key, lambda: "ok", ttl_seconds=10_000)
+
+    assert cache.ttl(build_raw_key(cache.prefix, key)) > 9_000
+
+
+def test_leases(cache):
+    lease_key = build_raw_key(cache.prefix, random_string()) + Cache.LEASE_SUFFIX
+
+    assert cache.acquire_lease_raw(lease_key, "a", 10) is True
+    assert cache.acquire_lease_raw(lease_key, "b", 10) is False
+
+    cache.release_lease_raw(lease_key, "b")
+    assert cache.acquire_lease_raw(lease_key, "b", 10) is False
+
+    cache.release_lease_raw(lease_key, "a")
+    assert cache.acquire_lease_raw(lease_key, "b", 10) is True
+
+
+def test_leases_expire(cache):
+    lease_key = build_raw_key(cache.prefix, random_string()) + Cache.LEASE_SUFFIX
+
+    # memcache's expiry times are in whole seconds
+    assert cache.acquire_lease_raw(lease_key, "a", 1) is True
+    time.sleep(2.1 if isinstance(cache, MemcacheCache) else 1.1)
+    assert cache.acquire_lease_raw(lease_key, "b", 1) is True
+
+
+def test_leases_not_supported():
+    cache = DictCache()
+    cache.lease_ttl_seconds = 10
+
+    with pytest.raises(NotImplementedError):
+        cache.get_via(StringToStringKeyWithCompression("a"), lambda: "a")
+    with pytest.raises(NotImplementedError):
+        cache.release_lease_raw("a", "token")
+
+
+def test_get_via_with_lease(cache, KeyCls):
+    cache.lease_ttl_seconds = 10
+    key = KeyCls(random_string())
+
+    assert cache.get_via(key, lambda: "ok") == "ok"
+    assert cache.get_via(key, lambda: "not ok") == "ok"
+
+    # The lease was released
+    lease_key = build_raw_key(cache.prefix, key) + Cache.LEASE_SUFFIX
+    assert cache.acquire_lease_raw(lease_key, "a", 10) is True
+
+
+def test_get_via_with_lease_released_when_getter_fails(cache, KeyCls):
+    cache.lease_ttl_seconds = 10
+    key = KeyCls(random_string())
+
+    def failing_getter():
+        raise RuntimeError("db down")
+
+    with pytest.raises(RuntimeError):
+        cache.get_via(key, failing_getter)
+
+    lease_key = build_raw_key(cache.prefix, key) + Cache.LEASE_SUFFIX
+    assert cache.acquire_lease_raw(lease_key, "a", 10) is True
+
+
+def test_get_via_waits_for_lease_holder(cache, KeyCls):
+    cache.lease_ttl_seconds = 10
+    key = KeyCls(random_string())
+    lease_key = build_raw_key(cache.prefix, key) + Cache.LEASE_SUFFIX
+
+    # Pretend to be another process
+    assert cache.acquire_lease_raw(lease_key, "other-process", 10)
+
+    def other_process():
+        time.sleep(0.2)
+        cache.set(key, "from other process")
+        cache.release_lease_raw(lease_key, "other-process")
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(other_process)
+        assert cache.get_via(key, lambda: "from getter") == "from other process"
+
+
+def test_get_via_rechecks_after_taking_lease(cache, KeyCls, monkeypatch):
+    cache.lease_ttl_seconds = 10
+    key = KeyCls(random_string())
+    acquire_lease_raw = cache.acquire_lease_raw
+
+    def set_then_acquire(lease_key_str, token, ttl_seconds):
+        # Another process sets the value between our miss and the lease
+        cache.set(key, "from other process")
+        return acquire_lease_raw(lease_key_str, token, ttl_seconds)
+
+    monkeypatch.setattr(cache, "acquire_lease_raw", set_then_acquire)
+    assert cache.get_via(key, lambda: "from getter") == "from other process"
+
+
+def test_get_via_gives_up_on_unreleased_lease(cache, KeyCls):
+    cache.lease_ttl_seconds = 0.3
+    key = KeyCls(random_string())
+    lease_key = build_raw_key(cache.prefix, key) + Cache.LEASE_SUFFIX
+    assert cache.acquire_lease_raw(lease_key, "crashed-process", 60)
+
+    assert cache.get_via(key, lambda: "from getter") == "from getter"
+
+
+def test_soft_ttl_serves_stale_and_refreshes(cache, KeyCls):
+    key = KeyCls(random_string())
+    cache.set(key, "old", soft_ttl_seconds=0)
+
+    assert cache.get(key) == "old"
+    assert cache.get_via(key, lambda: "new", soft_ttl_seconds=60) == "old"
+    wait_until(lambda: bool(cache.get(key) == "new"))
+
+
+def test_soft_ttl_not_yet_stale(cache, KeyCls):
+    key = KeyCls(random_string())
+    cache.set(key, "old", soft_ttl_seconds=60)
+
+    assert cache.get_via(key, lambda: "new", soft_ttl_seconds=60) == "old"
+    assert not cache._refreshing
+    assert cache.get(key) == "old"
+
+
+def test_soft_ttl_one_refresh_per_key(cache, KeyCls):
+    key = KeyCls(random_string())
+    cache.set(key, "old", soft_ttl_seconds=0)
+    release = Event()
+    calls = 0
+
+    def slow_getter():
+        nonlocal calls
+        calls += 1
+        release.wait()
+        return "new"
+
+    for _ in range(5):
+        assert cache.get_via(key, slow_getter, soft_ttl_seconds=60) == "old"
+    release.set()
+    wait_until(lambda: bool(cache.get(key) == "new"))
+
+    assert calls == 1
+
+
+def test_soft_ttl_refresh_fails(cache, KeyCls):
+    key = KeyCls(random_string())
+    cache.set(key, "old", soft_ttl_seconds=0)
+
+    def failing_getter():
+        raise RuntimeError("db down")
+
+    assert cache.get_via(key, failing_getter, soft_ttl_seconds=60) == "old"
+    wait_until(lambda: not cache._refreshing)
+
+    # Still stale, so the next call tries again
+    assert cache.get_via(key, lambda: "new", soft_ttl_seconds=60) == "old"
+    wait_until(lambda: bool(cache.get(key) == "new"))
+
+
+def test_soft_ttl_refresh_with_lease(cache, KeyCls):
+    cache.lease_ttl_seconds = 10
+    key = KeyCls(random_string())
+    cache.set(key, "old", soft_ttl_seconds=0)
+
+    assert cache.get_via(key, lambda: "new", soft_ttl_seconds=60) == "old"
+    wait_until(lambda: bool(cache.get(key) == "new"))
+
+    lease_key = build_raw_key(cache.prefix, key) + Cache.LEASE_SUFFIX
+    wait_until(lambda: not cache._refreshing)
+    assert cache.acquire_lease_raw(lease_key, "a", 10) is True
+
+
+def test_soft_ttl_refresh_leased_elsewhere(cache, KeyCls):
+    cache.lease_ttl_seconds = 10
+    key = KeyCls(random_string())
+    cache.set(key, "old", soft_ttl_seconds=0)
+    lease_key = build_raw_key(cache.prefix, key) + Cache.LEASE_SUFFIX
+    assert cache.acquire_lease_raw(lease_key, "other-process", 10)
+
+    assert cache.get_via(key, lambda: "new", soft_ttl_seconds=60) == "old"
+    wait_until(lambda: not cache._refreshing)
+
+    assert cache.get(key) == "old"
+
+
+def test_xfetch_refreshes_early(cache, KeyCls, monkeypatch):
+    key = KeyCls(random_string())
+    key.xfetch_beta = 1_000_000
+
+    def slow_getter():
+        time.sleep(0.05)
+        return "old"
+
+    assert cache.get_via(key, slow_getter, ttl_seconds=3600) == "old"
+
+    # Unlucky roll: no early refresh
+    monkeypatch.setattr("pyappcache.envelope.random", lambda: 0)
+    assert cache.get_via(key, lambda: "new", ttl_seconds=3600) == "old"
+    assert not cache._refreshing
+
+    # With a huge beta anything else is "near" expiry
+    monkeypatch.setattr("pyappcache.envelope.random", lambda: 0.5)
+    assert cache.get_via(key, lambda: "new", ttl_seconds=3600) == "old"
+    wait_until(lambda: bool(cache.get(key) == "new"))
+
+
+def test_xfetch_without_ttl(cache, KeyCls, monkeypatch):
+    monkeypatch.setattr("pyappcache.envelope.random", lambda: 0.5)
+    key = KeyCls(random_string())
+    key.xfetch_beta = 1_000_000
+    assert cache.get_via(key, lambda: "old") == "old"
+
+    assert cache.get_via(key, lambda: "new") == "old"
+    assert not cache._refreshing
@@ -1,13 +1,36 @@
 from io import BytesIO
 
-from pyappcache.compression import GZIPCompressor
+from pyappcache.compression import (
+    TAG_MARKER,
+    BZ2Compressor,
+    DecompressionError,
+    GZIPCompressor,
+    LZ4Compressor,
+    LZMACompressor,
+    TaggedCompressor,
+    ZlibCompressor,
+    ZstdCompressor,
+    get_compressor_for,
+    register_compressor,
+)
+from pyappcache.envelope import Envelope
 
 import pytest
 
 
-@pytest.fixture(scope="session")
-def compressor():
-    return GZIPCompressor()
+@pytest.fixture(
+    scope="session",
+    params=[
+        GZIPCompressor,
+        ZlibCompressor,
+        LZMACompressor,
+        BZ2Compressor,
+        ZstdCompressor,
+        LZ4Compressor,
+    ],
+)
+def compressor(request):
+    return request.param()
 
 
 def test_compress_and_decompress(compressor):
@@ -16,3 +39,67 @@ def test_compress_and_decompress(compressor):
     buf.seek(0)
     expected = buf.read()
     assert expected == decompressed
+
+
+def test_is_compressed(compressor):
+    compressed = compressor.compress(BytesIO(b"hello, world"))
+    assert compressor.is_compressed(compressed)
+    assert compressed.tell() == 0
+    assert not compressor.is_compressed(BytesIO(b"hello, world"))
+
+
+def test_get_compressor_for(compressor):
+    compressed = compressor.compress(BytesIO(b"hello, world"))
+
+    found = get_compressor_for(compressed, GZIPCompressor())
+    assert found is not None
+    assert type(found) is type(compressor)
+    assert found.decompress(compressed).read() == b"hello, world"
+
+
+def test_get_compressor_for_uncompressed():
+    assert get_compressor_for(BytesIO(b"hello, world"), ZlibCompressor()) is None
+    assert get_compressor_for(BytesIO(b""), ZlibCompressor()) is None
+
+
+def test_get_compressor_for_unknown_tag():
+    assert get_compressor_for(BytesIO(b"\xa8\xff..."), ZlibCompressor()) is None
+
+
+def test_tagged_compressor_invalid_data(compressor):
+    if not isinstance(compressor, TaggedCompressor):
+        pytest.skip("not a tagged compressor")
+    data = BytesIO(bytes([TAG_MARKER, compressor.tag]) + b"not compressed")
+    with pytest.raises(DecompressionError):
+        compressor.decompress(data)
+
+
+def test_tagged_values_and_envelopes_are_distinct(compressor):
+    compressed = compressor.compress(BytesIO(b"hello, world"))
+    envelope, payload = Envelope.unwrap(compressed)
+    assert envelope is None
+    assert payload is compressed
+
+    enveloped = Envelope(expiry=60).wrap(BytesIO(b"hello, world"))
+    assert get_compressor_for(enveloped, compressor) is None
+
+
+def test_tagged_compressor_without_hooks():
+    class IncompleteCompressor(TaggedCompressor):
+        tag = 200
+
+        def _compress(self, data, out):
+            out.write(data.read())
+
+    with pytest.raises(TypeError):
+        IncompleteCompressor()  # type: ignore[abstract]
+
+
+def test_register_compressor_clashing_tag():
+    class ClashingCompressor(LZMACompressor):
+        tag = ZlibCompressor.tag
+
+    with pytest.raises(ValueError):
+        register_compressor(ClashingCompressor())
+    # Re-registering (eg: with other settings) is fine
+    register_compressor(ZlibCompressor())
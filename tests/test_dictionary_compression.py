@@ -0,0 +1,185 @@
+import gc
+from io import BytesIO
+import pickle
+from typing import Optional
+import weakref
+
+import pytest
+from pyappcache import dictionary_compression
+from pyappcache.compression import Compressor, DecompressionError, ZstdCompressor
+from pyappcache.dictionary_compression import ZstdDictionaryCompressor
+from pyappcache.sqlite_lru import SqliteCache
+from .utils import StringToStringKeyWithCompression, random_string
+
+
+class UserKey(StringToStringKeyWithCompression):
+    compressor: Optional[Compressor] = None
+
+
+def make_value(i):
+    return {
+        "id": i,
+        "name": f"user{i}",
+        "email": f"user{i}@example.com",
+        "roles": ["reader", "writer"],
+    }
+
+
+@pytest.fixture
+def cache():
+    cache = SqliteCache()
+    cache.prefix = random_string()
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def forget_dictionaries():
+    # As if each test were a new process
+    dictionary_compression._dictionaries.clear()
+
+
+def test_compresses_without_a_dictionary(cache):
+    compressor = ZstdDictionaryCompressor(cache, "users")
+    value = pickle.dumps(make_value(1))
+
+    compressed = compressor.compress(BytesIO(value))
+    assert compressor.dictionary_id is None
+    assert compressor.decompress(compressed).read() == value
+
+
+def test_train(cache):
+    compressor = ZstdDictionaryCompressor(cache, "users")
+    samples = [pickle.dumps(make_value(i)) for i in range(1000)]
+
+    dict_id = compressor.train(samples)
+    assert compressor.dictionary_id == dict_id
+
+    value = pickle.dumps(make_value(1001))
+    compressed = compressor.compress(BytesIO(value)).read()
+    plain = ZstdCompressor().compress(BytesIO(value)).read()
+    assert len(compressed) < len(plain) / 2
+    assert compressor.decompress(BytesIO(compressed)).read() == value
+
+
+def test_trains_automatically(cache):
+    compressor = ZstdDictionaryCompressor(cache, "users")
+    compressor.training_sample_count = 500
+    key = UserKey("before")
+    key.compressor = compressor
+    cache.set(key, make_value(0))
+
+    for i in range(500):
+        compressor.compress(BytesIO(pickle.dumps(make_value(i))))
+
+    assert compressor.dictionary_id is not None
+    assert cache.get(key) == make_value(0)
+
+
+def test_training_fails(cache):
+    compressor = ZstdDictionaryCompressor(cache, "users")
+    compressor.training_sample_count = 2
+
+    compressor.compress(BytesIO(b"a"))
+    compressed = compressor.compress(BytesIO(b"a"))
+
+    assert compressor.dictionary_id is None
+    assert compressor.decompress(compressed).read() == b"a"
+
+
+def test_big_values_are_not_sampled(cache):
+    compressor = ZstdDictionaryCompressor(cache, "users")
+    compressor.max_sample_size = 10
+    compressor.compress(BytesIO(b"a" * 11))
+
+    assert compressor._samples == []
+
+
+def test_dictionary_is_shared_via_the_cache(cache):
+    writer = ZstdDictionaryCompressor(cache, "users")
+    writer.train([pickle.dumps(make_value(i)) for i in range(1000)])
+    key = UserKey("a")
+    key.compressor = writer
+    cache.set(key, make_value(1))
+
+    dictionary_compression._dictionaries.clear()
+    reader = ZstdDictionaryCompressor(cache, "users")
+    assert reader.dictionary_id == writer.dictionary_id
+    assert cache.get(StringToStringKeyWithCompression("a")) == make_value(1)
+
+
+def test_reload(cache):
+    first = ZstdDictionaryCompressor(cache, "users")
+    second = ZstdDictionaryCompressor(cache, "users")
+    first.train([pickle.dumps(make_value(i)) for i in range(1000)])
+
+    assert second.dictionary_id is None
+    second.reload()
+    assert second.dictionary_id == first.dictionary_id
+
+
+def test_missing_dictionary(cache):
+    compressor = ZstdDictionaryCompressor(cache, "users")
+    compressor.train([pickle.dumps(make_value(i)) for i in range(1000)])
+    compressed = compressor.compress(BytesIO(b"hello"))
+
+    dictionary_compression._dictionaries.clear()
+    cache.clear()
+    with pytest.raises(DecompressionError):
+        compressor.decompress(compressed)
+
+
+def test_missing_dictionary_is_a_miss(cache, caplog):
+    compressor = ZstdDictionaryCompressor(cache, "users")
+    compressor.train([pickle.dumps(make_value(i)) for i in range(1000)])
+    key = UserKey("a")
+    key.compressor = compressor
+    cache.set(key, make_value(1))
+
+    dictionary_compression._dictionaries.clear()
+    assert compressor.dictionary_id is not None
+    cache.invalidate_raw(compressor._dictionary_key(compressor.dictionary_id))
+    assert cache.get(key) is None
+    assert "unable to decompress value" in caplog.text
+
+
+def test_dictionaries_are_found_in_each_cache():
+    caches = [SqliteCache(), SqliteCache()]
+    compressors = []
+    for offset, cache in enumerate(caches):
+        cache.prefix = random_string()
+        compressor = ZstdDictionaryCompressor(cache, "users")
+        compressor.train(
+            [pickle.dumps(make_value(offset * 1000 + i)) for i in range(1000)]
+        )
+        compressors.append(compressor)
+        key = UserKey("a")
+        key.compressor = compressor
+        cache.set(key, make_value(offset))
+    assert compressors[0].dictionary_id != compressors[1].dictionary_id
+
+    dictionary_compression._dictionaries.clear()
+    for offset, cache in enumerate(caches):
+        assert cache.get(UserKey("a")) == make_value(offset)
+
+
+def test_compressors_are_not_kept_alive(cache):
+    compressor = weakref.ref(ZstdDictionaryCompressor(cache, "users"))
+    gc.collect()
+    assert compressor() is None
+
+
+@pytest.mark.parametrize("refresh_every_n, readable", [(5, True), (0, False)])
+def test_dictionary_is_kept_in_lru_caches(refresh_every_n, readable):
+    cache = SqliteCache(max_size=10)
+    cache.prefix = random_string()
+    compressor = ZstdDictionaryCompressor(cache, "users")
+    compressor.refresh_every_n = refresh_every_n
+    compressor.train([pickle.dumps(make_value(i)) for i in range(1000)])
+
+    for i in range(50):
+        key = UserKey(str(i))
+        key.compressor = compressor
+        cache.set(key, make_value(i))
+
+    dictionary_compression._dictionaries.clear()
+    assert (cache.get(UserKey("49")) == make_value(49)) is readable
@@ -0,0 +1,75 @@
+from io import BytesIO
+from time import time
+from typing import IO
+
+import pytest
+
+from pyappcache.envelope import Envelope
+from pyappcache.keys import SimpleStringKey
+from pyappcache.memory import MemoryCache
+from pyappcache.serialisation import BinaryFileSerialiser
+
+
+def test_envelope_round_trip():
+    envelope = Envelope(soft_expiry=123.5, expiry=456.5, delta=0.25)
+    unwrapped, payload = Envelope.unwrap(envelope.wrap(BytesIO(b"hello")))
+
+    assert unwrapped is not None
+    assert unwrapped.soft_expiry == 123.5
+    assert unwrapped.expiry == 456.5
+    assert unwrapped.delta == 0.25
+    assert repr(unwrapped) == "<Envelope soft_expiry=123.5 expiry=456.5 delta=0.25>"
+    assert payload is not None
+    assert payload.read() == b"hello"
+
+
+def test_unwrap_without_envelope():
+    envelope, payload = Envelope.unwrap(BytesIO(b"hello"))
+
+    assert envelope is None
+    assert payload is not None
+    assert payload.read() == b"hello"
+
+
+def test_unwrap_unknown_version():
+    data = Envelope._HEADER.pack(Envelope.MAGIC, 99, 0, 0, 0) + b"hello"
+    envelope, payload = Envelope.unwrap(BytesIO(data))
+
+    assert envelope is None
+    assert payload is None
+
+
+def test_unknown_version_is_a_miss():
+    cache = MemoryCache(copy_on_read=True)
+    cache.serialiser = BinaryFileSerialiser()
+    data = Envelope._HEADER.pack(Envelope.MAGIC, 99, 0, 0, 0) + b"hello"
+    cache.set_raw(f"{cache.prefix}/a", BytesIO(data), 0)
+
+    assert cache.get(SimpleStringKey[IO[bytes]]("a")) is None
+
+
+def test_is_stale():
+    assert not Envelope().is_stale()
+    assert not Envelope(soft_expiry=time() + 60).is_stale()
+    assert Envelope(soft_expiry=time() - 1).is_stale()
+
+
+@pytest.mark.parametrize(
+    "expiry_in, delta, rand, expected",
+    [
+        (3600, 1, 0.5, False),
+        (0.5, 1, 0.5, True),
+        (0.5, 1, 0, False),
+        (-1, 1, 0, True),
+        (0.5, 0, 0.5, False),
+    ],
+)
+def test_should_refresh_early(monkeypatch, expiry_in, delta, rand, expected):
+    monkeypatch.setattr("pyappcache.envelope.random", lambda: rand)
+    envelope = Envelope(expiry=time() + expiry_in, delta=delta)
+
+    assert envelope.should_refresh_early(beta=1.0) is expected
+
+
+def test_should_refresh_early_without_expiry():
+    assert not Envelope(delta=1).should_refresh_early(beta=1.0)
@@ -0,0 +1,537 @@
+from contextlib import closing
+from datetime import datetime, timedelta
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import gc
+import sqlite3
+from threading import Thread
+import time
+from typing import IO, Optional
+import weakref
+
+import pytest
+import time_machine
+from pyappcache.fs import FilesystemCache, PinnedPath, migrate_layout
+from pyappcache.keys import SimpleStringKey
+from pyappcache.serialisation import BinaryFileSerialiser
+from .utils import wait_until
+
+
+def get_raw_bytes(cache: FilesystemCache, raw_key: str) -> Optional[bytes]:
+    contents = cache.get_raw(raw_key)
+    return contents.read() if contents is not None else None
+
+
+def test_fs_stats(tmp_path):
+    cache = FilesystemCache(tmp_path)
+    cache.set_raw("a", BytesIO(b"x" * 10), 0)
+    cache.set_raw("b", BytesIO(b"x" * 20), 0)
+    cache.set_raw("a", BytesIO(b"x" * 5), 0)
+
+    assert cache.stats() == {"row_count": 2, "total_size_bytes": 25}
+
+
+def test_fs_evicts_least_recently_read(tmp_path):
+    cache = FilesystemCache(tmp_path, max_size_bytes=1000)
+
+    for i in range(3):
+        with time_machine.travel(datetime(2018, 1, 3, i)):
+            cache.set_raw(str(i), BytesIO(b"x" * 300), 0)
+    with time_machine.travel(datetime(2018, 1, 3, 3)):
+        cache.get_raw("0")
+    with time_machine.travel(datetime(2018, 1, 3, 4)):
+        cache.set_raw("4", BytesIO(b"x" * 300), 0)
+
+    assert cache.stats() == {"row_count": 3, "total_size_bytes": 900}
+    assert cache.get_raw("1") is None
+    assert not cache._make_path("1").exists()
+    assert cache.get_raw("0") is not None
+
+
+def test_fs_low_water_mark_bytes(tmp_path):
+    cache = FilesystemCache(tmp_path, max_size_bytes=1000)
+    cache.low_water_mark_bytes = 500
+
+    for i in range(4):
+        with time_machine.travel(datetime(2018, 1, 3, i)):
+            cache.set_raw(str(i), BytesIO(b"x" * 300), 0)
+
+    assert cache.stats() == {"row_count": 1, "total_size_bytes": 300}
+    assert cache.get_raw("3") is not None
+
+
+def test_fs_similar_keys_do_not_collide(tmp_path):
+    cache = FilesystemCache(tmp_path)
+    cache.set_raw("a/b", BytesIO(b"slash"), 0)
+    cache.set_raw("a_b", BytesIO(b"underscore"), 0)
+    cache.set_raw("x" * 1000, BytesIO(b"long"), 0)
+
+    assert get_raw_bytes(cache, "a/b") == b"slash"
+    assert get_raw_bytes(cache, "a_b") == b"underscore"
+    assert get_raw_bytes(cache, "x" * 1000) == b"long"
+
+
+def test_fs_only_makes_directories_on_write(tmp_path):
+    cache = FilesystemCache(tmp_path)
+    cache.get_raw("a")
+    cache.get_many_raw(["b", "c"])
+    cache.invalidate_raw("d")
+
+    assert [p for p in tmp_path.iterdir() if p.is_dir()] == []
+
+    cache.set_raw("a", BytesIO(b"a"), 0)
+    path = cache._make_path("a")
+    assert path.parent.parent.parent == tmp_path
+
+
+def make_flat_cache(directory, files):
+    with closing(sqlite3.connect(str(directory / "metadata.sqlite3"))) as conn:
+        conn.execute(
+            "CREATE TABLE pyappcache"
+            " (key PRIMARY KEY, expiry NOT NULL, last_read NOT NULL, size NOT NULL);"
+        )
+        for key, contents in files.items():
+            conn.execute(
+                "INSERT INTO pyappcache VALUES (?, '-1', ?, 1);",
+                (key, datetime.utcnow().isoformat()),
+            )
+            if contents is not None:
+                (directory / key.replace("/", "_")).write_bytes(contents)
+        conn.commit()
+
+
+def test_fs_migrates_from_flat_layout(tmp_path):
+    # "2e" is also the name of the directory that "c" goes in in the new layout
+    files = {"2e": b"1", "c": b"2", "d/e": b"3", "d_e": b"4", "missing": None}
+    make_flat_cache(tmp_path, files)
+
+    assert migrate_layout(tmp_path) == 2
+    assert migrate_layout(tmp_path) == 0
+
+    cache = FilesystemCache(tmp_path)
+    assert get_raw_bytes(cache, "2e") == b"1"
+    assert get_raw_bytes(cache, "c") == b"2"
+    # Both were written to "d_e" so which one it holds is not known
+    assert cache.get_raw("d/e") is None
+    assert cache.get_raw("d_e") is None
+    assert cache.stats()["row_count"] == 2
+    assert not (tmp_path / "c").exists()
+
+
+def test_fs_migrates_when_created(tmp_path):
+    make_flat_cache(tmp_path, {"a": b"1"})
+
+    cache = FilesystemCache(tmp_path)
+    assert get_raw_bytes(cache, "a") == b"1"
+
+
+@pytest.mark.parametrize("touch_interval_seconds", [0, 60])
+def test_fs_migrated_files_keep_their_expiry(tmp_path, touch_interval_seconds):
+    make_flat_cache(tmp_path, {"forever": b"1", "live": b"2", "expired": b"3"})
+    with closing(sqlite3.connect(str(tmp_path / "metadata.sqlite3"))) as conn:
+        for key, hours in [("live", 1), ("expired", -1)]:
+            expiry = datetime.utcnow() + timedelta(hours=hours)
+            conn.execute(
+                "UPDATE pyappcache SET expiry = ? WHERE key = ?;",
+                (expiry.isoformat(), key),
+            )
+        conn.commit()
+
+    cache = FilesystemCache(tmp_path, touch_interval_seconds=touch_interval_seconds)
+
+    assert get_raw_bytes(cache, "forever") == b"1"
+    assert get_raw_bytes(cache, "live") == b"2"
+    assert cache.get_raw("expired") is None
+
+
+@pytest.mark.parametrize("fsync", ["none", "data", "data+dir"])
+def test_fs_fsync_policies(tmp_path, fsync):
+    cache = FilesystemCache(tmp_path, fsync=fsync)
+    cache.set_raw("a", BytesIO(b"a"), 0)
+    cache.set_raw("a", BytesIO(b"b"), 0)
+
+    assert get_raw_bytes(cache, "a") == b"b"
+    # No temporary files left behind
+    assert list(cache._make_path("a").parent.iterdir()) == [cache._make_path("a")]
+
+
+def test_fs_unknown_fsync_policy(tmp_path):
+    with pytest.raises(ValueError):
+        FilesystemCache(tmp_path, fsync="sometimes")
+
+
+def test_fs_failed_write_leaves_old_value(tmp_path):
+    class BrokenFile(BytesIO):
+        def read(self, *args):
+            raise OSError("disk on fire")
+
+    cache = FilesystemCache(tmp_path)
+    cache.set_raw("a", BytesIO(b"old"), 0)
+    with pytest.raises(OSError):
+        cache.set_raw("a", BrokenFile(), 0)
+
+    assert get_raw_bytes(cache, "a") == b"old"
+    assert list(cache._make_path("a").parent.iterdir()) == [cache._make_path("a")]
+
+
+def write_and_read(directory, n):
+    cache = FilesystemCache(directory)
+    torn = 0
+    for i in range(50):
+        value = bytes([n]) * 100_000
+        cache.set_raw("shared", BytesIO(value), 0)
+        got = cache.get_raw("shared")
+        if got is not None:
+            contents = got.read()
+            if len(set(contents)) != 1 or len(contents) != 100_000:
+                torn += 1
+    return torn
+
+
+def test_fs_concurrent_processes(tmp_path):
+    FilesystemCache(tmp_path)
+    # sqlite connections must not be carried over a fork
+    with ProcessPoolExecutor(4, mp_context=get_context("spawn")) as pool:
+        results = list(pool.map(write_and_read, [tmp_path] * 4, range(4)))
+    assert results == [0, 0, 0, 0]
+
+
+def make_binary_cache(directory, **kwargs):
+    cache = FilesystemCache(directory, **kwargs)
+    cache.serialiser = BinaryFileSerialiser()
+    return cache
+
+
+def test_fs_connections_closed_when_threads_end(tmp_path):
+    cache = FilesystemCache(tmp_path)
+    cache.set(SimpleStringKey[str]("a"), "b")
+
+    def worker():
+        assert cache.get(SimpleStringKey[str]("a")) == "b"
+
+    for _ in range(50):
+        thread = Thread(target=worker)
+        thread.start()
+        thread.join()
+    gc.collect()
+
+    # Just this thread's
+    assert len(cache._pool) == 1
+    cache.close()
+    assert len(cache._pool) == 0
+    assert cache.get(SimpleStringKey("a")) == "b"
+
+
+def test_fs_connections_closed_when_cache_dropped(tmp_path):
+    cache = FilesystemCache(tmp_path)
+    cache.set(SimpleStringKey[str]("a"), "b")
+    conn = cache.metadata_conn
+    cache_ref = weakref.ref(cache)
+
+    del cache
+    gc.collect()
+
+    assert cache_ref() is None
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1;")
+
+
+def test_fs_get_mmap(tmp_path):
+    cache = make_binary_cache(tmp_path)
+    key = SimpleStringKey[IO[bytes]]("a")
+    cache.set(key, BytesIO(b"hello"))
+
+    view = cache.get_mmap(key)
+    assert view.readonly
+    assert bytes(view) == b"hello"
+
+    # Still readable after the key is gone
+    cache.invalidate(key)
+    assert bytes(view) == b"hello"
+    assert cache.get_mmap(key) is None
+
+
+def test_fs_get_mmap_of_empty_file(tmp_path):
+    cache = make_binary_cache(tmp_path)
+    key = SimpleStringKey[IO[bytes]]("a")
+    cache.set(key, BytesIO(b""))
+
+    assert bytes(cache.get_mmap(key)) == b""
+
+
+def test_fs_get_path(tmp_path):
+    cache = make_binary_cache(tmp_path)
+    key = SimpleStringKey[IO[bytes]]("a")
+    cache.set(key, BytesIO(b"hello"))
+
+    with cache.get_path(key) as pinned:
+        cache.set(key, BytesIO(b"goodbye"))
+        cache.invalidate(key)
+        with open(pinned, "rb") as fh:
+            assert fh.read() == b"hello"
+    assert not pinned.path.exists()
+    assert cache.get_path(key) is None
+
+
+def test_fs_get_path_released_when_collected(tmp_path):
+    cache = make_binary_cache(tmp_path)
+    key = SimpleStringKey[IO[bytes]]("a")
+    cache.set(key, BytesIO(b"hello"))
+
+    pinned = cache.get_path(key)
+    assert pinned is not None
+    path = pinned.path
+    del pinned
+    gc.collect()
+    assert not path.exists()
+
+
+def test_fs_get_path_of_vanished_file(tmp_path, monkeypatch):
+    cache = make_binary_cache(tmp_path)
+    cache.set(SimpleStringKey("a"), BytesIO(b"a"))
+
+    def link(src, dst):
+        raise FileNotFoundError(src)
+
+    monkeypatch.setattr("pyappcache.fs.os.link", link)
+    assert cache.get_path(SimpleStringKey("a")) is None
+
+
+def test_fs_pinned_path_repr(tmp_path):
+    assert repr(PinnedPath(tmp_path / "a")) == f"<PinnedPath {tmp_path / 'a'}>"
+
+
+def test_fs_get_path_survives_eviction(tmp_path):
+    cache = make_binary_cache(tmp_path, max_size_bytes=1000)
+    key = SimpleStringKey[IO[bytes]]("a")
+    cache.set(key, BytesIO(b"x" * 600))
+
+    pinned = cache.get_path(key)
+    cache.set(SimpleStringKey("b"), BytesIO(b"y" * 600))
+    assert cache.get_path(key) is None
+    assert pinned.path.read_bytes() == b"x" * 600
+    pinned.close()
+
+
+def test_fs_get_mmap_and_get_path_are_reads(tmp_path):
+    cache = make_binary_cache(tmp_path, max_size_bytes=1000)
+    with time_machine.travel(datetime(2018, 1, 3, 0)):
+        cache.set(SimpleStringKey("a"), BytesIO(b"x" * 300))
+        cache.set(SimpleStringKey("b"), BytesIO(b"x" * 300))
+        cache.set(SimpleStringKey("c"), BytesIO(b"x" * 300))
+    with time_machine.travel(datetime(2018, 1, 3, 1)):
+        cache.get_mmap(SimpleStringKey("a"))
+        cache.get_path(SimpleStringKey("b")).close()
+    with time_machine.travel(datetime(2018, 1, 3, 2)):
+        cache.set(SimpleStringKey("d"), BytesIO(b"x" * 300))
+
+    assert cache.get_mmap(SimpleStringKey("c")) is None
+    assert cache.get_mmap(SimpleStringKey("a")) is not None
+    assert cache.get_mmap(SimpleStringKey("b")) is not None
+
+
+def test_fs_touch_interval_reads_do_not_use_metadata(tmp_path):
+    cache = FilesystemCache(tmp_path, touch_interval_seconds=60, busy_timeout_seconds=0)
+    cache.set_raw("a", BytesIO(b"a"), 0)
+
+    # Another process is writing to the metadata database
+    with closing(sqlite3.connect(str(tmp_path / "metadata.sqlite3"))) as other:
+        other.execute("BEGIN EXCLUSIVE;")
+        assert get_raw_bytes(cache, "a") == b"a"
+        assert cache.get_many_raw(["a", "b"])[1] is None
+        other.rollback()
+
+
+def test_fs_touch_interval_expiry(tmp_path):
+    cache = FilesystemCache(tmp_path, touch_interval_seconds=60)
+    with time_machine.travel(datetime(2018, 1, 3, 0)):
+        cache.set_raw("a", BytesIO(b"a"), 60)
+        cache.set_raw("b", BytesIO(b"b"), 0)
+    with time_machine.travel(datetime(2018, 1, 3, 0, 0, 59)):
+        assert cache.get_raw("a") is not None
+    with time_machine.travel(datetime(2018, 1, 3, 0, 1, 1)):
+        assert cache.get_raw("a") is None
+        assert cache.get_raw("b") is not None
+
+
+def test_fs_touch_interval_eviction_follows_reads(tmp_path):
+    cache = FilesystemCache(tmp_path, max_size_bytes=1000, touch_interval_seconds=60)
+    for i in range(3):
+        with time_machine.travel(datetime(2018, 1, 3, i)):
+            cache.set_raw(str(i), BytesIO(b"x" * 300), 0)
+    with time_machine.travel(datetime(2018, 1, 3, 3)):
+        cache.get_raw("0")
+    with time_machine.travel(datetime(2018, 1, 3, 4)):
+        # Buffered touches are flushed before evicting
+        cache.set_raw("4", BytesIO(b"x" * 300), 0)
+
+    assert cache.get_raw("1") is None
+    assert cache.get_raw("0") is not None
+
+
+def test_fs_touch_batch_size(tmp_path):
+    cache = FilesystemCache(tmp_path, touch_interval_seconds=60)
+    cache.touch_batch_size = 2
+    cache.set_raw("a", BytesIO(b"a"), 0)
+    cache.set_raw("b", BytesIO(b"b"), 0)
+
+    cache.get_raw("a")
+    assert len(cache._touches) == 1
+    cache.get_raw("b")
+    assert len(cache._touches) == 0
+
+
+class NamespacedKey(SimpleStringKey):
+    def namespace_key(self):
+        return SimpleStringKey("namespace")
+
+
+def test_fs_get_mmap_and_get_path_with_missing_namespace(tmp_path):
+    cache = make_binary_cache(tmp_path)
+
+    assert cache.get_mmap(NamespacedKey("a")) is None
+    assert cache.get_path(NamespacedKey("a")) is None
+
+
+def test_fs_missing_file(tmp_path):
+    cache = FilesystemCache(tmp_path)
+    cache.set_raw("a", BytesIO(b"a"), 0)
+    cache._make_path("a").unlink()
+
+    assert cache.get_raw("a") is None
+    assert cache.get_many_raw(["a"]) == [None]
+
+
+def test_fs_clear(tmp_path):
+    cache = make_binary_cache(tmp_path, touch_interval_seconds=60)
+    cache.set(SimpleStringKey("a"), BytesIO(b"a"))
+    pinned = cache.get_path(SimpleStringKey("a"))
+
+    cache.clear()
+
+    assert cache.get_raw("a") is None
+    assert cache.stats() == {"row_count": 0, "total_size_bytes": 0}
+    assert [p.name for p in tmp_path.iterdir() if p.is_dir()] == []
+    assert not pinned.path.exists()
+    pinned.close()
+
+
+def test_fs_invalidate_removes_metadata(tmp_path):
+    cache = FilesystemCache(tmp_path)
+    cache.set_raw("a", BytesIO(b"x" * 10), 0)
+    cache.set_raw("b", BytesIO(b"x" * 20), 0)
+
+    cache.invalidate_raw("a")
+
+    assert cache.stats() == {"row_count": 1, "total_size_bytes": 20}
+    assert not cache._make_path("a").exists()
+
+
+def test_fs_purge_expired(tmp_path):
+    cache = FilesystemCache(tmp_path)
+    cache.compact_batch_size = 2
+    with time_machine.travel(datetime(2018, 1, 3)):
+        for i in range(5):
+            cache.set_raw(str(i), BytesIO(b"x"), 60)
+        cache.set_raw("forever", BytesIO(b"x"), 0)
+    with time_machine.travel(datetime(2018, 1, 4)):
+        assert cache.purge_expired() == 5
+
+    assert cache.stats()["row_count"] == 1
+    assert not cache._make_path("0").exists()
+    assert cache._make_path("forever").exists()
+
+
+def test_fs_compact(tmp_path):
+    cache = FilesystemCache(tmp_path)
+    with time_machine.travel(datetime(2018, 1, 3)):
+        cache.set_raw("expired", BytesIO(b"x"), 60)
+    cache.set_raw("missing", BytesIO(b"x" * 10), 0)
+    cache.set_raw("resized", BytesIO(b"x" * 10), 0)
+    cache.set_raw("fine", BytesIO(b"x" * 10), 0)
+    cache._make_path("missing").unlink()
+    cache._make_path("resized").write_bytes(b"x" * 30)
+    orphan = cache._make_path("orphan")
+    orphan.parent.mkdir(parents=True)
+    orphan.write_bytes(b"x")
+    temp_file = cache._make_path("fine").parent / ".leftover.tmp"
+    temp_file.write_bytes(b"x")
+
+    # Too new to be deleted
+    assert cache.compact()["orphaned_files"] == 0
+    assert orphan.exists()
+
+    with time_machine.travel(time.time() + 120):
+        assert cache.compact() == {
+            "expired": 0,
+            "missing_files": 0,
+            "orphaned_files": 2,
+            "resized": 0,
+            "stale_pins": 0,
+        }
+
+    assert not orphan.exists()
+    assert not temp_file.exists()
+    assert cache.stats() == {"row_count": 2, "total_size_bytes": 40}
+    assert get_raw_bytes(cache, "fine") == b"x" * 10
+
+
+def test_fs_compact_counts(tmp_path):
+    cache = FilesystemCache(tmp_path)
+    with time_machine.travel(datetime(2018, 1, 3)):
+        cache.set_raw("expired", BytesIO(b"x"), 60)
+    cache.set_raw("missing", BytesIO(b"x" * 10), 0)
+    cache.set_raw("resized", BytesIO(b"x" * 10), 0)
+    cache._make_path("missing").unlink()
+    cache._make_path("resized").write_bytes(b"x" * 30)
+
+    assert cache.compact() == {
+        "expired": 1,
+        "missing_files": 1,
+        "orphaned_files": 0,
+        "resized": 1,
+        "stale_pins": 0,
+    }
+    assert cache.stats() == {"row_count": 1, "total_size_bytes": 30}
+
+
+def test_fs_compact_stale_pins(tmp_path):
+    cache = make_binary_cache(tmp_path)
+    key = SimpleStringKey[IO[bytes]]("a")
+    cache.set(key, BytesIO(b"a"))
+    assert cache.compact()["stale_pins"] == 0
+
+    pinned = cache.get_path(key)
+    assert pinned is not None
+    assert cache.compact()["stale_pins"] == 0
+    assert pinned.path.exists()
+
+    with time_machine.travel(time.time() + cache.pin_max_age_seconds + 60):
+        assert cache.compact()["stale_pins"] == 1
+    assert not pinned.path.exists()
+    # The file itself is untouched
+    assert cache.get_mmap(key) == b"a"
+
+
+def test_fs_auto_compact(tmp_path):
+    cache = FilesystemCache(tmp_path)
+    cache.set_raw("a", BytesIO(b"x"), 0)
+    cache._make_path("a").unlink()
+
+    cache.auto_compact(interval_seconds=0.01)
+    try:
+        wait_until(lambda: cache.stats()["row_count"] == 0)
+    finally:
+        cache.close()
+
+
+def test_fs_auto_compact_failure(tmp_path, monkeypatch, caplog):
+    cache = FilesystemCache(tmp_path)
+
+    def compact():
+        raise RuntimeError("oh no")
+
+    monkeypatch.setattr(cache, "compact", compact)
+    cache._auto_compact()
+    assert "unable to compact" in caplog.text
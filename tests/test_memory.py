@@ -0,0 +1,117 @@
+from io import BytesIO
+import pickle
+import threading
+from typing import List
+
+from pyappcache.keys import SimpleStringKey
+from pyappcache.memory import MemoryCache
+from .utils import StringToStringKey, StringToStringKeyWithCompression
+
+
+def test_by_reference():
+    cache = MemoryCache()
+    key = SimpleStringKey[List[str]]("a")
+    value = ["b"]
+    cache.set(key, value)
+
+    assert cache.get(key) is value
+
+
+def test_by_reference_set_many():
+    cache = MemoryCache()
+    keys = [SimpleStringKey[threading.Lock]("a"), SimpleStringKey[threading.Lock]("b")]
+    values = [threading.Lock(), threading.Lock()]
+    cache.set_many(dict(zip(keys, values)))
+
+    assert cache.get(keys[0]) is values[0]
+    got = cache.get_many(keys)
+    assert got[0] is values[0]
+    assert got[1] is values[1]
+
+
+def test_copy_on_read_set_many():
+    cache = MemoryCache(copy_on_read=True)
+    key = SimpleStringKey[List[str]]("a")
+    value = ["b"]
+    cache.set_many({key: value})
+    value.append("c")
+
+    assert cache.get(key) == ["b"]
+
+
+def test_copy_on_read():
+    cache = MemoryCache(copy_on_read=True)
+    key = SimpleStringKey[List[str]]("a")
+    value = ["b"]
+    cache.set(key, value)
+    value.append("c")
+
+    got = cache.get(key)
+    assert got == ["b"]
+    assert got is not cache.get(key)
+
+
+def test_copy_on_read_compression():
+    cache = MemoryCache(copy_on_read=True)
+    key = StringToStringKeyWithCompression("a")
+    cache.set(key, "b")
+
+    contents = cache.get_raw(f"{cache.prefix}/a")
+    assert contents is not None
+    assert contents.read().startswith(b"\x1f\x8b")
+    assert cache.get(key) == "b"
+
+
+def test_get_raw_of_live_object():
+    cache = MemoryCache()
+    cache.set(StringToStringKey("a"), "b")
+
+    contents = cache.get_raw(f"{cache.prefix}/a")
+    assert contents is not None
+    assert pickle.load(contents) == "b"
+
+
+def test_get_raw_of_missing_key():
+    assert MemoryCache().get_raw("a") is None
+
+
+def test_set_raw_then_get():
+    cache = MemoryCache()
+    cache.set_raw(f"{cache.prefix}/a", BytesIO(pickle.dumps("b")), 0)
+
+    assert cache.get(StringToStringKey("a")) == "b"
+
+
+def test_lru_eviction():
+    cache = MemoryCache(max_size=2)
+    keys = [StringToStringKey(str(i)) for i in range(3)]
+    cache.set(keys[0], "a")
+    cache.set(keys[1], "b")
+    cache.get(keys[0])
+    cache.set(keys[2], "c")
+
+    assert cache.get_many(keys) == ["a", None, "c"]
+    assert cache.max_size == 2
+
+    cache.max_size = 1
+    cache.set(keys[1], "b")
+    assert cache.get_many(keys) == [None, "b", None]
+
+
+def test_expiry(monkeypatch):
+    cache = MemoryCache()
+    key = StringToStringKey("a")
+    monkeypatch.setattr("pyappcache.lru.monotonic", lambda: 100.0)
+    cache.set(key, "b", ttl_seconds=10)
+    assert cache.ttl(f"{cache.prefix}/a") == 10
+
+    monkeypatch.setattr("pyappcache.lru.monotonic", lambda: 111.0)
+    assert cache.get(key) is None
+    assert cache.ttl(f"{cache.prefix}/a") is None
+
+
+def test_no_ttl():
+    cache = MemoryCache()
+    cache.set(StringToStringKey("a"), "b")
+
+    assert cache.ttl(f"{cache.prefix}/a") is None
@@ -1,7 +1,9 @@
 from datetime import datetime
 import logging
 
-from pyappcache.keys import BaseKey
+from pyappcache.keys import BaseKey, build_raw_key
+from pyappcache.serialisation import PickleSerialiser
+from .utils import DictCache
 
 
 class UserToLastChangedKey(BaseKey[datetime]):
@@ -39,6 +41,13 @@ def test_namespace_set_when_no_namespace(cache):
     assert cache.get(key) is None
 
 
+def test_namespace_get_via_when_no_namespace(cache):
+    key = UserFavouritePokemon("john")
+
+    assert cache.get_via(key, lambda: "pikachu") == "pikachu"
+    assert cache.get(key) is None
+
+
 def test_namespace_get_and_set_when_namespace_present(cache):
     key = UserFavouritePokemon("john")
 
@@ -91,3 +100,143 @@ def test_invalidation_when_namespace_present(cache):
 
     cache.invalidate(key)
     assert cache.get(key) is None
+
+
+def test_get_many_and_set_many_with_namespaces(cache):
+    keys = [UserFavouritePokemon("john"), UserFavouritePokemon("paul")]
+
+    cache.set(keys[0].namespace_key(), datetime(2018, 1, 3))
+    cache.set_many({keys[0]: "pikachu", keys[1]: "bulbasaur"})
+
+    assert cache.get_many(keys) == ["pikachu", None]
+
+
+def test_get_many_looks_up_each_namespace_once(cache):
+    keys = [UserFavouritePokemon("john"), UserFavouritePokemon("john")]
+    cache.set(keys[0].namespace_key(), datetime(2018, 1, 3))
+    cache.set(keys[0], "pikachu")
+
+    seen = []
+    get_many_raw = cache.get_many_raw
+
+    def counting_get_many_raw(raw_keys):
+        seen.extend(raw_keys)
+        return get_many_raw(raw_keys)
+
+    cache.get_many_raw = counting_get_many_raw
+
+    assert cache.get_many(keys) == ["pikachu", "pikachu"]
+    assert len(seen) == len(set(seen))
+
+
+def test_invalidate_many_when_no_namespace(cache, caplog):
+    key = UserFavouritePokemon("john")
+
+    with caplog.at_level(logging.WARNING, logger="pyappcache.cache"):
+        cache.invalidate_many([key])
+        assert caplog.record_tuples == [
+            (
+                "pyappcache.cache",
+                30,
+                "unable to invalidate key as namespace does not exist",
+            )
+        ]
+
+
+def test_relaxed_namespace_resolution_reads_namespace_once(cache):
+    cache.namespace_ttl_seconds = 60
+    key = UserFavouritePokemon("john")
+    cache.set(key.namespace_key(), datetime(2018, 1, 3))
+    cache.set(key, "pikachu")
+
+    seen = []
+    get_raw = cache.get_raw
+
+    def counting_get_raw(raw_key):
+        seen.append(raw_key)
+        return get_raw(raw_key)
+
+    cache.get_raw = counting_get_raw
+
+    for _ in range(3):
+        assert cache.get(key) == "pikachu"
+    assert cache.get_many([key]) == ["pikachu"]
+    assert len([raw_key for raw_key in seen if "last_changed" in raw_key]) <= 1
+
+
+def test_relaxed_namespace_resolution_sees_local_changes(cache):
+    cache.namespace_ttl_seconds = 60
+    key = UserFavouritePokemon("john")
+
+    cache.set(key, "pikachu")
+    assert cache.get(key) is None
+
+    cache.set(key.namespace_key(), datetime(2018, 1, 3))
+    cache.set(key, "pikachu")
+    assert cache.get(key) == "pikachu"
+
+    cache.set(key.namespace_key(), datetime(2018, 1, 4))
+    assert cache.get(key) is None
+
+    cache.invalidate(key.namespace_key())
+    assert cache.get(key) is None
+
+
+def test_relaxed_namespace_resolution_sees_local_clear(cache):
+    cache.namespace_ttl_seconds = 60
+    key = UserFavouritePokemon("john")
+    cache.set(key.namespace_key(), datetime(2018, 1, 3))
+    cache.set(key, "pikachu")
+    assert cache.get(key) == "pikachu"
+
+    cache.clear()
+    cache.set(key, "pikachu")
+    assert cache.get(key) is None
+
+
+def test_relaxed_namespace_resolution_sees_local_clear_of_custom_cache():
+    """Test that a clear of a cache which only implements the abstract methods
+    also forgets namespaces"""
+    cache = DictCache()
+    cache.namespace_ttl_seconds = 60
+    key = UserFavouritePokemon("john")
+    cache.set(key.namespace_key(), datetime(2018, 1, 3))
+    cache.set(key, "pikachu")
+    assert cache.get(key) == "pikachu"
+
+    cache.clear()
+    cache.set(key, "pikachu")
+    assert cache.get(key) is None
+
+
+def test_relaxed_namespace_resolution_staleness_is_bounded(cache, monkeypatch):
+    cache.namespace_ttl_seconds = 10
+    key = UserFavouritePokemon("john")
+    monkeypatch.setattr("pyappcache.lru.monotonic", lambda: 100.0)
+    cache.set(key.namespace_key(), datetime(2018, 1, 3))
+    cache.set(key, "pikachu")
+    assert cache.get(key) == "pikachu"
+
+    # Simulate another process bumping the namespace
+    cache.set_raw(
+        build_raw_key(cache.prefix, key.namespace_key()),
+        PickleSerialiser().dump(datetime(2018, 1, 4)),
+        0,
+    )
+    assert cache.get(key) == "pikachu"
+
+    monkeypatch.setattr("pyappcache.lru.monotonic", lambda: 111.0)
+    assert cache.get(key) is None
+
+
+def test_namespace_cache_size(cache):
+    cache.namespace_ttl_seconds = 60
+    cache.namespace_cache_size = 1
+    assert cache.namespace_cache_size == 1
+    keys = [UserFavouritePokemon("john"), UserFavouritePokemon("paul")]
+    for key in keys:
+        cache.set(key.namespace_key(), datetime(2018, 1, 3))
+        cache.set(key, "pikachu")
+
+    assert cache.get_many(keys) == ["pikachu", "pikachu"]
+    assert len(cache._namespaces) == 1
@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+import time
+
+import pytest
+
+from pyappcache.singleflight import SingleFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight()
+    release = Event()
+    calls = 0
+
+    def slow():
+        nonlocal calls
+        calls += 1
+        release.wait()
+        return "ok"
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        futures = [executor.submit(flight.do, "a", slow) for _ in range(10)]
+        time.sleep(0.1)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == ["ok"] * 10
+    assert calls == 1
+
+
+def test_exceptions_propagate_to_waiters_but_are_not_remembered():
+    flight = SingleFlight()
+    release = Event()
+
+    def failing():
+        release.wait()
+        raise RuntimeError("db down")
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(flight.do, "a", failing) for _ in range(5)]
+        time.sleep(0.1)
+        release.set()
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result()
+
+    assert flight.do("a", lambda: "ok") == "ok"
+
+
+def test_waiter_timeout_uses_fallback():
+    flight = SingleFlight()
+    release = Event()
+
+    def slow():
+        release.wait()
+        return "slow"
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        leader = executor.submit(flight.do, "a", slow)
+        time.sleep(0.1)
+        assert flight.do("a", slow, timeout=0.01, fallback=lambda: "fast") == "fast"
+        release.set()
+        assert leader.result() == "slow"
+
+
+def test_waiter_timeout_without_fallback_calls_fn():
+    flight = SingleFlight()
+    release = Event()
+    calls = 0
+
+    def slow():
+        nonlocal calls
+        calls += 1
+        call = calls
+        if call == 1:
+            release.wait()
+        return call
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        leader = executor.submit(flight.do, "a", slow)
+        time.sleep(0.1)
+        assert flight.do("a", slow, timeout=0.01) == 2
+        release.set()
+        assert leader.result() == 1
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
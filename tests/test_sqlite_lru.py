@@ -1,11 +1,21 @@
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from datetime import datetime, timezone
 import contextlib
+import io
+import gc
 import sqlite3
+import time
+import tracemalloc
+import weakref
+from threading import Barrier, Event, Thread
 
 import pytest
 import time_machine
-from pyappcache.sqlite_lru import SqliteCache
-from .utils import StringToStringKey, random_string
+from pyappcache.keys import SimpleStringKey, build_raw_key
+from pyappcache.serialisation import PickleSerialiser
+from pyappcache.sqlite_lru import CREATE_DDL, SqliteCache, SCHEMA_VERSION, _BlobReader
+from .utils import StringToStringKey, random_string, wait_until
 
 
 @pytest.fixture(scope="function")
@@ -129,3 +139,631 @@ def test_sqlite3_eviction_via_last_read(random_conn):
 
         assert cache.get(key_b) is None
         assert cache.get(key_a) == "1"
+
+
+def test_sqlite3_migrates_datetime_schema(random_conn):
+    """Test that databases from before epoch timestamps are migrated"""
+    random_conn.execute(
+        "CREATE TABLE pyappcache"
+        " (key PRIMARY KEY, value NOT NULL, expiry NOT NULL, last_read NOT NULL);"
+    )
+    random_conn.execute("CREATE INDEX pyappcache_expiry ON pyappcache (expiry);")
+    rows = {
+        "expired": (datetime(2018, 1, 1), datetime(2017, 12, 31)),
+        "live": (datetime(2018, 1, 3), datetime(2018, 1, 2, 0, 0, 0, 500)),
+        "forever": ("-1", datetime(2018, 1, 2)),
+    }
+    for key_str, (expiry, last_read) in rows.items():
+        random_conn.execute(
+            "INSERT INTO pyappcache VALUES (?, ?, ?, ?);",
+            (
+                build_raw_key("pyappcache", StringToStringKey(key_str)),
+                PickleSerialiser().dump(key_str).read(),
+                expiry,
+                last_read,
+            ),
+        )
+    random_conn.commit()
+
+    with time_machine.travel(datetime(2018, 1, 2, 12)):
+        cache = SqliteCache(connection=random_conn)
+
+        assert cache.get(StringToStringKey("expired")) is None
+        assert cache.get(StringToStringKey("live")) == "live"
+        assert cache.get(StringToStringKey("forever")) == "forever"
+        live_raw_key = build_raw_key(cache.prefix, StringToStringKey("live"))
+        assert cache.ttl(live_raw_key) in (12 * 60 * 60 - 1, 12 * 60 * 60)
+
+    (version,) = random_conn.execute(
+        "SELECT version FROM pyappcache_schema;"
+    ).fetchone()
+    assert version == SCHEMA_VERSION
+
+
+def test_sqlite3_leaves_user_version_alone(random_conn):
+    """Test that an application's own database (and its user_version) can be
+    used, including one that needs migrating"""
+    random_conn.execute(
+        "CREATE TABLE pyappcache (key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+        " expiry REAL, last_read REAL NOT NULL);"
+    )
+    random_conn.execute("INSERT INTO pyappcache VALUES ('a', x'0102', NULL, 0);")
+    random_conn.execute("PRAGMA user_version = 7;")
+    random_conn.commit()
+
+    cache = SqliteCache(connection=random_conn)
+
+    assert cache.stats() == {"row_count": 1, "total_size_bytes": 2}
+    (user_version,) = random_conn.execute("PRAGMA user_version;").fetchone()
+    assert user_version == 7
+
+    # And isn't migrated again
+    SqliteCache(connection=random_conn)
+    assert cache.stats() == {"row_count": 1, "total_size_bytes": 2}
+
+
+def test_sqlite3_ttl_never_expires(random_conn):
+    cache = SqliteCache(connection=random_conn)
+    key = StringToStringKey("a")
+    cache.set(key, "b")
+
+    assert cache.ttl(build_raw_key(cache.prefix, key)) is None
+
+
+def exercise_concurrently(cache, threads=8, keys_per_thread=50):
+    barrier = Barrier(threads)
+
+    def worker(thread_no):
+        barrier.wait()
+        for i in range(keys_per_thread):
+            key = StringToStringKey(f"{thread_no}-{i}")
+            cache.set(key, str(i))
+            assert cache.get(key) == str(i)
+        return id(cache.conn)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return set(executor.map(worker, range(threads)))
+
+
+def test_sqlite3_pooled_file(tmp_path):
+    cache = SqliteCache(database=str(tmp_path / "cache.sqlite3"))
+
+    conn_ids = exercise_concurrently(cache)
+
+    assert len(conn_ids) == 8
+    (journal_mode,) = cache.conn.execute("PRAGMA journal_mode;").fetchone()
+    assert journal_mode == "wal"
+    cache.close()
+
+
+def test_sqlite3_pooled_file_shared_between_instances(tmp_path):
+    """Test that two caches (eg: in two processes) can share a file"""
+    path = str(tmp_path / "cache.sqlite3")
+    cache_a = SqliteCache(database=path)
+    cache_b = SqliteCache(database=path)
+
+    cache_a.set(StringToStringKey("a"), "b")
+
+    assert cache_b.get(StringToStringKey("a")) == "b"
+
+
+def test_sqlite3_pooled_memory():
+    cache = SqliteCache(database=":memory:")
+    other_cache = SqliteCache(database=":memory:")
+
+    conn_ids = exercise_concurrently(cache)
+
+    assert len(conn_ids) == 8
+    assert cache.get(StringToStringKey("0-0")) == "0"
+    assert other_cache.get(StringToStringKey("0-0")) is None
+
+
+@pytest.mark.parametrize("database", ["file", ":memory:"])
+def test_sqlite3_pooled_connections_closed_when_threads_end(tmp_path, database):
+    if database == "file":
+        database = str(tmp_path / "cache.sqlite3")
+    cache = SqliteCache(database=database)
+    cache.set(StringToStringKey("a"), "b")
+
+    def worker():
+        assert cache.get(StringToStringKey("a")) == "b"
+
+    for _ in range(50):
+        thread = Thread(target=worker)
+        thread.start()
+        thread.join()
+    gc.collect()
+
+    # Just this thread's
+    assert len(cache._pool) == 1
+    assert cache.get(StringToStringKey("a")) == "b"
+
+
+@pytest.mark.parametrize("database", ["file", ":memory:"])
+def test_sqlite3_pooled_connections_closed_when_cache_dropped(tmp_path, database):
+    if database == "file":
+        database = str(tmp_path / "cache.sqlite3")
+    cache = SqliteCache(database=database)
+    cache.set(StringToStringKey("a"), "b")
+    conn = cache.conn
+    cache_ref = weakref.ref(cache)
+
+    del cache
+    gc.collect()
+
+    assert cache_ref() is None
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1;")
+
+
+def test_sqlite3_close(tmp_path):
+    cache = SqliteCache(database=str(tmp_path / "cache.sqlite3"))
+    cache.set(StringToStringKey("a"), "b")
+    cache.close()
+
+    # New connections are opened as required
+    assert cache.get(StringToStringKey("a")) == "b"
+
+
+def test_sqlite3_connection_or_database(random_conn):
+    with pytest.raises(ValueError):
+        SqliteCache(connection=random_conn, database=":memory:")
+
+
+def test_sqlite3_buffered_touches_read_only(random_conn):
+    cache = SqliteCache(connection=random_conn, touch_interval_seconds=60)
+    key = StringToStringKey("a")
+    cache.set(key, "b")
+    changes_before = random_conn.total_changes
+
+    assert cache.get(key) == "b"
+    assert random_conn.total_changes == changes_before
+
+    cache.flush_touches()
+    assert random_conn.total_changes == changes_before + 1
+
+
+@pytest.mark.parametrize("database", [None, ":memory:", "file"])
+def test_sqlite3_buffered_touches_concurrent_reads_and_writes(tmp_path, database):
+    """Test that reads that don't touch (and so don't take the write lock) are
+    consistent with concurrent writes, whatever the connection mode"""
+    if database == "file":
+        database = str(tmp_path / "cache.sqlite3")
+    cache = SqliteCache(database=database, touch_interval_seconds=60)
+    cache.prefix = random_string()
+    keys = [StringToStringKey(str(i)) for i in range(10)]
+    stop = Event()
+
+    def writer():
+        n = 0
+        while not stop.is_set():
+            n += 1
+            for i, key in enumerate(keys):
+                cache.set(key, str(i) * (n % 50 + 1) * 100)
+            cache.invalidate(keys[n % len(keys)])
+
+    def reader():
+        for _ in range(200):
+            values = cache.get_many(keys)
+            for i, value in enumerate(values):
+                assert value is None or set(value) == {str(i)}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        writing = executor.submit(writer)
+        try:
+            for reading in [executor.submit(reader) for _ in range(3)]:
+                reading.result()
+        finally:
+            stop.set()
+        writing.result()
+    cache.close()
+
+
+def test_sqlite3_buffered_touches_still_lru(random_conn):
+    cache = SqliteCache(max_size=2, connection=random_conn, touch_interval_seconds=60)
+
+    with time_machine.travel(datetime(2018, 1, 3, 0)):
+        key_a = StringToStringKey("a")
+        cache.set(key_a, "1")
+
+    with time_machine.travel(datetime(2018, 1, 3, 1)):
+        key_b = StringToStringKey("b")
+        cache.set(key_b, "2")
+
+    with time_machine.travel(datetime(2018, 1, 3, 2)):
+        cache.get(key_a)
+
+    with time_machine.travel(datetime(2018, 1, 3, 3)):
+        key_c = StringToStringKey("c")
+        cache.set(key_c, "3")
+
+        assert cache.get(key_b) is None
+        assert cache.get(key_a) == "1"
+
+
+def test_sqlite3_buffered_touches_dont_go_backwards(random_conn):
+    cache = SqliteCache(connection=random_conn, touch_interval_seconds=60)
+    key = StringToStringKey("a")
+
+    with time_machine.travel(datetime(2018, 1, 3, 0, tzinfo=timezone.utc)):
+        cache.set(key, "1")
+        cache.get(key)
+
+    with time_machine.travel(datetime(2018, 1, 3, 1, tzinfo=timezone.utc)):
+        cache.set(key, "2")
+        cache.flush_touches()
+
+    ((last_read,),) = random_conn.execute("SELECT last_read FROM pyappcache;")
+    assert last_read == datetime(2018, 1, 3, 1, tzinfo=timezone.utc).timestamp()
+
+
+def test_sqlite3_buffered_touches_flushed_in_batches(random_conn):
+    cache = SqliteCache(connection=random_conn, touch_interval_seconds=60)
+    cache.touch_batch_size = 2
+    keys = [StringToStringKey(str(i)) for i in range(2)]
+    cache.set_many({key: "a" for key in keys})
+    changes_before = random_conn.total_changes
+
+    cache.get(keys[0])
+    assert random_conn.total_changes == changes_before
+    cache.get(keys[1])
+    assert random_conn.total_changes == changes_before + 2
+
+
+def test_sqlite3_buffered_touches_flushed_on_interval(random_conn):
+    cache = SqliteCache(connection=random_conn, touch_interval_seconds=0.01)
+    key = StringToStringKey("a")
+    cache.set(key, "b")
+    changes_before = random_conn.total_changes
+
+    time.sleep(0.02)
+    cache.get(key)
+    assert random_conn.total_changes == changes_before + 1
+
+
+def get_row_count(conn):
+    ((row_count,),) = conn.execute("SELECT row_count FROM pyappcache_totals;")
+    return row_count
+
+
+def test_sqlite3_row_count(random_conn):
+    cache = SqliteCache(connection=random_conn)
+    keys = [StringToStringKey(str(i)) for i in range(3)]
+
+    cache.set_many({key: "a" for key in keys})
+    assert get_row_count(random_conn) == 3
+
+    cache.set(keys[0], "b")
+    assert get_row_count(random_conn) == 3
+
+    cache.invalidate(keys[1])
+    assert get_row_count(random_conn) == 2
+
+    cache.clear()
+    assert get_row_count(random_conn) == 0
+
+
+def test_sqlite3_row_count_of_existing_db(random_conn):
+    SqliteCache(connection=random_conn).set(StringToStringKey("a"), "b")
+    random_conn.execute("DROP TABLE pyappcache_totals;")
+
+    SqliteCache(connection=random_conn)
+
+    assert get_row_count(random_conn) == 1
+
+
+def test_sqlite3_low_water_mark(random_conn):
+    cache = SqliteCache(max_size=10, connection=random_conn)
+    cache.low_water_mark = 5
+
+    for i in range(11):
+        with time_machine.travel(datetime(2018, 1, 3, i)):
+            cache.set(StringToStringKey(str(i)), "a")
+        if i == 9:
+            assert get_row_count(random_conn) == 10
+
+    assert get_row_count(random_conn) == 5
+    assert cache.get(StringToStringKey("5")) is None
+    assert cache.get(StringToStringKey("6")) == "a"
+
+
+def test_sqlite3_stats(random_conn):
+    cache = SqliteCache(connection=random_conn)
+    cache.set_raw("a", BytesIO(b"x" * 10), 0)
+    cache.set_raw("b", BytesIO(b"x" * 20), 0)
+    cache.set_raw("a", BytesIO(b"x" * 5), 0)
+
+    assert cache.stats() == {"row_count": 2, "total_size_bytes": 25}
+
+    cache.invalidate_raw("b")
+    assert cache.stats() == {"row_count": 1, "total_size_bytes": 5}
+
+
+def test_sqlite3_max_size_bytes(random_conn):
+    cache = SqliteCache(max_size=None, connection=random_conn, max_size_bytes=100)
+
+    with time_machine.travel(datetime(2018, 1, 3, 0)):
+        cache.set_raw("small", BytesIO(b"x" * 10), 0)
+    with time_machine.travel(datetime(2018, 1, 3, 1)):
+        cache.set_raw("big", BytesIO(b"x" * 80), 0)
+    with time_machine.travel(datetime(2018, 1, 3, 2)):
+        cache.set_raw("bigger", BytesIO(b"x" * 90), 0)
+
+    assert cache.get_raw("small") is None
+    assert cache.get_raw("big") is None
+    assert cache.stats() == {"row_count": 1, "total_size_bytes": 90}
+
+
+def test_sqlite3_value_bigger_than_max_size_bytes(random_conn, caplog):
+    cache = SqliteCache(max_size=None, connection=random_conn, max_size_bytes=100)
+    for i in range(5):
+        cache.set_raw(str(i), BytesIO(b"x" * 10), 0)
+    cache.set_raw("huge", BytesIO(b"x" * 10), 0)
+
+    cache.set_raw("huge", BytesIO(b"x" * 500), 0)
+
+    assert "unable to set huge" in caplog.text
+    assert cache.get_raw("huge") is None
+    assert cache.stats() == {"row_count": 5, "total_size_bytes": 50}
+
+
+def test_sqlite3_max_size_bytes_and_rows(random_conn):
+    cache = SqliteCache(max_size=2, connection=random_conn, max_size_bytes=1000)
+
+    for i in range(3):
+        with time_machine.travel(datetime(2018, 1, 3, i)):
+            cache.set_raw(str(i), BytesIO(b"x" * 10), 0)
+    assert cache.stats() == {"row_count": 2, "total_size_bytes": 20}
+
+    with time_machine.travel(datetime(2018, 1, 3, 3)):
+        cache.set_raw("3", BytesIO(b"x" * 995), 0)
+    assert cache.stats() == {"row_count": 1, "total_size_bytes": 995}
+
+
+def test_sqlite3_low_water_mark_bytes(random_conn):
+    cache = SqliteCache(max_size=None, connection=random_conn, max_size_bytes=1000)
+    cache.low_water_mark_bytes = 500
+
+    for i in range(4):
+        with time_machine.travel(datetime(2018, 1, 3, i)):
+            cache.set_raw(str(i), BytesIO(b"x" * 300), 0)
+
+    assert cache.stats() == {"row_count": 1, "total_size_bytes": 300}
+    assert cache.get_raw("3") is not None
+
+
+def test_sqlite3_migrates_from_v1(random_conn):
+    random_conn.execute(
+        "CREATE TABLE pyappcache (key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+        " expiry REAL, last_read REAL NOT NULL);"
+    )
+    random_conn.execute("INSERT INTO pyappcache VALUES ('a', x'0102', NULL, 0);")
+    random_conn.commit()
+
+    cache = SqliteCache(connection=random_conn)
+
+    assert cache.stats() == {"row_count": 1, "total_size_bytes": 2}
+    contents = cache.get_raw("a")
+    assert contents is not None
+    assert contents.read() == b"\x01\x02"
+
+
+def test_sqlite3_current_schema_without_version(random_conn):
+    """Test that a current table that predates pyappcache_schema isn't
+    migrated again"""
+    random_conn.execute(CREATE_DDL)
+    random_conn.execute("INSERT INTO pyappcache VALUES ('a', x'0102', NULL, 0, 2);")
+    random_conn.commit()
+
+    cache = SqliteCache(connection=random_conn)
+
+    assert cache.stats() == {"row_count": 1, "total_size_bytes": 2}
+
+
+def test_sqlite3_purge_expired(random_conn, monkeypatch):
+    monkeypatch.setattr("pyappcache.sqlite_lru.PURGE_BATCH_SIZE", 2)
+    cache = SqliteCache(connection=random_conn)
+    with time_machine.travel(datetime(2018, 1, 3)):
+        for i in range(5):
+            cache.set(StringToStringKey(f"expires-{i}"), "a", ttl_seconds=10)
+        cache.set(StringToStringKey("lives"), "a", ttl_seconds=36000)
+        cache.set(StringToStringKey("forever"), "a")
+
+    with time_machine.travel(datetime(2018, 1, 3, 1)):
+        assert cache.purge_expired() == 5
+        assert cache.purge_expired() == 0
+        assert cache.stats()["row_count"] == 2
+        assert cache.get(StringToStringKey("lives")) == "a"
+
+
+def test_sqlite3_purge_every_n_sets(random_conn):
+    cache = SqliteCache(connection=random_conn)
+    cache.purge_every_n_sets = 3
+    with time_machine.travel(datetime(2018, 1, 3)):
+        cache.set(StringToStringKey("a"), "a", ttl_seconds=10)
+
+    with time_machine.travel(datetime(2018, 1, 3, 1)):
+        cache.set(StringToStringKey("b"), "b")
+        assert cache.stats()["row_count"] == 2
+        cache.set(StringToStringKey("c"), "c")
+        assert cache.stats()["row_count"] == 2
+
+
+def test_sqlite3_snapshot_and_restore(random_conn, tmp_path):
+    path = tmp_path / "snapshot.sqlite3"
+    cache = SqliteCache(connection=random_conn)
+    with time_machine.travel(datetime(2018, 1, 3)):
+        cache.set(StringToStringKey("expires"), "a", ttl_seconds=10)
+        cache.set(StringToStringKey("lives"), "b", ttl_seconds=36000)
+        cache.set(StringToStringKey("forever"), "c")
+        cache.snapshot(path)
+
+    other_cache = SqliteCache(
+        connection=sqlite3.connect(f"file:{random_string()}?mode=memory&cache=shared")
+    )
+    other_cache.set(StringToStringKey("forever"), "old")
+    # Not overwritten, as the snapshot's copy has expired
+    other_cache.set(StringToStringKey("expires"), "live")
+    with time_machine.travel(datetime(2018, 1, 3, 1)):
+        assert other_cache.restore(path) == 2
+
+        assert other_cache.get(StringToStringKey("expires")) == "live"
+        assert other_cache.get(StringToStringKey("lives")) == "b"
+        assert other_cache.get(StringToStringKey("forever")) == "c"
+        assert other_cache.stats()["row_count"] == 3
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_sqlite3_restore_wrong_version(random_conn, tmp_path):
+    path = tmp_path / "snapshot.sqlite3"
+    with contextlib.closing(sqlite3.connect(str(path))) as conn:
+        conn.execute(
+            "CREATE TABLE pyappcache (key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+            " expiry REAL, last_read REAL NOT NULL);"
+        )
+    cache = SqliteCache(connection=random_conn)
+
+    assert cache.restore(path) == 0
+
+
+def test_sqlite3_restore_not_a_snapshot(random_conn, tmp_path):
+    path = tmp_path / "snapshot.sqlite3"
+    with contextlib.closing(sqlite3.connect(str(path))) as conn:
+        conn.execute("CREATE TABLE something_else (a);")
+    cache = SqliteCache(connection=random_conn)
+
+    assert cache.restore(path) == 0
+
+
+def test_sqlite3_auto_snapshot(tmp_path):
+    path = tmp_path / "snapshot.sqlite3"
+    cache = SqliteCache(database=":memory:")
+    cache.set(StringToStringKey("a"), "b")
+    cache.auto_snapshot(path, interval_seconds=0.01)
+    wait_until(path.exists)
+    cache.close()
+
+    other_cache = SqliteCache(database=":memory:")
+    other_cache.auto_snapshot(path)
+    assert other_cache.get(StringToStringKey("a")) == "b"
+    other_cache.close()
+
+
+def test_sqlite3_auto_snapshot_failure(tmp_path, caplog):
+    cache = SqliteCache(database=":memory:")
+
+    cache._auto_snapshot(tmp_path / "missing-dir" / "snapshot.sqlite3")
+
+    assert "unable to snapshot" in caplog.text
+
+
+requires_blobopen = pytest.mark.skipif(
+    not hasattr(sqlite3.Connection, "blobopen"), reason="needs Python 3.11+"
+)
+
+
+@requires_blobopen
+def test_sqlite3_stream_reads(tmp_path):
+    cache = SqliteCache(database=str(tmp_path / "cache.sqlite3"), stream_reads=True)
+    value = b"first line\nsecond line\n" + random_string(10_000).encode("utf-8")
+    cache.set_raw("a", BytesIO(value), 0)
+
+    stream = cache.get_raw("a")
+    assert stream is not None
+    assert not isinstance(stream, BytesIO)
+    assert stream.readline() == b"first line\n"
+    assert stream.read(6) == b"second"
+    stream.seek(0)
+    assert stream.read() == value
+    stream.close()
+
+    cache.set(StringToStringKey("b"), "c")
+    assert cache.get(StringToStringKey("b")) == "c"
+
+
+@requires_blobopen
+@pytest.mark.parametrize("touch_interval_seconds", [0, 60])
+def test_sqlite3_stream_reads_with_other_threads(tmp_path, touch_interval_seconds):
+    cache = SqliteCache(
+        database=str(tmp_path / "cache.sqlite3"),
+        stream_reads=True,
+        touch_interval_seconds=touch_interval_seconds,
+    )
+    value = random_string(100_000).encode("utf-8")
+    cache.set_raw("a", BytesIO(value), 0)
+
+    stream = cache.get_raw("a")
+    assert stream is not None
+    assert stream.read(10) == value[:10]
+
+    def read_and_write():
+        other_stream = cache.get_raw("a")
+        assert other_stream is not None
+        assert other_stream.read() == value
+        other_stream.close()
+        cache.set_raw("a", BytesIO(b"new"), 0)
+        cache.set_raw("b", BytesIO(b"c"), 0)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(read_and_write).result()
+
+    assert stream.read() == value[10:]
+    stream.close()
+    new_stream = cache.get_raw("a")
+    assert new_stream is not None
+    assert new_stream.read() == b"new"
+    new_stream.close()
+
+
+@pytest.mark.parametrize("database", [None, ":memory:"])
+def test_sqlite3_stream_reads_needs_database_file(database):
+    with pytest.raises(ValueError):
+        SqliteCache(database=database, stream_reads=True)
+
+
+def test_sqlite3_stream_reads_needs_database_not_connection(random_conn):
+    with pytest.raises(ValueError):
+        SqliteCache(connection=random_conn, stream_reads=True)
+
+
+def test_sqlite3_blob_reader(monkeypatch):
+    # BytesIO has the same read/seek/tell/close as sqlite3.Blob
+    monkeypatch.setattr(_BlobReader, "CHUNK_SIZE", 4)
+    value = b"first line\nsecond line\n" + random_string(100).encode("utf-8")
+    stream = io.BufferedReader(_BlobReader(BytesIO(value)), buffer_size=8)
+
+    assert stream.readline() == b"first line\n"
+    assert stream.read(3) == b"sec"
+    assert stream.read(5) == b"ond l"
+    assert stream.seek(-10, io.SEEK_END) == len(value) - 10
+    assert stream.read() == value[-10:]
+    assert stream.read() == b""
+    stream.seek(0)
+    assert stream.read() == value
+
+    stream.close()
+    stream.close()
+    with pytest.raises(ValueError):
+        stream.read()
+
+
+@requires_blobopen
+def test_sqlite3_stream_reads_peak_memory(tmp_path):
+    size = 20 * 1024 * 1024
+    key = SimpleStringKey[bytes]("big")
+
+    def peak_memory_of_get(cache):
+        tracemalloc.start()
+        try:
+            assert len(cache.get(key)) == size
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    database = str(tmp_path / "cache.sqlite3")
+    SqliteCache(database=database).set(key, b"x" * size)
+    copying = peak_memory_of_get(SqliteCache(database=database))
+    streaming = peak_memory_of_get(SqliteCache(database=database, stream_reads=True))
+
+    assert copying > size * 1.9
+    assert streaming < size * 1.2
@@ -0,0 +1,109 @@
+import sqlite3
+from typing import List
+
+import pytest
+
+from pyappcache.keys import SimpleStringKey
+from pyappcache.sqlite_lru import SqliteCache
+from pyappcache.tiered import TieredCache
+from .utils import StringToStringKey, random_string
+
+
+@pytest.fixture(scope="function")
+def l2():
+    conn = sqlite3.connect(f"file:{random_string()}?mode=memory&cache=shared")
+    return SqliteCache(connection=conn)
+
+
+def test_l1_hit_skips_l2(l2):
+    cache = TieredCache(l2)
+    key = StringToStringKey("a")
+    cache.set(key, "b")
+
+    l2.clear()
+    assert cache.get(key) == "b"
+    assert cache.stats() == {"l1_hits": 1, "l1_misses": 0, "l2_hits": 0, "l2_misses": 0}
+
+
+def test_l2_hit_populates_l1(l2):
+    cache = TieredCache(l2)
+    key = StringToStringKey("a")
+    l2.set(key, "b")
+
+    assert cache.get(key) == "b"
+    assert cache.get(key) == "b"
+    assert cache.get(StringToStringKey("c")) is None
+    assert cache.stats() == {"l1_hits": 1, "l1_misses": 2, "l2_hits": 1, "l2_misses": 1}
+
+
+def test_l1_returns_same_object(l2):
+    cache = TieredCache(l2)
+    key = SimpleStringKey[List[str]]("a")
+    value = ["b"]
+    cache.set(key, value)
+
+    assert cache.get(key) is value
+
+
+def test_invalidate_goes_to_both_tiers(l2):
+    cache = TieredCache(l2)
+    key = StringToStringKey("a")
+    cache.set(key, "b")
+    cache.invalidate(key)
+
+    assert cache.get(key) is None
+    assert l2.get(key) is None
+
+
+def test_l1_max_size(l2):
+    cache = TieredCache(l2, l1_max_size=2)
+    keys = [StringToStringKey(str(i)) for i in range(3)]
+    for key in keys:
+        cache.set(key, "b")
+    l2.clear()
+
+    assert cache.get_many(keys) == [None, "b", "b"]
+    assert cache.l1_max_size == 2
+
+    cache.l1_max_size = 1
+    cache.set(keys[0], "b")
+    l2.clear()
+    assert cache.get_many(keys) == ["b", None, None]
+
+
+def test_l1_ttl_cap(l2, monkeypatch):
+    cache = TieredCache(l2, l1_ttl_seconds=10)
+    key = StringToStringKey("a")
+    monkeypatch.setattr("pyappcache.lru.monotonic", lambda: 100.0)
+    cache.set(key, "b", ttl_seconds=3600)
+    l2.set(key, "c")
+
+    monkeypatch.setattr("pyappcache.lru.monotonic", lambda: 111.0)
+    assert cache.get(key) == "c"
+
+
+def test_l2_ttl_cap(l2):
+    cache = TieredCache(l2, l2_max_ttl_seconds=100)
+    cache.set(StringToStringKey("a"), "b")
+    cache.set(StringToStringKey("c"), "d", ttl_seconds=1000)
+
+    assert 0 < l2.ttl(f"{cache.prefix}/a") <= 100
+    assert 0 < l2.ttl(f"{cache.prefix}/c") <= 100
+
+
+def test_set_many_drops_l1_entries(l2):
+    cache = TieredCache(l2)
+    key = StringToStringKey("a")
+    cache.set(key, "b")
+    cache.set_many({key: "c"})
+
+    assert cache.get(key) == "c"
+    assert cache.l1_misses == 1
+
+
+def test_get_many_raw_goes_to_l2(l2):
+    cache = TieredCache(l2)
+    cache.set(StringToStringKey("a"), "b")
+    l2.clear()
+
+    assert cache.get_many_raw([f"{cache.prefix}/a"]) == [None]
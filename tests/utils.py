@@ -1,11 +1,14 @@
-from typing import Optional
+from io import BytesIO
+from typing import IO, Callable, Dict, Optional
 import re
 import random
 import string
 import socket
+import time
 from datetime import datetime, timedelta
 from logging import getLogger
 
+from pyappcache.cache import Cache
 from pyappcache.keys import SimpleStringKey
 
 logger = getLogger(__name__)
@@ -19,6 +22,28 @@ class StringToStringKeyWithCompression(StringToStringKey):
         return True
 
 
+class DictCache(Cache):
+    """The least a cache has to implement, so that the default
+    implementations of everything else get tested.  Ignores TTLs."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._values: Dict[str, bytes] = {}
+
+    def get_raw(self, key_str: str) -> Optional[IO[bytes]]:
+        value = self._values.get(key_str)
+        return BytesIO(value) if value is not None else None
+
+    def set_raw(self, key_str: str, value_bytes: IO[bytes], ttl_seconds: int) -> None:
+        self._values[key_str] = value_bytes.read()
+
+    def invalidate_raw(self, key_str: str) -> None:
+        self._values.pop(key_str, None)
+
+    def clear_raw(self) -> None:
+        self._values.clear()
+
+
 def random_string(n: int = 32) -> str:
     return "".join(random.choice(string.ascii_lowercase) for _ in range(n))
 
@@ -65,3 +90,12 @@ def get_memcache_ttl(key: str) -> Optional[int]:
                 return ttl
         attempt += 1
     return None
+
+
+def wait_until(predicate: Callable[[], bool], timeout: float = 5) -> None:
+    """Poll predicate until it's true, for things that happen on a background
+    thread."""
+    give_up_at = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < give_up_at, "timed out"
+        time.sleep(0.01)